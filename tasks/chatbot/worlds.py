@@ -2,6 +2,9 @@ from parlai.core.agents import create_agent_from_shared
 from parlai.core.worlds import World
 from parlai.chat_service.services.messenger.worlds import OnboardWorld
 
+from telegram.core.metrics import MODEL_INFERENCE_SECONDS
+from telegram.core.profiling import profile_section
+
 
 # ---------- Chatbot demo ---------- #
 class TelegramBotOnboardWorld(OnboardWorld):
@@ -36,21 +39,29 @@ class TelegramBotChatTaskWorld(World):
     MAX_AGENTS = 1
     MODEL_KEY = 'blender_90M'
 
-    def __init__(self, opt, agent, bot):
+    def __init__(self, opt, agent, bot, scheduler=None):
         self.agent = agent
         self.episodeDone = False
         self.model = bot
+        self.scheduler = scheduler
 
     @staticmethod
     def generate_world(opt, agents):
         if opt['models'] is None:
             raise RuntimeError("Model must be specified")
+        models = opt['shared_bot_params']
+        if hasattr(models, 'is_ready') and not models.is_ready(TelegramBotChatTaskWorld.MODEL_KEY):
+            agents[0].observe({
+                'id': 'System',
+                'text': 'The bot is still warming up, it will answer in a moment.'
+            })
         return TelegramBotChatTaskWorld(
             opt,
             agents[0],
             create_agent_from_shared(
                 opt['shared_bot_params'][TelegramBotChatTaskWorld.MODEL_KEY]
             ),
+            opt.get('inference_schedulers', {}).get(TelegramBotChatTaskWorld.MODEL_KEY),
         )
 
     @staticmethod
@@ -58,7 +69,7 @@ class TelegramBotChatTaskWorld(World):
         agents[0].disp_id = 'TelegramAgent'
 
     def parley(self):
-        a = self.agent.act()
+        a = self.agent.act(blocking=True)
         if a is not None:
             if a['text'][:1] == '/':
                 if '/done' in a['text']:
@@ -78,14 +89,43 @@ class TelegramBotChatTaskWorld(World):
                     })
             else:
                 print(f"Agent act: {a}")
-                self.model.observe(a)
-                response = self.model.act()
+                with MODEL_INFERENCE_SECONDS.time(model=self.MODEL_KEY):
+                    if self.scheduler is not None:
+                        response = self.scheduler.act(self.model, a)
+                    else:
+                        with profile_section(f'model:{self.MODEL_KEY}'):
+                            self.model.observe(a)
+                            response = self.model.act()
                 print(f"Model response: {response}")
                 self.agent.observe(response)
 
     def episode_done(self):
         return self.episodeDone
 
+    def get_state(self):
+        """
+        Dialogue history of the model, saved so the chat goes on after a restart.
+        """
+        history = getattr(self.model, 'history', None)
+        if history is None:
+            return None
+        return {
+            'history_strings': list(history.history_strings),
+            'history_raw_strings': list(history.history_raw_strings),
+        }
+
+    def set_state(self, state):
+        """
+        Continue the dialogue history saved by get_state.
+        """
+        history = getattr(self.model, 'history', None)
+        if not state or history is None:
+            return
+        history.reset()
+        history.history_strings = list(state['history_strings'])
+        history.history_raw_strings = list(state['history_raw_strings'])
+        history.history_vecs = [history.parse(text) for text in history.history_strings]
+
     def shutdown(self):
         self.agent.shutdown()
 
@@ -124,7 +164,7 @@ class TelegramOverworld(World):
                 }
             )
             self.first_time = False
-        a = self.agent.act()
+        a = self.agent.act(blocking=True)
         if a is not None:
             if a['text'] == '/exit':
                 self.episodeDone = True
@@ -1,7 +1,8 @@
-from parlai.core.agents import create_agent_from_shared
 from parlai.core.worlds import World
 from parlai.chat_service.services.messenger.worlds import OnboardWorld
 
+from telegram.agents import AgentSelector
+
 
 # ---------- Echo demo ---------- #
 class TelegramEchoOnboardWorld(OnboardWorld):
@@ -50,7 +51,7 @@ class TelegramEchoTaskWorld(World):
         agents[0].disp_id = 'EchoAgent'
 
     def parley(self):
-        a = self.agent.act()
+        a = self.agent.act(blocking=True)
         if a is not None:
             if '/done' in a['text']:
                 self.episodeDone = True
@@ -76,6 +77,8 @@ class TelegramOnboardDataOnboardWorld(OnboardWorld):
         super().__init__(opt, agent)
         self.turn = 0
         self.data = {}
+        # Whether the question of the current turn was asked
+        self.asked = False
 
     @staticmethod
     def generate_world(opt, agents):
@@ -88,25 +91,31 @@ class TelegramOnboardDataOnboardWorld(OnboardWorld):
 
     def parley(self):
         if self.turn == 0:
-            self.agent.observe(
-                {
-                    'id': 'Onboarding',
-                    'text': 'Welcome to the onboarding world the onboarding '
-                    'data demo.\nEnter your name.',
-                }
-            )
-            a = self.agent.act()
-            while a is None:
-                a = self.agent.act()
+            if not self.asked:
+                self.agent.observe(
+                    {
+                        'id': 'Onboarding',
+                        'text': 'Welcome to the onboarding world the onboarding '
+                        'data demo.\nEnter your name.',
+                    }
+                )
+                self.asked = True
+            a = self.agent.act(blocking=True)
+            if a is None:
+                # Asked again on the next parley, once the user answered
+                return
             self.data['name'] = a['text']
             self.turn = self.turn + 1
+            self.asked = False
         elif self.turn == 1:
-            self.agent.observe(
-                {'id': 'Onboarding', 'text': '\nEnter your favorite color.'}
-            )
-            a = self.agent.act()
-            while a is None:
-                a = self.agent.act()
+            if not self.asked:
+                self.agent.observe(
+                    {'id': 'Onboarding', 'text': '\nEnter your favorite color.'}
+                )
+                self.asked = True
+            a = self.agent.act(blocking=True)
+            if a is None:
+                return
             self.data['color'] = a['text']
             self.episodeDone = True
 
@@ -160,6 +169,8 @@ class TelegramChatOnboardWorld(OnboardWorld):
         super().__init__(opt, agent)
         self.turn = 0
         self.data = {}
+        # Whether the display name was asked for
+        self.asked = False
 
     @staticmethod
     def generate_world(opt, agents):
@@ -172,16 +183,19 @@ class TelegramChatOnboardWorld(OnboardWorld):
 
     def parley(self):
         if self.turn == 0:
-            self.agent.observe(
-                {
-                    'id': 'Onboarding',
-                    'text': 'Welcome to the onboarding world free chat. '
-                    'Enter your display name.',
-                }
-            )
-            a = self.agent.act()
-            while a is None:
-                a = self.agent.act()
+            if not self.asked:
+                self.agent.observe(
+                    {
+                        'id': 'Onboarding',
+                        'text': 'Welcome to the onboarding world free chat. '
+                        'Enter your display name.',
+                    }
+                )
+                self.asked = True
+            a = self.agent.act(blocking=True)
+            if a is None:
+                # The world runner parleys again once the user answered
+                return
             self.data['user_name'] = a['text']
             self.turn = self.turn + 1
         elif self.turn == 1:
@@ -205,6 +219,7 @@ class TelegramChatTaskWorld(World):
     def __init__(self, opt, agents):
         self.agents = agents
         self.episodeDone = False
+        self.selector = AgentSelector(agents)
 
     @staticmethod
     def generate_world(opt, agents):
@@ -216,22 +231,22 @@ class TelegramChatTaskWorld(World):
             a.disp_id = 'Agent'
 
     def parley(self):
-        for x in [0, 1]:
-            a = self.agents[x].act()
-            if a is not None:
-                if '/done' in a['text']:
-                    self.agents[x - 1].observe({
-                        'id': 'World',
-                        'text': 'The other agent has ended the chat.'
-                    })
-                    self.episodeDone = True
-                else:
-                    self.agents[x - 1].observe(a)
+        x, a = self.selector.act(blocking=True)
+        if a is not None:
+            if '/done' in a['text']:
+                self.agents[x - 1].observe({
+                    'id': 'World',
+                    'text': 'The other agent has ended the chat.'
+                })
+                self.episodeDone = True
+            else:
+                self.agents[x - 1].observe(a)
 
     def episode_done(self):
         return self.episodeDone
 
     def shutdown(self):
+        self.selector.close()
         for agent in self.agents:
             agent.shutdown()
 
@@ -273,7 +288,7 @@ class TelegramOverworld(World):
                 }
             )
             self.first_time = False
-        a = self.agent.act()
+        a = self.agent.act(blocking=True)
         if a is not None:
             if a['text'][1:] in self.demos:
                 self.agent.observe({
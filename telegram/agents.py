@@ -1,8 +1,21 @@
+import logging
+import queue
+import threading
 import time
+from collections import deque
 
+import parlai.chat_service.utils.logging as log_utils
 from parlai.chat_service.core.agents import ChatServiceAgent
 from parlai.core.message import Message
 
+from telegram.core.dedup import PacketRecord, RecentPackets
+from telegram.core.metrics import AGENT_QUEUE_WAIT_SECONDS
+from telegram.core.profiling import profiled
+
+DEFAULT_DEDUP_WINDOW = 256
+# Longest act_blocking sleeps at once before checking for shutdown
+ACT_BLOCKING_SLICE = 1.0
+
 
 class TelegramAgent(ChatServiceAgent):
     """
@@ -11,6 +24,47 @@ class TelegramAgent(ChatServiceAgent):
     def __init__(self, opt, manager, receiver_id, task_id):
         super().__init__(opt, manager, receiver_id, task_id)
         self.disp_id = 'TelegramUser'
+        # Only the recent message ids are needed to drop duplicates
+        dedup_window = opt.get('dedup_window', DEFAULT_DEDUP_WINDOW)
+        self.acted_packets = RecentPackets(dedup_window)
+        self.observed_packets = RecentPackets(dedup_window)
+        self._message_listeners = []
+        # Time every message in msg_queue was queued at, in the same order
+        self._queued_at = deque()
+        # Seconds act(blocking=True) may wait for a message, set by the runtime
+        self.act_wait = getattr(manager, 'act_wait', 0.0)
+        # Last saved state of the world this agent is in, see SessionStore
+        self.world_state = None
+        # When the chat last sent a message, idle conversations are evicted
+        self.last_message_time = time.monotonic()
+
+    def add_message_listener(self, callback):
+        """
+        Call callback(agent) whenever a new message is queued for this agent.
+        """
+        self._message_listeners.append(callback)
+
+    def remove_message_listener(self, callback):
+        if callback in self._message_listeners:
+            self._message_listeners.remove(callback)
+
+    def get_new_act_message(self, wait: float = 0.0):
+        """
+        Get a new act message if one exists, return None otherwise.
+
+        :param wait:
+            seconds to wait for a message if none is queued yet
+        """
+        try:
+            if wait > 0:
+                msg = self.msg_queue.get(timeout=wait)
+            else:
+                msg = self.msg_queue.get_nowait()
+        except queue.Empty:
+            return None
+        if self._queued_at:
+            AGENT_QUEUE_WAIT_SECONDS.observe(time.monotonic() - self._queued_at.popleft())
+        return msg
 
     def _is_image_attempt(self, message):
         img_attempt = False
@@ -20,12 +74,23 @@ class TelegramAgent(ChatServiceAgent):
             img_attempt = True
         return img_attempt
 
-    def act(self, timeout=None):
+    @profiled('agent.act')
+    def act(self, timeout=None, blocking: bool = False):
         """
         Pulls a message from the message queue.
 
         If none exist returns None unless the timeout has expired.
+
+        :param timeout:
+            seconds without a message after which the agent is marked inactive
+        :param blocking:
+            wait up to ``act_wait`` seconds for a message instead of returning
+            None right away. The world runner keeps control, as the wait is
+            short and ends at the timeout.
         """
+        return self._act(timeout, self.act_wait if blocking else 0.0)
+
+    def _act(self, timeout, wait: float):
         # if this is the first act since last sent message start timing
         if self.message_request_time is None:
             self.message_request_time = time.time()
@@ -36,7 +101,11 @@ class TelegramAgent(ChatServiceAgent):
             if time.time() - self.message_request_time > timeout:
                 return self.mark_inactive()
 
-        msg = self.get_new_act_message()
+        if wait > 0 and timeout:
+            wait = min(wait, self.message_request_time + timeout - time.time())
+        msg = self.get_new_act_message(wait)
+        if msg is None and wait > 0 and self._check_timeout(timeout):
+            return self.mark_inactive()
 
         if msg is not None:
             if msg.get('img_attempt') and not self.data.get('allow_images', False):
@@ -65,28 +134,80 @@ class TelegramAgent(ChatServiceAgent):
 
         return msg
 
+    def act_blocking(self, timeout=None):
+        """
+        Wait until a message arrives and return it.
+
+        Returns None once timeout expired without a message, or when the
+        manager shuts down.
+        """
+        while not self.manager.shutting_down:
+            if self.message_request_time is None:
+                self.message_request_time = time.time()
+            if self._check_timeout(timeout):
+                return None
+            msg = self._act(timeout, ACT_BLOCKING_SLICE)
+            if msg is not None:
+                return msg
+        return None
+
     def mark_inactive(self):
         # some kind of behavior to send a message when a user is marked as
         # being inactive. Could be useful. Should return a message to be sent
         pass
 
+    @profiled('agent.observe')
     def observe(self, act):  # TODO Need to check it
         """
         Send an agent a message through the manager.
+
+        If act has a ``text_stream`` (an iterable of text pieces, e.g. tokens of a
+        reply still being generated), the reply is shown and updated while the
+        pieces arrive.
         """
+        if act.get('text_stream') is not None:
+            self._observe_stream(act['text_stream'])
+            return
         msg = act['text']
-        resp = self.manager.observe_message(
+        future = self.manager.observe_message_async(
             self.id,
             msg,
             act.get('quick_replies', None),
             act.get('persona_id', None),
         )
-        try:
-            mid = resp['message_id']
-            if mid not in self.observed_packets:
-                self.observed_packets[mid] = act
-        except Exception:
-            print(f'{resp} could not be extracted to an observed message.')
+
+        def _on_sent(fut):
+            if fut.cancelled():
+                return
+            if fut.exception() is not None:
+                log_utils.print_and_log(
+                    logging.WARN,
+                    f'Message to {self.id} was not delivered: {repr(fut.exception())}',
+                )
+                return
+            resp = fut.result()
+            try:
+                mid = resp['message_id']
+                if mid not in self.observed_packets:
+                    self.observed_packets[mid] = PacketRecord.now(mid)
+            except Exception:
+                print(f'{resp} could not be extracted to an observed message.')
+
+        future.add_done_callback(_on_sent)
+
+    def _observe_stream(self, text_stream):
+        reply = self.manager.observe_message_stream(self.id)
+        for piece in text_stream:
+            reply.append(piece)
+
+        def _on_sent(fut):
+            if fut.cancelled() or fut.exception() is not None:
+                return
+            for message in reply.messages:
+                mid = message['message_id']
+                self.observed_packets[mid] = PacketRecord.now(mid)
+
+        reply.finish().add_done_callback(_on_sent)
 
     def put_data(self, message):
         """
@@ -99,11 +220,90 @@ class TelegramAgent(ChatServiceAgent):
         recipient = message['recipient'].get('id', None)
         img_attempt = self._is_image_attempt(message)
         if mid not in self.acted_packets:
-            self.acted_packets[mid] = {'mid': mid, 'text': text}
+            self.acted_packets[mid] = PacketRecord.now(mid)
             action = {
                 'episode_done': False,
                 'text': text,
                 'id': recipient,
                 'img_attempt': img_attempt
             }
-            self.msg_queue.put(action)
+            self._queue_action(action, time.monotonic())
+
+    def _queue_action(self, action, queued_at: float):
+        self.last_message_time = queued_at
+        self._queued_at.append(queued_at)
+        self.msg_queue.put(action)
+        for listener in list(self._message_listeners):
+            listener(self)
+
+    def hand_over_messages(self, agent):
+        """
+        Move the messages still queued for this agent to the queue of agent.
+        """
+        while True:
+            try:
+                action = self.msg_queue.get_nowait()
+            except queue.Empty:
+                return
+            queued_at = self._queued_at.popleft() if self._queued_at else time.monotonic()
+            agent._queue_action(action, queued_at)
+
+
+class AgentSelector:
+    """
+    Waits on the message queues of several agents at once.
+
+    For worlds with more than one user: instead of polling every agent in turn,
+    ``act`` returns the message of whichever agent spoke first, waking up as
+    soon as one of them gets a message. Agents are scanned round-robin, so a
+    chatty user cannot starve the others.
+    """
+
+    def __init__(self, agents):
+        """
+        :param agents:
+            TelegramAgents to wait on
+        """
+        self.agents = list(agents)
+        self._next = 0
+        self._ready = threading.Event()
+        for agent in self.agents:
+            agent.add_message_listener(self._on_message)
+
+    def _on_message(self, agent):
+        self._ready.set()
+
+    def act(self, timeout=None, blocking: bool = False):
+        """
+        Return the next message of any of the agents.
+
+        :param timeout:
+            passed to the ``act`` of every agent
+        :param blocking:
+            wait up to ``act_wait`` seconds for a message, like
+            ``TelegramAgent.act``
+        :return:
+            (index of the agent, message), or (None, None) if none spoke
+        """
+        wait = min(agent.act_wait for agent in self.agents) if blocking else 0.0
+        deadline = time.monotonic() + wait
+        while True:
+            # Cleared before scanning, so a message arriving meanwhile ends the wait
+            self._ready.clear()
+            for offset in range(len(self.agents)):
+                index = (self._next + offset) % len(self.agents)
+                msg = self.agents[index].act(timeout)
+                if msg is not None:
+                    self._next = index + 1
+                    return index, msg
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, None
+            self._ready.wait(remaining)
+
+    def close(self):
+        """
+        Stop listening to the agents.
+        """
+        for agent in self.agents:
+            agent.remove_message_listener(self._on_message)
@@ -0,0 +1,6 @@
+"""
+Benchmark tools: a fake Bot API server and a load generator.
+
+Run ``python -m telegram.bench --config-path tasks/chatbot/config.yml`` to
+measure throughput and latency of a task without a bot token or internet access.
+"""
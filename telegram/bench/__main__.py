@@ -0,0 +1,168 @@
+import os
+import tempfile
+import threading
+
+import parlai.chat_service.utils.config as config_utils
+
+from telegram.bench.fake_api import FakeBotAPI
+from telegram.bench.loadgen import LoadGenerator, SocketDelivery, WebhookDelivery
+from telegram.parser import Parser
+from telegram.telegram_manager import INGEST_WEBHOOK, TelegramManager
+
+SERVICE_NAME = 'telegram'
+
+# Messages that bring a fresh user from the overworld into the task world
+SETUP_COMMANDS = {
+    'chatbot': ['hi', '/begin'],
+    'overworld_demo': ['hi', '/echo'],
+}
+
+
+class BenchmarkManager(TelegramManager):
+    """
+    TelegramManager talking to the fake Bot API instead of Telegram.
+    """
+
+    def get_app_token(self):
+        return 'bench-token'
+
+    def in_task_world(self, agent_id) -> bool:
+        """
+        Return whether the agent's messages currently go to a task world.
+        """
+        agent_state = self.get_agent_state(agent_id)
+        if agent_state is None:
+            return False
+        agent = agent_state.get_active_agent()
+        return agent is not None and agent.task_id.startswith('t_')
+
+    def setup_socket(self):
+        if self.opt['bench_delivery'] == 'socket':
+            # Updates are handed to _receive_update by the load generator
+            self._setup_sender()
+            if self.opt['shards'] > 1:
+                self._setup_shards()
+            self._setup_ingress()
+        else:
+            super().setup_socket()
+
+
+def add_bench_args(parser):
+    bench = parser.add_argument_group('Telegram Benchmark')
+    bench.add_argument(
+        '--bench-users', dest='bench_users', type=int, default=100,
+        help='number of simulated Telegram users',
+    )
+    bench.add_argument(
+        '--bench-messages', dest='bench_messages', type=int, default=5,
+        help='number of measured messages every user sends',
+    )
+    bench.add_argument(
+        '--bench-concurrency', dest='bench_concurrency', type=int, default=100,
+        help='maximum number of users talking at the same time',
+    )
+    bench.add_argument(
+        '--bench-delivery', dest='bench_delivery', choices=['webhook', 'socket'],
+        default='webhook',
+        help='deliver updates over HTTP to the in-process webhook receiver, or '
+             'from one listener thread like the relay socket does',
+    )
+    bench.add_argument(
+        '--bench-setup-commands', dest='bench_setup_commands', type=str, default=None,
+        help='comma separated messages that bring a user into the task world, '
+             'defaults to the ones of the bundled tasks',
+    )
+    bench.add_argument(
+        '--bench-exit-command', dest='bench_exit_command', type=str, default='/done',
+        help='message sent by every user after the measured ones',
+    )
+    bench.add_argument(
+        '--bench-settle-time', dest='bench_settle_time', type=float, default=1.0,
+        help='seconds without bot messages after which a setup command is done. '
+             'With --shards the conversations live in the workers, so this is '
+             'also how long users wait for their task world to start',
+    )
+    bench.add_argument(
+        '--bench-reply-timeout', dest='bench_reply_timeout', type=float, default=60,
+        help='seconds to wait for a reply before counting a timeout',
+    )
+    bench.add_argument(
+        '--api-latency', dest='api_latency', type=float, default=0.0,
+        help='seconds every call to the fake Bot API takes',
+    )
+    bench.add_argument(
+        '--api-flood-rate', dest='api_flood_rate', type=float, default=0.0,
+        help='probability that the fake Bot API refuses a sendMessage with a 429',
+    )
+
+
+def main():
+    parser = Parser(False, False, description='Benchmark a Telegram task locally')
+    parser.add_parlai_data_path()
+    parser.add_telegram_args()
+    add_bench_args(parser)
+    opt = parser.parse_args()
+
+    config = config_utils.parse_configuration_file(opt.get('config_path'))
+    opt.update(config['world_opt'])
+    opt['config'] = config
+    opt['service'] = SERVICE_NAME
+
+    api = FakeBotAPI(latency=opt['api_latency'], flood_rate=opt['api_flood_rate'])
+    opt['telegram_api_url'] = api.url
+    opt['ingest'] = INGEST_WEBHOOK
+    opt['webhook_host'] = '127.0.0.1'
+    opt['webhook_port'] = 0
+    opt['webhook_url'] = None
+    state_dir = tempfile.mkdtemp(prefix='telegram-bench-')
+    opt['update_state_path'] = os.path.join(state_dir, 'update_id')
+    opt['session_store_path'] = os.path.join(state_dir, 'sessions.sqlite')
+
+    manager = BenchmarkManager(opt)
+    task_thread = threading.Thread(target=manager.start_task, name='Bench-Task-Thread')
+    task_thread.daemon = True
+    task_thread.start()
+
+    if opt['bench_delivery'] == 'socket':
+        deliver = SocketDelivery(manager._receive_update)
+    else:
+        deliver = WebhookDelivery(f'http://127.0.0.1:{manager.socket.port}{manager.socket.path}')
+    if opt['bench_setup_commands'] is not None:
+        setup_commands = opt['bench_setup_commands'].split(',')
+    else:
+        setup_commands = SETUP_COMMANDS.get(config['task_name'], ['hi'])
+
+    generator = LoadGenerator(
+        deliver,
+        api,
+        users=opt['bench_users'],
+        messages=opt['bench_messages'],
+        setup_commands=setup_commands,
+        exit_command=opt['bench_exit_command'],
+        concurrency=opt['bench_concurrency'],
+        reply_timeout=opt['bench_reply_timeout'],
+        settle_time=opt['bench_settle_time'],
+        ready=manager.in_task_world if manager.shards is None else None,
+    )
+    try:
+        result = generator.run()
+    finally:
+        deliver.close()
+        manager.shutdown()
+        api.shutdown()
+
+    print(f'\nTask {config["task_name"]}, {opt["bench_delivery"]} delivery, {result["users"]} users')
+    print(f'Replies: {result["replies"]}, timeouts: {result["timeouts"]}, '
+          f'duration: {result["duration"]:.2f}s')
+    print(f'Throughput: {result["msgs_per_sec"]:.1f} msgs/sec')
+    print(f'Latency: p50 {result["p50"] * 1000:.1f} ms, p95 {result["p95"] * 1000:.1f} ms, '
+          f'p99 {result["p99"] * 1000:.1f} ms')
+    print(f'Bot API calls: {api.calls}, injected flood waits: {api.flood_waits}')
+    if manager.ingress is not None:
+        ingress = manager.ingress.stats()
+        print(f'Ingress: max depth {ingress["max_depth"]}, dropped {ingress["dropped"]}, '
+              f'wait avg {ingress["avg_wait"] * 1000:.1f} ms, max {ingress["max_wait"] * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Local stand-in for the Telegram Bot API.
+
+Implements the methods the manager calls, with configurable latency and flood
+control (HTTP 429) injection, and records every message the bot sends so a load
+generator can wait for replies.
+"""
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _FakeAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        payload = json.loads(body) if body else {}
+        method = self.path.rsplit('/', 1)[-1]
+        response = self.server.api.handle(method, payload)
+        data = json.dumps(response).encode('utf-8')
+        self.send_response(429 if response.get('error_code') == 429 else 200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeBotAPI:
+    """
+    Fake Bot API server running in a background thread.
+
+    Serves ``/bot<token>/<method>`` for sendMessage, editMessageText,
+    sendChatAction, setWebhook and deleteWebhook.
+    """
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: float = 0.0,
+        flood_rate: float = 0.0,
+        retry_after: int = 1,
+    ):
+        """
+        :param host:
+            interface to listen on
+        :param port:
+            port to listen on, 0 picks a free one
+        :param latency:
+            seconds every request takes
+        :param flood_rate:
+            probability that a sendMessage is refused with a 429 flood wait
+        :param retry_after:
+            retry_after of injected flood waits, in seconds
+        """
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.webhook_url = None
+        self.calls = {}
+        self.flood_waits = 0
+        self.edits = 0
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # chat id -> list of (time, text) of the messages the bot sent
+        self._messages = {}
+        # chat id -> condition notified when the bot sends to that chat
+        self._conditions = {}
+        self.server = ThreadingHTTPServer((host, port), _FakeAPIHandler)
+        self.server.daemon_threads = True
+        self.server.api = self
+        self.url = f'http://{host}:{self.server.server_address[1]}'
+        self.serve_thread = threading.Thread(
+            target=self.server.serve_forever, name='Fake-Bot-API-Thread'
+        )
+        self.serve_thread.daemon = True
+        self.serve_thread.start()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, method: str, payload: dict) -> dict:
+        """
+        Answer one Bot API call the way Telegram would.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'sendMessage':
+            if self.flood_rate and random.random() < self.flood_rate:
+                with self._lock:
+                    self.flood_waits += 1
+                return {
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after},
+                }
+            return {'ok': True, 'result': self._record_message(payload)}
+        if method == 'editMessageText':
+            return {'ok': True, 'result': self._edit_message(payload)}
+        if method == 'sendChatAction':
+            return {'ok': True, 'result': True}
+        if method == 'setWebhook':
+            self.webhook_url = payload.get('url')
+            return {'ok': True, 'result': True, 'description': 'Webhook was set'}
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return {'ok': True, 'result': True, 'description': 'Webhook was deleted'}
+        return {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+
+    def _record_message(self, payload: dict) -> dict:
+        chat_id = payload['chat_id']
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': payload.get('text'),
+        }
+        with self._lock:
+            self._messages.setdefault(chat_id, []).append((time.monotonic(), message['text']))
+            self._chat_condition(chat_id).notify_all()
+        return message
+
+    def _edit_message(self, payload: dict) -> dict:
+        with self._lock:
+            self.edits += 1
+        return {
+            'message_id': payload['message_id'],
+            'date': int(time.time()),
+            'edit_date': int(time.time()),
+            'chat': {'id': payload['chat_id'], 'type': 'private'},
+            'text': payload.get('text'),
+        }
+
+    def _chat_condition(self, chat_id) -> threading.Condition:
+        condition = self._conditions.get(chat_id)
+        if condition is None:
+            condition = self._conditions[chat_id] = threading.Condition(self._lock)
+        return condition
+
+    def message_count(self, chat_id) -> int:
+        """
+        Return how many messages the bot has sent to chat_id.
+        """
+        with self._lock:
+            return len(self._messages.get(chat_id, ()))
+
+    def wait_for_message(self, chat_id, index: int, timeout: float):
+        """
+        Wait until the bot has sent at least ``index + 1`` messages to chat_id.
+
+        :return:
+            (monotonic time, text) of message ``index``, or None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            condition = self._chat_condition(chat_id)
+            while len(self._messages.get(chat_id, ())) <= index:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                condition.wait(remaining)
+            return self._messages[chat_id][index]
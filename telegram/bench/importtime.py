@@ -0,0 +1,172 @@
+"""
+Import time benchmark.
+
+Imports the entry modules in fresh interpreters with ``python -X importtime``
+and splits their import time into the part spent in ParlAI (which pulls in
+torch and cannot be changed from here) and the rest: the telegram package, the
+tasks and every module only they import. The rest is checked against a budget,
+and optionally against a saved baseline, so import time regressions fail CI.
+
+    python -m telegram.bench.importtime --budget-ms 25 --save importtime.json
+    python -m telegram.bench.importtime --baseline importtime.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+DEFAULT_TARGETS = (
+    'telegram.__main__',
+    'telegram.telegram_manager',
+    'tasks.chatbot.worlds',
+    'tasks.overworld_demo.worlds',
+)
+# Import time of these packages is reported, but not held against the budget
+EXTERNAL_PACKAGES = ('parlai',)
+# Imported before the target, so the standard library modules they share with
+# it count as theirs, whichever of them happens to be imported first
+EXTERNAL_PRELOAD = ('parlai.core.params', 'parlai.chat_service.core.chat_service_manager')
+DEFAULT_BUDGET_MS = 25
+DEFAULT_TOLERANCE = 0.25
+# Absolute slack when comparing against a baseline, against timer noise
+BASELINE_SLACK_MS = 5
+
+
+def parse_importtime(output: str) -> list:
+    """
+    Parse ``-X importtime`` output into (depth, self us, cumulative us, module)
+    tuples, in the order Python printed them (children before their parent).
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        # One space after the separator, then two per nesting level
+        stripped = name.lstrip(' ')
+        depth = (len(name) - len(stripped) - 1) // 2
+        entries.append((depth, int(self_us), int(cumulative_us), stripped))
+    return entries
+
+
+def _is_external(module: str) -> bool:
+    return module.split('.')[0] in EXTERNAL_PACKAGES
+
+
+def analyze(entries: list, target: str) -> dict:
+    """
+    Split the import time of target into its own and its external part.
+
+    :return:
+        dict with ``total``, ``external`` and ``own`` milliseconds and the
+        ``slowest`` own modules as (module, self ms) pairs
+    """
+    parts = target.split('.')
+    roots = {'.'.join(parts[:i]) for i in range(1, len(parts) + 1)}
+    total = external = 0
+    own_modules = []
+    # Walk parents before children, remembering the current ancestors
+    ancestors = []
+    in_target = False
+    for depth, self_us, cumulative_us, module in reversed(entries):
+        del ancestors[depth:]
+        if depth == 0:
+            in_target = module in roots or _is_external(module)
+            if in_target:
+                total += cumulative_us
+        ancestors.append(module)
+        if not in_target:
+            continue
+        if _is_external(module):
+            if not any(_is_external(ancestor) for ancestor in ancestors[:-1]):
+                external += cumulative_us
+        elif not any(_is_external(ancestor) for ancestor in ancestors):
+            own_modules.append((module, self_us / 1000))
+    own_modules.sort(key=lambda item: item[1], reverse=True)
+    return {
+        'total': total / 1000,
+        'external': external / 1000,
+        'own': (total - external) / 1000,
+        'slowest': own_modules,
+    }
+
+
+def measure(target: str, repeat: int) -> dict:
+    """
+    Import target ``repeat`` times in a fresh interpreter, after
+    ``EXTERNAL_PRELOAD``, and keep the fastest run.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), env.get('PYTHONPATH')]))
+    best = None
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             '; '.join(f'import {module}' for module in EXTERNAL_PRELOAD + (target,))],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        if process.returncode != 0:
+            raise RuntimeError(f'Importing {target} failed:\n{process.stderr[-2000:]}')
+        result = analyze(parse_importtime(process.stderr), target)
+        if best is None or result['own'] < best['own']:
+            best = result
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Track the import time of the Telegram bot')
+    parser.add_argument('--targets', nargs='+', default=list(DEFAULT_TARGETS),
+                        help='modules to import')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='imports per module, the fastest one counts')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help='maximum own import time of every module')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='JSON file of an earlier --save to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed relative increase over the baseline')
+    parser.add_argument('--save', type=str, default=None,
+                        help='write the results to this JSON file')
+    parser.add_argument('--top', type=int, default=5,
+                        help='number of slowest own modules shown per target')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    failures = []
+    for target in args.targets:
+        result = measure(target, args.repeat)
+        results[target] = {key: result[key] for key in ('total', 'external', 'own')}
+        print(f'{target}: own {result["own"]:.1f} ms, '
+              f'{"+".join(EXTERNAL_PACKAGES)} {result["external"]:.1f} ms, '
+              f'total {result["total"]:.1f} ms')
+        for module, self_ms in result['slowest'][:args.top]:
+            print(f'    {self_ms:8.1f} ms  {module}')
+        if result['own'] > args.budget_ms:
+            failures.append(f'{target} takes {result["own"]:.1f} ms, budget {args.budget_ms:g} ms')
+        if target in baseline:
+            limit = baseline[target]['own'] * (1 + args.tolerance) + BASELINE_SLACK_MS
+            if result['own'] > limit:
+                failures.append(
+                    f'{target} takes {result["own"]:.1f} ms, '
+                    f'baseline {baseline[target]["own"]:.1f} ms'
+                )
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    for failure in failures:
+        print(f'Import time regression: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
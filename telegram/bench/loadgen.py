@@ -0,0 +1,227 @@
+"""
+Load generator simulating Telegram users talking to the bot.
+
+Every simulated user sends updates the way Telegram would and waits for the
+bot's reply on the fake Bot API, which gives the end-to-end latency of each
+message.
+"""
+import itertools
+import math
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(sorted_values, p: float) -> float:
+    """
+    Return the nearest-rank percentile p (0-100) of an already sorted list.
+    """
+    if not sorted_values:
+        return float('nan')
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+# Telegram retries a refused update after a while
+REDELIVERY_DELAY = 0.5
+
+
+class WebhookDelivery:
+    """
+    Delivers updates by POSTing them to a webhook, like Telegram does, retrying
+    updates refused with 503.
+    """
+
+    def __init__(self, url: str, secret_token: str = None):
+        self.url = url
+        self.headers = {}
+        if secret_token:
+            self.headers['X-Telegram-Bot-Api-Secret-Token'] = secret_token
+        self._local = threading.local()
+
+    def __call__(self, update: dict):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        while True:
+            response = session.post(self.url, json=update, headers=self.headers)
+            if response.status_code != 503:
+                response.raise_for_status()
+                return
+            time.sleep(REDELIVERY_DELAY)
+
+    def close(self):
+        pass
+
+
+class SocketDelivery:
+    """
+    Delivers updates to a callback from one listener thread, like the relay socket.
+    """
+
+    def __init__(self, message_callback):
+        self.message_callback = message_callback
+        self._updates = queue.Queue()
+        self.listen_thread = threading.Thread(
+            target=self._run_listener, name='Bench-Socket-Thread'
+        )
+        self.listen_thread.daemon = True
+        self.listen_thread.start()
+
+    def __call__(self, update: dict):
+        self._updates.put(update)
+
+    def close(self):
+        self._updates.put(None)
+
+    def _run_listener(self):
+        while True:
+            update = self._updates.get()
+            if update is None:
+                return
+            self.message_callback(update)
+
+
+class LoadGenerator:
+    """
+    Simulates ``users`` Telegram users, each of them going through the setup
+    commands (overworld, onboarding) and then sending ``messages`` measured
+    messages, waiting for the reply to each one before sending the next.
+    """
+
+    def __init__(
+        self,
+        deliver,
+        api,
+        users: int = 100,
+        messages: int = 5,
+        setup_commands=('hi',),
+        exit_command: str = None,
+        concurrency: int = 100,
+        reply_timeout: float = 60.0,
+        settle_time: float = 1.0,
+        first_user_id: int = 1000000,
+        ready=None,
+    ):
+        """
+        :param deliver:
+            callable delivering one update to the bot
+        :param api:
+            FakeBotAPI the bot sends its replies to
+        :param users:
+            number of simulated users
+        :param messages:
+            number of measured messages every user sends
+        :param setup_commands:
+            messages sent before the measured ones, e.g. to leave the overworld
+        :param exit_command:
+            message sent after the measured ones, e.g. to end the task world
+        :param concurrency:
+            maximum number of users talking at the same time
+        :param reply_timeout:
+            seconds to wait for a reply before counting a timeout
+        :param settle_time:
+            seconds without new bot messages after which a setup step is done
+        :param first_user_id:
+            Telegram id of the first simulated user
+        :param ready:
+            optional callable ``ready(user_id) -> bool`` telling whether the user
+            reached the task world; measuring starts only once it does
+        """
+        self.deliver = deliver
+        self.api = api
+        self.users = users
+        self.messages = messages
+        self.setup_commands = list(setup_commands)
+        self.exit_command = exit_command
+        self.concurrency = concurrency
+        self.reply_timeout = reply_timeout
+        self.settle_time = settle_time
+        self.first_user_id = first_user_id
+        self.ready = ready
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _send(self, user_id: int, text: str):
+        self.deliver(
+            {
+                'update_id': next(self._update_ids),
+                'message': {
+                    'message_id': next(self._message_ids),
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'date': int(time.time()),
+                    'text': text,
+                },
+            }
+        )
+
+    def _wait_quiet(self, user_id: int, index: int) -> bool:
+        """
+        Wait for the bot's answer to a setup command and for it to stop talking.
+        """
+        if self.api.wait_for_message(user_id, index, self.reply_timeout) is None:
+            return False
+        index += 1
+        while self.api.wait_for_message(user_id, index, self.settle_time) is not None:
+            index += 1
+        return True
+
+    def _wait_ready(self, user_id: int) -> bool:
+        deadline = time.monotonic() + self.reply_timeout
+        while not self.ready(user_id):
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _run_user(self, user_id: int):
+        result = {'latencies': [], 'timeouts': 0, 'start': None, 'end': None}
+        for text in self.setup_commands:
+            index = self.api.message_count(user_id)
+            self._send(user_id, text)
+            if not self._wait_quiet(user_id, index):
+                result['timeouts'] += 1
+                return result
+        if self.ready is not None and not self._wait_ready(user_id):
+            result['timeouts'] += 1
+            return result
+        result['start'] = time.monotonic()
+        for i in range(self.messages):
+            index = self.api.message_count(user_id)
+            sent = time.monotonic()
+            self._send(user_id, f'Message {i} from user {user_id}')
+            reply = self.api.wait_for_message(user_id, index, self.reply_timeout)
+            if reply is None:
+                result['timeouts'] += 1
+                continue
+            result['latencies'].append(reply[0] - sent)
+            result['end'] = reply[0]
+        if self.exit_command:
+            self._send(user_id, self.exit_command)
+        return result
+
+    def run(self) -> dict:
+        """
+        Run all users and return throughput and latency statistics.
+        """
+        user_ids = range(self.first_user_id, self.first_user_id + self.users)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(self._run_user, user_ids))
+        latencies = sorted(latency for r in results for latency in r['latencies'])
+        starts = [r['start'] for r in results if r['start'] is not None]
+        ends = [r['end'] for r in results if r['end'] is not None]
+        duration = max(ends) - min(starts) if starts and ends else 0.0
+        return {
+            'users': self.users,
+            'replies': len(latencies),
+            'timeouts': sum(r['timeouts'] for r in results),
+            'duration': duration,
+            'msgs_per_sec': len(latencies) / duration if duration else 0.0,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+        }
@@ -0,0 +1,121 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import parlai.chat_service.utils.logging as log_utils
+from parlai.core.agents import create_agent_from_shared
+
+from telegram.core.profiling import profile_section
+
+
+class InferenceScheduler:
+    """
+    Runs the model turns of concurrent chats as micro-batches.
+
+    Every chat world keeps its own copy of the model for the dialogue history, but
+    the forward pass is done by one leader copy: observations of all worlds that
+    arrive within ``max_wait`` seconds (at most ``batch_size`` of them) go through
+    a single ``batch_act`` call and the replies are routed back to their worlds.
+    """
+
+    def __init__(self, shared, batch_size: int = 8, max_wait: float = 0.01, name: str = 'model'):
+        """
+        :param shared:
+            shared parameters of the model, as returned by ``agent.share()``
+        :param batch_size:
+            maximum number of observations in one batch
+        :param max_wait:
+            seconds the first observation of a batch waits for more to arrive
+        :param name:
+            name of the model, used for the scheduler thread
+        """
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self.model = create_agent_from_shared(shared)
+        # Agents without batch_act/self_observe can only answer one at a time
+        self.supports_batching = hasattr(self.model, 'batch_act') and hasattr(
+            self.model, 'self_observe'
+        )
+        self.keep_running = True
+        self._requests = queue.Queue()
+        self.batch_thread = threading.Thread(
+            target=self._run_batches, name=f'Inference-{name}-Thread'
+        )
+        self.batch_thread.daemon = True
+        self.batch_thread.start()
+
+    def act(self, agent, observation):
+        """
+        Let agent observe the message and return its reply.
+
+        Blocks the calling world until the batch with its observation is done.
+
+        :param agent:
+            the world's copy of the model, created from the same shared parameters
+        :param observation:
+            message the model should reply to
+        """
+        if not self.supports_batching:
+            agent.observe(observation)
+            return agent.act()
+        if not self.keep_running:
+            raise RuntimeError('Inference scheduler is shut down')
+        future = Future()
+        self._requests.put((agent.observe(observation), future))
+        reply = future.result()
+        agent.self_observe(reply)
+        return reply
+
+    def shutdown(self):
+        self.keep_running = False
+        self._requests.put(None)
+
+    def _next_batch(self):
+        request = self._requests.get()
+        if request is None:
+            return []
+        batch = [request]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                self._requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run_batches(self):
+        while self.keep_running:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            observations = [observation for observation, _ in batch]
+            try:
+                with profile_section(f'model:{self.name}'):
+                    replies = self.model.batch_act(observations)
+            except BaseException as e:
+                log_utils.print_and_log(
+                    logging.ERROR, f'Batch of {len(batch)} failed: {repr(e)}'
+                )
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), reply in zip(batch, replies):
+                future.set_result(reply)
+        # Release the worlds that are still waiting for a reply
+        while True:
+            try:
+                request = self._requests.get_nowait()
+            except queue.Empty:
+                return
+            if request is not None:
+                request[1].set_exception(RuntimeError('Inference scheduler is shut down'))
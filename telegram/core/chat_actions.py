@@ -0,0 +1,137 @@
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import parlai.chat_service.utils.logging as log_utils
+
+# Telegram shows a chat action for 5 seconds, renew it just before it fades
+DEFAULT_REFRESH_INTERVAL = 4.5
+# Stop renewing if the reply never comes
+DEFAULT_MAX_DURATION = 120
+DEFAULT_ACTION_WORKERS = 4
+
+
+class ChatActionDispatcher:
+    """
+    Keeps chat actions such as "typing" visible in busy chats.
+
+    ``start`` marks a chat busy and returns immediately; a background thread
+    sends one ``sendChatAction`` per busy chat and renews it every
+    ``refresh_interval`` seconds until ``stop`` is called (the reply was sent).
+    Starting a chat that is already busy does nothing, so a burst of messages
+    costs a single request.
+    """
+
+    def __init__(
+        self,
+        send_action,
+        refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+        max_duration: float = DEFAULT_MAX_DURATION,
+        workers: int = DEFAULT_ACTION_WORKERS,
+    ):
+        """
+        :param send_action:
+            function ``send_action(chat_id, action)`` doing the Bot API call
+        :param refresh_interval:
+            seconds between two actions sent to the same chat
+        :param max_duration:
+            seconds after which a chat stops being busy without ``stop``
+        :param workers:
+            number of threads sending actions
+        """
+        self.send_action = send_action
+        self.refresh_interval = refresh_interval
+        self.max_duration = max_duration
+        self.keep_running = True
+        # chat id -> (action, time it became busy)
+        self._busy = {}
+        # (next send time, chat id, time it became busy), may hold stale entries
+        # of chats that stopped or became busy again since
+        self._schedule = []
+        self._in_flight = set()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='Chat-Action'
+        )
+        self.action_thread = threading.Thread(
+            target=self._run_actions, name='Chat-Action-Thread'
+        )
+        self.action_thread.daemon = True
+        self.action_thread.start()
+
+    def start(self, chat_id, action: str = 'typing'):
+        """
+        Show action in chat_id until ``stop`` is called.
+        """
+        with self._condition:
+            if chat_id in self._busy:
+                return
+            now = time.monotonic()
+            self._busy[chat_id] = (action, now)
+            heapq.heappush(self._schedule, (now, chat_id, now))
+            self._condition.notify()
+
+    def stop(self, chat_id):
+        """
+        Stop renewing the action in chat_id.
+        """
+        with self._condition:
+            self._busy.pop(chat_id, None)
+
+    def busy_chats(self) -> int:
+        with self._condition:
+            return len(self._busy)
+
+    def shutdown(self):
+        with self._condition:
+            self.keep_running = False
+            self._busy.clear()
+            self._condition.notify()
+        self._executor.shutdown(wait=False)
+
+    def _next_due(self):
+        """
+        Wait for the next chat whose action has to be sent.
+        """
+        with self._condition:
+            while self.keep_running:
+                now = time.monotonic()
+                if self._schedule and self._schedule[0][0] <= now:
+                    _, chat_id, started = heapq.heappop(self._schedule)
+                    action, busy_since = self._busy.get(chat_id, (None, None))
+                    if busy_since != started:
+                        continue
+                    if now - started > self.max_duration:
+                        del self._busy[chat_id]
+                        continue
+                    heapq.heappush(
+                        self._schedule, (now + self.refresh_interval, chat_id, started)
+                    )
+                    if chat_id in self._in_flight:
+                        # The previous request is still running
+                        continue
+                    self._in_flight.add(chat_id)
+                    return chat_id, action
+                timeout = self._schedule[0][0] - now if self._schedule else None
+                self._condition.wait(timeout)
+        return None
+
+    def _send(self, chat_id, action: str):
+        try:
+            self.send_action(chat_id, action)
+        except Exception as e:
+            log_utils.print_and_log(
+                logging.WARN, f'Chat action for {chat_id} failed: {repr(e)}'
+            )
+        finally:
+            with self._condition:
+                self._in_flight.discard(chat_id)
+
+    def _run_actions(self):
+        while True:
+            due = self._next_due()
+            if due is None:
+                return
+            self._executor.submit(self._send, *due)
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+
+class PacketRecord(NamedTuple):
+    """
+    What an agent remembers about a message it has already seen.
+    """
+
+    mid: int
+    time: float
+
+    @classmethod
+    def now(cls, mid):
+        return cls(mid, time.time())
+
+
+class RecentPackets:
+    """
+    Dict-like record of the last ``maxlen`` message ids.
+
+    Used for duplicate detection: the oldest id is forgotten once the window is
+    full, so memory stays flat however long a conversation runs.
+    """
+
+    __slots__ = ('maxlen', '_records')
+
+    def __init__(self, maxlen: int):
+        self.maxlen = maxlen
+        self._records = OrderedDict()
+
+    def __contains__(self, mid):
+        return mid in self._records
+
+    def __getitem__(self, mid):
+        return self._records[mid]
+
+    def __setitem__(self, mid, record):
+        self._records[mid] = record
+        self._records.move_to_end(mid)
+        while len(self._records) > self.maxlen:
+            self._records.popitem(last=False)
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, mid, default=None):
+        return self._records.get(mid, default)
+
+
+class UpdateIdWindow:
+    """
+    Drops Telegram updates that were already handled, keyed on ``update_id``.
+
+    Update ids grow monotonically, so the filter keeps the highest id seen and a
+    bitmap of which of the ``size`` ids below it arrived. Older ids are treated as
+    duplicates. The highest id is written to ``path`` every ``persist_every``
+    updates, so updates redelivered after a restart are dropped as well.
+    """
+
+    # Telegram picks a random next id after a week without updates
+    MAX_IDLE_SECONDS = 7 * 24 * 60 * 60
+
+    def __init__(self, path: str = None, size: int = 1024, persist_every: int = 16):
+        """
+        :param path:
+            file storing the highest handled update id, or None to keep it in memory
+        :param size:
+            number of ids below the highest one that may still arrive late
+        :param persist_every:
+            write the highest id to disk after this many new updates
+        """
+        self.path = path
+        self.size = size
+        self.persist_every = persist_every
+        self.high_water = None
+        self.last_update_time = 0.0
+        self._bits = 0
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        if time.time() - os.path.getmtime(self.path) > self.MAX_IDLE_SECONDS:
+            return
+        try:
+            with open(self.path, 'r') as state_file:
+                self.high_water = int(state_file.read().strip())
+        except ValueError:
+            return
+        # Everything up to the stored id was handled before the restart
+        self._bits = (1 << self.size) - 1
+        self.last_update_time = time.time()
+
+    def save(self):
+        """
+        Write the highest handled id to disk.
+        """
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        self._unsaved = 0
+        if self.path is None or self.high_water is None:
+            return
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as state_file:
+            state_file.write(str(self.high_water))
+        os.replace(tmp_path, self.path)
+
+    def is_duplicate(self, update_id: int) -> bool:
+        """
+        Record update_id and return whether it has been seen before.
+        """
+        with self._lock:
+            now = time.time()
+            if now - self.last_update_time > self.MAX_IDLE_SECONDS:
+                self.high_water = None
+            self.last_update_time = now
+            if self.high_water is None:
+                self.high_water = update_id
+                self._bits = 1
+            elif update_id > self.high_water:
+                shift = update_id - self.high_water
+                if shift >= self.size:
+                    self._bits = 1
+                else:
+                    self._bits = ((self._bits << shift) | 1) & ((1 << self.size) - 1)
+                self.high_water = update_id
+            else:
+                offset = self.high_water - update_id
+                if offset >= self.size or self._bits >> offset & 1:
+                    return True
+                self._bits |= 1 << offset
+            self._unsaved += 1
+            if self._unsaved >= self.persist_every:
+                self._save()
+            return False
@@ -0,0 +1,163 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import parlai.chat_service.utils.logging as log_utils
+
+
+class RetryLater(Exception):
+    """
+    Raised by a job to run it again after ``delay`` seconds, before any later job
+    of the same chat.
+    """
+
+    def __init__(self, delay: float):
+        super().__init__(f'retry in {delay}s')
+        self.delay = delay
+
+
+class ChatDispatcher:
+    """
+    Runs jobs on a pool of worker threads while keeping jobs for the same chat in
+    submission order.
+
+    Every chat owns a FIFO of pending jobs. A chat is handed to at most one worker
+    at a time, so jobs of one chat never overtake each other, while jobs of
+    different chats run in parallel on the pool. A chat that has to wait (see
+    ``throttle`` and ``RetryLater``) is parked without holding a worker.
+    """
+
+    def __init__(self, num_workers: int, name: str = 'Dispatcher', throttle=None):
+        """
+        :param num_workers:
+            number of worker threads that execute jobs
+        :param name:
+            prefix for the names of the worker threads
+        :param throttle:
+            optional callable ``throttle(chat_id) -> seconds`` asked before each
+            job; a positive value postpones the chat by that many seconds
+        """
+        self.name = name
+        self.throttle = throttle
+        self.keep_running = True
+        self._condition = threading.Condition()
+        # chat id -> deque of (future, fn, args, kwargs)
+        self._pending = {}
+        # heap of (ready time, sequence, chat id) for chats not held by a worker
+        self._ready = []
+        self._sequence = itertools.count()
+        self._workers = []
+        for index in range(max(1, num_workers)):
+            worker = threading.Thread(
+                target=self._run_worker, name=f'{name}-{index}', daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, chat_id, fn, *args, **kwargs) -> Future:
+        """
+        Schedule ``fn(*args, **kwargs)`` after all jobs previously submitted for
+        ``chat_id``.
+
+        :return:
+            Future resolved with the return value of ``fn``
+        """
+        future = Future()
+        with self._condition:
+            if not self.keep_running:
+                raise RuntimeError(f'{self.name} is shut down')
+            jobs = self._pending.get(chat_id)
+            if jobs is None:
+                jobs = self._pending[chat_id] = deque()
+                self._schedule(chat_id, time.monotonic())
+            jobs.append((future, fn, args, kwargs))
+        return future
+
+    def pending(self) -> int:
+        """
+        Return the number of jobs that have not finished yet.
+        """
+        with self._condition:
+            return sum(len(jobs) for jobs in self._pending.values())
+
+    def waiting_chats(self) -> int:
+        """
+        Return the number of chats parked until a later time.
+        """
+        now = time.monotonic()
+        with self._condition:
+            return sum(1 for ready_at, _, _ in self._ready if ready_at > now)
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stop accepting jobs and let the workers drain what is already queued.
+        """
+        with self._condition:
+            self.keep_running = False
+            self._condition.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def _schedule(self, chat_id, ready_at: float):
+        heapq.heappush(self._ready, (ready_at, next(self._sequence), chat_id))
+        self._condition.notify()
+
+    def _next_job(self):
+        with self._condition:
+            while True:
+                if not self._ready:
+                    if not self.keep_running:
+                        return None, None
+                    self._condition.wait()
+                    continue
+                delay = self._ready[0][0] - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                _, _, chat_id = heapq.heappop(self._ready)
+                return chat_id, self._pending[chat_id][0]
+
+    def _release(self, chat_id, done: bool = True, delay: float = 0.0):
+        """
+        Hand chat_id back to the pool, dropping its head job if it is done.
+        """
+        with self._condition:
+            jobs = self._pending[chat_id]
+            if done:
+                jobs.popleft()
+            if jobs:
+                self._schedule(chat_id, time.monotonic() + max(delay, 0.0))
+            else:
+                del self._pending[chat_id]
+
+    def _run_worker(self):
+        while True:
+            chat_id, job = self._next_job()
+            if job is None:
+                return
+            future, fn, args, kwargs = job
+            # a retried job is already running, a cancelled one is dropped
+            if not (future.running() or future.set_running_or_notify_cancel()):
+                self._release(chat_id)
+                continue
+            if self.throttle is not None:
+                delay = self.throttle(chat_id)
+                if delay > 0:
+                    self._release(chat_id, done=False, delay=delay)
+                    continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except RetryLater as e:
+                self._release(chat_id, done=False, delay=e.delay)
+                continue
+            except BaseException as e:
+                log_utils.print_and_log(
+                    logging.WARN, f'{self.name}: job for chat {chat_id} failed: {repr(e)}'
+                )
+                future.set_exception(e)
+            self._release(chat_id)
@@ -0,0 +1,156 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import parlai.chat_service.utils.logging as log_utils
+
+from telegram.core.dispatcher import ChatDispatcher
+from telegram.core.metrics import INGRESS_WAIT_SECONDS
+from telegram.core.sharding import chat_id_of
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+OVERFLOW_DROP_NEWEST = 'drop-newest'
+DEFAULT_INGRESS_WORKERS = 4
+DEFAULT_INGRESS_QUEUE_SIZE = 10000
+
+
+class IngressQueue:
+    """
+    Bounded queue between the update source and the manager.
+
+    The receiving thread (socket listener, poller or webhook receiver) only
+    enqueues updates; a pool of workers hands them to the manager, keeping the
+    updates of one chat in order, so a slow chat no longer holds up the others.
+    When ``maxsize`` updates are waiting, ``overflow`` decides: ``block`` the
+    receiver (backpressure to the relay or to Telegram), ``drop-oldest`` waiting
+    update, or ``drop-newest``, i.e. refuse the incoming one.
+    """
+
+    def __init__(
+        self,
+        handler,
+        workers: int = DEFAULT_INGRESS_WORKERS,
+        maxsize: int = DEFAULT_INGRESS_QUEUE_SIZE,
+        overflow: str = OVERFLOW_BLOCK,
+    ):
+        """
+        :param handler:
+            function called with every update
+        :param workers:
+            number of threads handling updates
+        :param maxsize:
+            maximum number of updates waiting to be handled
+        :param overflow:
+            block, drop-oldest or drop-newest
+        """
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST):
+            raise ValueError(f'Unknown overflow policy {overflow}')
+        self.handler = handler
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dispatcher = ChatDispatcher(workers, name='Ingress')
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+        # sequence -> future of the updates not picked up by a worker yet
+        self._waiting = OrderedDict()
+        self.enqueued = 0
+        self.started = 0
+        self.handled = 0
+        self.failed = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def put(self, update: dict) -> bool:
+        """
+        Queue an update for the manager.
+
+        :return:
+            False if the update was refused because the queue is full
+        """
+        with self._condition:
+            while len(self._waiting) >= self.maxsize:
+                if self.overflow == OVERFLOW_DROP_NEWEST:
+                    self.dropped += 1
+                    self._log_drop(update)
+                    return False
+                if self.overflow == OVERFLOW_DROP_OLDEST:
+                    self._drop_oldest()
+                else:
+                    self._condition.wait()
+            sequence = next(self._sequence)
+            future = self.dispatcher.submit(
+                chat_id_of(update), self._handle, sequence, update, time.monotonic()
+            )
+            self._waiting[sequence] = future
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self._waiting))
+        return True
+
+    def _drop_oldest(self):
+        sequence, future = self._waiting.popitem(last=False)
+        # A worker may have picked it up in the meantime
+        if future.cancel():
+            self.dropped += 1
+            self._log_drop(None)
+        self._condition.notify_all()
+
+    def _log_drop(self, update):
+        log_utils.print_and_log(
+            logging.WARN,
+            f'Ingress queue full ({self.maxsize}), dropped '
+            f'{"incoming" if update is not None else "oldest"} update',
+        )
+
+    def _handle(self, sequence: int, update: dict, enqueued_at: float):
+        wait = time.monotonic() - enqueued_at
+        INGRESS_WAIT_SECONDS.observe(wait)
+        with self._condition:
+            self._waiting.pop(sequence, None)
+            self.started += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self._condition.notify_all()
+        try:
+            self.handler(update)
+        except Exception as e:
+            with self._condition:
+                self.failed += 1
+            log_utils.print_and_log(
+                logging.ERROR, f'Update {update.get("update_id")} failed: {repr(e)}'
+            )
+        with self._condition:
+            self.handled += 1
+
+    def depth(self) -> int:
+        """
+        Return the number of updates waiting for a worker.
+        """
+        with self._condition:
+            return len(self._waiting)
+
+    def stats(self) -> dict:
+        """
+        Return queue depth, throughput and wait time counters.
+        """
+        with self._condition:
+            return {
+                'depth': len(self._waiting),
+                'max_depth': self.max_depth,
+                'enqueued': self.enqueued,
+                'handled': self.handled,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'avg_wait': self.total_wait / self.started if self.started else 0.0,
+                'max_wait': self.max_wait,
+            }
+
+    def shutdown(self):
+        """
+        Handle the updates already queued and stop the workers.
+        """
+        self.dispatcher.shutdown()
@@ -0,0 +1,307 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import parlai.chat_service.utils.logging as log_utils
+
+# Seconds, from a cheap Bot API call up to a slow model turn
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(
+            key, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        )
+        for key, value in labels.items()
+    )
+    return f'{{{pairs}}}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes the labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _header(self, name: str = None) -> list:
+        name = name or self.name
+        return [
+            f'# HELP {name} {self.documentation}',
+            f'# TYPE {name} {self.type_name}',
+        ]
+
+    def render(self) -> list:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    Value that only goes up, e.g. a number of requests.
+    """
+
+    type_name = 'counter'
+
+    @property
+    def sample_name(self) -> str:
+        # In the 0.0.4 text format HELP and TYPE name the samples, which
+        # carry the _total suffix of counters
+        return self.name if self.name.endswith('_total') else f'{self.name}_total'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = self._header(self.sample_name)
+        for key, value in values:
+            labels = _format_labels(dict(zip(self.labelnames, key)))
+            lines.append(f'{self.sample_name}{labels} {_format_value(value)}')
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, e.g. a queue depth.
+    """
+
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = self._header()
+        for key, value in values:
+            labels = _format_labels(dict(zip(self.labelnames, key)))
+            lines.append(f'{self.name}{labels} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, e.g. durations, over fixed buckets.
+    """
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one count per bucket plus +Inf, and the sum
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of the ``with`` block.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = self._header()
+        for key, (counts, total) in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                bucket_labels = _format_labels({**labels, 'le': _format_value(bound)})
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics rendered together in the Prometheus text format.
+
+    Collectors registered with ``add_collector`` run before every render, to
+    refresh gauges that are sampled (queue depths) rather than recorded.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        """
+        Call collector() before every render.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                log_utils.print_and_log(logging.WARN, f'Metrics collector failed: {repr(e)}')
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# Stages an update goes through, from receipt to the reply on the Bot API
+INGEST_SECONDS = REGISTRY.histogram(
+    'telegram_ingest_seconds', 'Time the manager spent handling one received update'
+)
+INGRESS_WAIT_SECONDS = REGISTRY.histogram(
+    'telegram_ingress_wait_seconds', 'Time an update waited in the ingress queue'
+)
+AGENT_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    'telegram_agent_queue_wait_seconds',
+    'Time a message waited in the agent queue until its world acted on it',
+)
+WORLD_PARLEY_SECONDS = REGISTRY.histogram(
+    'telegram_world_parley_seconds', 'Duration of one world parley', ('world',)
+)
+MODEL_INFERENCE_SECONDS = REGISTRY.histogram(
+    'telegram_model_inference_seconds',
+    'Time a world waited for the reply of its model, batching included',
+    ('model',),
+)
+BOT_API_SECONDS = REGISTRY.histogram(
+    'telegram_bot_api_seconds', 'Duration of one Bot API request', ('method', 'status')
+)
+FLOOD_WAITS = REGISTRY.counter(
+    'telegram_flood_waits', 'Bot API requests rescheduled because of a flood wait', ('method',)
+)
+INGRESS = REGISTRY.gauge(
+    'telegram_ingress', 'State of the ingress queue, sampled at scrape time', ('stat',)
+)
+SENDER = REGISTRY.gauge(
+    'telegram_sender', 'State of the message sender, sampled at scrape time', ('stat',)
+)
+SESSIONS = REGISTRY.gauge(
+    'telegram_sessions', 'State of the session store, sampled at scrape time', ('stat',)
+)
+
+
+def set_stats(gauge: Gauge, stats: dict):
+    """
+    Copy the numeric values of a ``stats()`` dict into gauge, labelled by key.
+    """
+    for key, value in stats.items():
+        if isinstance(value, (int, float)):
+            gauge.set(value, stat=key)
+
+
+class MetricsServer:
+    """
+    Serves the metrics of a registry on ``http://host:port/metrics`` for
+    Prometheus to scrape.
+    """
+
+    def __init__(self, host: str, port: int, registry: MetricsRegistry = REGISTRY):
+        """
+        :param host:
+            interface to listen on
+        :param port:
+            port to listen on, 0 picks a free one
+        :param registry:
+            metrics to serve
+        """
+        # http.server pulls in a dozen modules, only load them when serving
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.registry = registry
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?')[0] != '/metrics':
+                    handler.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                handler.send_response(200)
+                handler.send_header('Content-Type', CONTENT_TYPE)
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.host = host
+        self.port = self.server.server_address[1]
+        self.serve_thread = threading.Thread(
+            target=self.server.serve_forever, name='Metrics-Server-Thread'
+        )
+        self.serve_thread.daemon = True
+        self.serve_thread.start()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from collections.abc import Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import parlai.chat_service.utils.logging as log_utils
+from parlai.core.agents import create_agent
+
+MODEL_PENDING = 'pending'
+MODEL_LOADING = 'loading'
+MODEL_READY = 'ready'
+MODEL_FAILED = 'failed'
+
+
+class ModelRegistry(Mapping):
+    """
+    Shared parameters of the task's models, loaded in the background.
+
+    Behaves like the ``{name: agent.share()}`` dict worlds read from
+    ``opt['shared_bot_params']``, except that looking up a model waits until it
+    is loaded. Models load in parallel right away, or, when ``lazy``, on the first
+    lookup, so the bot can serve the overworld while they warm up.
+    """
+
+    def __init__(self, model_opts: dict, lazy: bool = False, on_load=None):
+        """
+        :param model_opts:
+            model name -> opt passed to ``create_agent``
+        :param lazy:
+            load a model only when a world first asks for it
+        :param on_load:
+            optional callable ``on_load(name, shared)`` run once a model is loaded,
+            before worlds waiting for it are released
+        """
+        self.model_opts = model_opts
+        self.on_load = on_load
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._status = {name: MODEL_PENDING for name in model_opts}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, len(model_opts)), thread_name_prefix='Model-Loader'
+        )
+        if not lazy:
+            for name in model_opts:
+                self.load(name)
+
+    def _load(self, name):
+        self._status[name] = MODEL_LOADING
+        log_utils.print_and_log(logging.INFO, f'Loading model {name}...', should_print=True)
+        start = time.time()
+        try:
+            shared = create_agent(self.model_opts[name]).share()
+            if self.on_load is not None:
+                self.on_load(name, shared)
+        except BaseException as e:
+            self._status[name] = MODEL_FAILED
+            log_utils.print_and_log(
+                logging.ERROR, f'Model {name} failed to load: {repr(e)}', should_print=True
+            )
+            raise
+        self._status[name] = MODEL_READY
+        log_utils.print_and_log(
+            logging.INFO,
+            f'Model {name} ready in {time.time() - start:.1f}s',
+            should_print=True,
+        )
+        return shared
+
+    def load(self, name) -> Future:
+        """
+        Start loading model name unless it is loading already.
+
+        :return:
+            Future resolved with the shared parameters of the model
+        """
+        if name not in self.model_opts:
+            raise KeyError(name)
+        with self._lock:
+            future = self._futures.get(name)
+            if future is None:
+                future = self._futures[name] = self._executor.submit(self._load, name)
+            return future
+
+    def is_ready(self, name) -> bool:
+        return self._status.get(name) == MODEL_READY
+
+    def status(self) -> dict:
+        """
+        Return model name -> pending, loading, ready or failed.
+        """
+        return dict(self._status)
+
+    def wait(self, timeout: float = None):
+        """
+        Wait until every model is loaded, raising if one of them failed.
+        """
+        for name in self.model_opts:
+            self.load(name).result(timeout)
+
+    def __getitem__(self, name):
+        return self.load(name).result()
+
+    def __iter__(self):
+        return iter(self.model_opts)
+
+    def __len__(self):
+        return len(self.model_opts)
+
+    def __deepcopy__(self, memo):
+        # Models are shared, never copied along with the opt
+        return self
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
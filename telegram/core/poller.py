@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+
+import parlai.chat_service.utils.logging as log_utils
+
+MAX_RETRY_DELAY = 30
+# Seconds before fetching updates the manager refused again
+REFUSED_RETRY_DELAY = 0.5
+
+
+class TelegramUpdatePoller:
+    """
+    Long-polls ``getUpdates`` and forwards every update to the manager.
+
+    Used instead of the webhook relay on single-node deployments: updates come
+    straight from the Bot API, so there is no relay server and no websocket hop.
+    """
+
+    def __init__(self, sender, message_callback, limit: int = 100, timeout: int = 30):
+        """
+        :param sender:
+            MessageSender used to call the Bot API
+        :param message_callback:
+            function called with every incoming update
+        :param limit:
+            maximum number of updates fetched per request, 1-100
+        :param timeout:
+            seconds Telegram keeps a request open while there are no updates
+        """
+        self.sender = sender
+        self.message_callback = message_callback
+        self.limit = limit
+        self.timeout = timeout
+        self.offset = None
+        self.keep_running = True
+        self.listen_thread = threading.Thread(
+            target=self._run_polling, name='Update-Poller-Thread'
+        )
+        self.listen_thread.daemon = True
+        self.listen_thread.start()
+
+    def _run_polling(self):
+        retry_delay = 1
+        while self.keep_running:
+            try:
+                updates = self.sender.get_updates(self.offset, self.limit, self.timeout)
+            except Exception as e:
+                log_utils.print_and_log(
+                    logging.WARN,
+                    f'getUpdates failed: {repr(e)}, retrying in {retry_delay}s',
+                )
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+                continue
+            retry_delay = 1
+            for update in updates:
+                log_utils.print_and_log(logging.DEBUG, f'Update received: {update}')
+                try:
+                    accepted = self.message_callback(update)
+                except Exception as e:
+                    # Fetching it again would fail the same way
+                    log_utils.print_and_log(
+                        logging.ERROR, f'Update {update["update_id"]} failed: {repr(e)}'
+                    )
+                    accepted = True
+                if accepted is False:
+                    # Overloaded: the offset stays on this update, so the next
+                    # request fetches it and the rest of the batch again
+                    log_utils.print_and_log(
+                        logging.WARN, f'Update {update["update_id"]} refused, fetching it again'
+                    )
+                    time.sleep(REFUSED_RETRY_DELAY)
+                    break
+                # Confirmed to Telegram with the next request
+                self.offset = update['update_id'] + 1
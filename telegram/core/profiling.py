@@ -0,0 +1,317 @@
+import functools
+import io
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+import parlai.chat_service.utils.logging as log_utils
+
+PROFILE_OFF = 'off'
+PROFILE_SAMPLE = 'sample'
+PROFILE_CPROFILE = 'cprofile'
+DEFAULT_SAMPLE_HZ = 10
+DEFAULT_CALL_FRACTION = 0.01
+DEFAULT_DUMP_INTERVAL = 60
+# Functions listed in the text summary
+TOP_FUNCTIONS = 50
+MAX_STACK_DEPTH = 128
+
+_profiler = None
+
+
+def profile_section(name: str):
+    """
+    Context manager marking a section of code the profiler looks at.
+
+    Costs next to nothing while profiling is off.
+    """
+    if _profiler is None:
+        return nullcontext()
+    return _profiler.section(name)
+
+
+def profiled(name: str):
+    """
+    Decorator running the function in a ``profile_section``.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+            with _profiler.section(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def start_profiler(mode: str, directory: str, **kwargs):
+    """
+    Start the process wide profiler, see ``SamplingProfiler`` and
+    ``CallProfiler`` for the keyword arguments.
+    """
+    global _profiler
+    if mode == PROFILE_OFF:
+        return None
+    if _profiler is not None:
+        raise RuntimeError('A profiler is already running')
+    if mode == PROFILE_SAMPLE:
+        _profiler = SamplingProfiler(directory, **kwargs)
+    elif mode == PROFILE_CPROFILE:
+        _profiler = CallProfiler(directory, **kwargs)
+    else:
+        raise ValueError(f'Unknown profile mode {mode}')
+    log_utils.print_and_log(
+        logging.INFO, f'Profiling ({mode}) into {directory}', should_print=True
+    )
+    return _profiler
+
+
+def stop_profiler():
+    """
+    Stop the profiler and write its last dump.
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.shutdown()
+
+
+def _write_atomic(path: str, text: str):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class _Profiler:
+    """
+    Base of the profilers, dumping their aggregates every ``dump_interval``
+    seconds from a background thread.
+    """
+
+    def __init__(self, directory: str, dump_interval: float = DEFAULT_DUMP_INTERVAL):
+        self.directory = directory
+        self.dump_interval = dump_interval
+        self.prefix = os.path.join(directory, f'telegram-{os.getpid()}')
+        os.makedirs(directory, exist_ok=True)
+        self.keep_running = True
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self.dump_thread = threading.Thread(target=self._run_dumps, name='Profile-Dump-Thread')
+        self.dump_thread.daemon = True
+        self.dump_thread.start()
+
+    def section(self, name: str):
+        raise NotImplementedError
+
+    def dump(self):
+        raise NotImplementedError
+
+    def _safe_dump(self):
+        try:
+            self.dump()
+        except Exception as e:
+            log_utils.print_and_log(logging.WARN, f'Writing the profile failed: {repr(e)}')
+
+    def _run_dumps(self):
+        while not self._stopped.wait(self.dump_interval):
+            self._safe_dump()
+
+    def shutdown(self):
+        self.keep_running = False
+        self._stopped.set()
+        self._safe_dump()
+
+
+class SamplingProfiler(_Profiler):
+    """
+    Statistical profiler taking ``hz`` stack samples per second of the threads
+    that are inside a profiled section.
+
+    Threads outside the sections (sockets, pollers, idle workers) are not
+    sampled, and a section costs two dict updates, so it can stay on in
+    production. Dumps ``<prefix>.folded``, one ``frame;frame;... count`` line per
+    stack as read by flamegraph.pl and speedscope, and ``<prefix>-functions.txt``
+    with the samples per function.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        hz: float = DEFAULT_SAMPLE_HZ,
+        dump_interval: float = DEFAULT_DUMP_INTERVAL,
+        **kwargs,
+    ):
+        """
+        :param directory:
+            directory the dumps are written to
+        :param hz:
+            samples per second
+        :param dump_interval:
+            seconds between two dumps
+        """
+        # thread id -> names of the sections the thread is in, innermost last
+        self._sections = {}
+        self._stacks = Counter()
+        self.samples = 0
+        self.interval = 1.0 / hz
+        super().__init__(directory, dump_interval)
+        self.sample_thread = threading.Thread(target=self._run_sampling, name='Profile-Sample-Thread')
+        self.sample_thread.daemon = True
+        self.sample_thread.start()
+
+    @contextmanager
+    def section(self, name: str):
+        ident = threading.get_ident()
+        sections = self._sections.setdefault(ident, [])
+        sections.append(name)
+        try:
+            yield
+        finally:
+            sections.pop()
+            if not sections:
+                self._sections.pop(ident, None)
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+    def _sample(self):
+        frames = sys._current_frames()
+        stacks = []
+        for ident, sections in list(self._sections.items()):
+            frame = frames.get(ident)
+            try:
+                section = sections[-1]
+            except IndexError:
+                # The thread left its section meanwhile
+                continue
+            if frame is None:
+                continue
+            names = []
+            while frame is not None and len(names) < MAX_STACK_DEPTH:
+                names.append(self._frame_name(frame))
+                frame = frame.f_back
+            names.append(section)
+            stacks.append(';'.join(reversed(names)))
+        with self._lock:
+            self.samples += 1
+            self._stacks.update(stacks)
+
+    def _run_sampling(self):
+        next_sample = time.monotonic()
+        while self.keep_running:
+            self._sample()
+            next_sample += self.interval
+            delay = next_sample - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind, skip the missed samples rather than bursting
+                next_sample = time.monotonic()
+
+    def dump(self):
+        with self._lock:
+            stacks = dict(self._stacks)
+            samples = self.samples
+        _write_atomic(
+            f'{self.prefix}.folded',
+            ''.join(f'{stack} {count}\n' for stack, count in sorted(stacks.items())),
+        )
+        own = Counter()
+        total = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            # The first frame is the section, the last one is running
+            own[frames[-1]] += count
+            for frame in set(frames[1:]):
+                total[frame] += count
+        lines = [
+            f'{samples} samples at {1 / self.interval:g} Hz, '
+            f'{sum(stacks.values())} stacks in profiled sections',
+            '',
+            f'{"own":>8} {"total":>8}  function',
+        ]
+        for frame, count in own.most_common(TOP_FUNCTIONS):
+            lines.append(f'{count:>8} {total[frame]:>8}  {frame}')
+        _write_atomic(f'{self.prefix}-functions.txt', '\n'.join(lines) + '\n')
+
+
+class CallProfiler(_Profiler):
+    """
+    Runs a random ``fraction`` of the profiled sections under cProfile.
+
+    Exact call counts and times, at the cost of slowing the profiled calls down
+    several times. One section is profiled at a time, sections entered meanwhile
+    run unprofiled. Dumps ``<prefix>.pstats`` (for snakeviz, flameprof, ...) and
+    ``<prefix>-functions.txt`` sorted by cumulative time.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        fraction: float = DEFAULT_CALL_FRACTION,
+        dump_interval: float = DEFAULT_DUMP_INTERVAL,
+        **kwargs,
+    ):
+        """
+        :param directory:
+            directory the dumps are written to
+        :param fraction:
+            share of the sections that are profiled, 0-1
+        :param dump_interval:
+            seconds between two dumps
+        """
+        # Not imported at module level, as most runs never profile this way
+        import cProfile
+        import pstats
+
+        self._cprofile = cProfile
+        self._pstats = pstats
+        self.fraction = fraction
+        self.profiled = 0
+        self._stats = None
+        self._busy = threading.Lock()
+        super().__init__(directory, dump_interval)
+
+    @contextmanager
+    def section(self, name: str):
+        if random.random() >= self.fraction or not self._busy.acquire(blocking=False):
+            yield
+            return
+        profile = self._cprofile.Profile()
+        try:
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+        finally:
+            self._busy.release()
+        with self._lock:
+            self.profiled += 1
+            if self._stats is None:
+                self._stats = self._pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+
+    def dump(self):
+        with self._lock:
+            if self._stats is None:
+                return
+            self._stats.dump_stats(f'{self.prefix}.pstats')
+            output = io.StringIO()
+            self._stats.stream = output
+            output.write(f'{self.profiled} profiled sections\n')
+            self._stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        _write_atomic(f'{self.prefix}-functions.txt', output.getvalue())
@@ -0,0 +1,147 @@
+import threading
+import time
+
+# Limits documented in the Bot API FAQ
+GLOBAL_MESSAGES_PER_SECOND = 30
+PRIVATE_CHAT_MESSAGES_PER_SECOND = 1
+GROUP_CHAT_MESSAGES_PER_SECOND = 20 / 60
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at ``rate`` tokens per second up to
+    ``capacity`` tokens.
+
+    Not thread safe, callers are expected to hold a lock.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        # A bucket created after the caller read the clock has nothing to refill
+        if now <= self.updated:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """
+        Return how many seconds remain until one token is available.
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class RateGovernor:
+    """
+    Keeps outgoing Bot API traffic under Telegram's flood limits.
+
+    There is one global bucket for the whole bot and one bucket per chat; group
+    chats (negative ids) get the stricter group limit. Flood waits reported by
+    Telegram through ``retry_after`` block the chat until they expire.
+    """
+
+    MAX_IDLE_BUCKETS = 1024
+
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_MESSAGES_PER_SECOND,
+        private_rate: float = PRIVATE_CHAT_MESSAGES_PER_SECOND,
+        group_rate: float = GROUP_CHAT_MESSAGES_PER_SECOND,
+        chat_burst: float = 3,
+    ):
+        """
+        :param global_rate:
+            messages per second for the whole bot
+        :param private_rate:
+            messages per second to one private chat
+        :param group_rate:
+            messages per second to one group chat
+        :param chat_burst:
+            number of messages a quiet chat may receive back to back
+        """
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self._lock = threading.Lock()
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._blocked_until = {}
+        self.throttled = 0
+        self.flood_waits = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_IDLE_BUCKETS:
+                self._prune(time.monotonic())
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            rate = self.group_rate if is_group else self.private_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _prune(self, now: float):
+        """
+        Forget the buckets of chats that are back at full capacity.
+        """
+        for chat_id in [c for c, b in self._chats.items() if b.is_full(now)]:
+            del self._chats[chat_id]
+        for chat_id in [c for c, t in self._blocked_until.items() if t <= now]:
+            del self._blocked_until[chat_id]
+
+    def acquire(self, chat_id) -> float:
+        """
+        Try to take a send slot for chat_id.
+
+        :return:
+            0 if the message may be sent now, otherwise the number of seconds to
+            wait before asking again.
+        """
+        now = time.monotonic()
+        with self._lock:
+            delay = self._blocked_until.get(chat_id, now) - now
+            bucket = self._chat_bucket(chat_id)
+            delay = max(delay, bucket.wait_time(now), self._global.wait_time(now))
+            if delay > 0:
+                self.throttled += 1
+                return delay
+            bucket.consume()
+            self._global.consume()
+            return 0.0
+
+    def retry_after(self, chat_id, seconds: float):
+        """
+        Block chat_id for the flood wait reported by Telegram.
+        """
+        with self._lock:
+            self.flood_waits += 1
+            until = time.monotonic() + seconds
+            self._blocked_until[chat_id] = max(self._blocked_until.get(chat_id, 0), until)
+
+    def stats(self) -> dict:
+        """
+        Return a snapshot of the current throttle state.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._global._refill(now)
+            return {
+                'global_tokens': round(self._global.tokens, 2),
+                'tracked_chats': len(self._chats),
+                'flood_blocked_chats': sum(1 for t in self._blocked_until.values() if t > now),
+                'throttled': self.throttled,
+                'flood_waits': self.flood_waits,
+            }
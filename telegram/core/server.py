@@ -1,9 +1,12 @@
 import getpass
 import glob
+import hashlib
+import json
 import netrc
 import os
 from platform import architecture
 import shutil
+import socket
 import subprocess
 from sys import platform
 import tarfile
@@ -24,54 +27,252 @@ server_process = None
 
 heroku_url = 'https://cli-assets.heroku.com/heroku'
 
+# Public address of the local server, when --server-url is not given
+SERVER_URL_ENV = 'TELEGRAM_SERVER_URL'
+DEFAULT_LOCAL_PORT = 3000
+DEFAULT_READY_TIMEOUT = 60
+READY_POLL_INTERVAL = 0.25
+# The npm install only depends on these, the rest of the server can change
+# without reinstalling the packages
+PACKAGE_FILES = ('package.json', 'package-lock.json')
+# Kept in a prepared server directory when it is refreshed
+PRESERVED_NAMES = ('.git', 'node_modules')
+
+
+def _hash_files(directory, names=None):
+    """
+    Content hash of the files in directory, or only of the given names.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(name for name in dirs if name not in PRESERVED_NAMES)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            relative_path = os.path.relpath(path, directory).replace(os.sep, '/')
+            if names is not None and relative_path not in names:
+                continue
+            digest.update(relative_path.encode('utf-8') + b'\0')
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _stamp_path(directory):
+    return f'{directory}.json'
+
+
+def _read_stamp(directory):
+    """
+    What was prepared in directory, or {} if it cannot be trusted.
+    """
+    if not os.path.isdir(directory):
+        return {}
+    try:
+        with open(_stamp_path(directory)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_stamp(directory, stamp):
+    tmp_path = f'{_stamp_path(directory)}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(stamp, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, _stamp_path(directory))
+
+
+def _remove_stamp(directory):
+    if os.path.exists(_stamp_path(directory)):
+        os.remove(_stamp_path(directory))
+
+
+def prepare_server_directory(directory, install_packages=False):
+    """
+    Copy the server into directory, unless an identical copy is already there.
+
+    The content hashes of the server files and of its package files are
+    stamped next to the directory. An unchanged server is reused as is, and
+    ``node_modules`` is kept as long as the package files are unchanged.
+
+    :param directory:
+        where the server is prepared
+    :param install_packages:
+        run ``npm install`` in the directory
+    :return:
+        (stamp of the directory, whether it was reused unchanged)
+    """
+    source_path = os.path.join(core_dir, server_source_directory_name)
+    source_hash = _hash_files(source_path)
+    packages_hash = _hash_files(source_path, PACKAGE_FILES)
+    stamp = _read_stamp(directory)
+    modules_path = os.path.join(directory, 'node_modules')
+    packages_ready = stamp.get('packages_hash') == packages_hash and os.path.isdir(modules_path)
+    if stamp.get('source_hash') == source_hash and (packages_ready or not install_packages):
+        return stamp, True
+
+    # Dropped first, so an interrupted preparation is redone on the next launch
+    _remove_stamp(directory)
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name == '.git' or (name == 'node_modules' and packages_ready):
+            continue
+        path = os.path.join(directory, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    shutil.copytree(source_path, directory, dirs_exist_ok=True)
+
+    if install_packages and not packages_ready:
+        packages_installed = subprocess.call(['npm', 'install'], cwd=directory)
+        if packages_installed != 0:
+            raise Exception(
+                'please make sure npm is installed, otherwise view '
+                'the above error for more info.'
+            )
+        packages_ready = True
+
+    stamp = {
+        'source_hash': source_hash,
+        'packages_hash': packages_hash if packages_ready else None,
+        # Only a Heroku app built from this very source is up to date
+        'deployed_hash': stamp.get('deployed_hash'),
+    }
+    _write_stamp(directory, stamp)
+    return stamp, False
+
+
+def wait_for_port(port, timeout=DEFAULT_READY_TIMEOUT, process=None):
+    """
+    Wait until something accepts connections on localhost:port.
+
+    :param process:
+        the server process, waiting stops early if it exits
+    :return:
+        whether the port was ready before the timeout
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(('localhost', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(READY_POLL_INTERVAL)
+    return False
 
-def setup_heroku_server(task_name):
-    print("Heroku: Collecting files...")
 
-    # Install Heroku CLI
-    os_name = platform
+def wait_for_url(url, timeout=DEFAULT_READY_TIMEOUT):
+    """
+    Wait until url answers without a server error.
 
-    bit_architecture = 'x64' if architecture()[0] == '64bit' else 'x86'
+    A booting Heroku dyno answers 503, a running server 404 for ``/``.
 
-    if os_name == 'win32':
-        print('Windows not supported yet')
-        return
+    :return:
+        whether the url was ready before the timeout
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=5).status_code < 500:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(READY_POLL_INTERVAL)
+    return False
+
+
+def _get_heroku_executable():
+    """
+    Path of the Heroku CLI, downloaded into the core directory once.
+    """
+    os_name = platform
+    bit_architecture = 'x64' if architecture()[0] == '64bit' else 'x86'
 
     existing_heroku_directory_names = glob.glob(os.path.join(core_dir, 'heroku'))
     if len(existing_heroku_directory_names) == 0:
-        if os.path.exists(os.path.join(core_dir, 'heroku.tar.gz')):
-            os.remove(os.path.join(core_dir, 'heroku.tar.gz'))
+        tar_path = os.path.join(core_dir, 'heroku.tar.gz')
+        if os.path.exists(tar_path):
+            os.remove(tar_path)
 
         # Get the heroku client and unzip
-        os.chdir(core_dir)
-
         r = requests.get(url=f'{heroku_url}-{os_name}-{bit_architecture}.tar.gz', allow_redirects=True)
-        with open("heroku.tar.gz", "wb") as file:
+        r.raise_for_status()
+        with open(tar_path, 'wb') as file:
             file.write(r.content)
         del r
 
-        tar = tarfile.open("heroku.tar.gz", mode='r:gz')
-        tar.extractall()
-        tar.close()
-        del tar
+        with tarfile.open(tar_path, mode='r:gz') as tar:
+            tar.extractall(core_dir)
+        os.remove(tar_path)
 
     heroku_directory_name = glob.glob(os.path.join(core_dir, 'heroku'))[0]
     heroku_directory_path = os.path.join(core_dir, heroku_directory_name)
-    heroku_executable_path = os.path.join(heroku_directory_path, 'bin', 'heroku')
+    return os.path.join(heroku_directory_path, 'bin', 'heroku')
 
-    server_source_directory_path = os.path.join(core_dir, server_source_directory_name)
-    heroku_server_directory_path = os.path.join(core_dir, f'{heroku_server_directory_name}_{task_name}')
 
-    # Delete old server files
-    shutil.rmtree(heroku_server_directory_path, True)
+def _get_heroku_app_name(task_name):
+    return task_name[:30].rstrip('-')
 
-    # Copy over a clean copy into the server directory
-    shutil.copytree(server_source_directory_path, heroku_server_directory_path)
 
-    print("Heroku: Starting server...")
+def _create_heroku_app(heroku_executable_path, heroku_app_name, heroku_server_directory_path):
+    """
+    Create the app, or attach to it if it already exists in this account.
+
+    :return:
+        whether the app was created
+    """
+    try:
+        subprocess.check_output(
+            [heroku_executable_path, 'create', heroku_app_name],
+            stderr=subprocess.STDOUT,
+            cwd=heroku_server_directory_path,
+            text=True
+        )
+        return True
+    except subprocess.CalledProcessError as e:
+        if 'is already taken' not in e.output:
+            print(e.output)
+            raise SystemExit(
+                'Something unexpected happened trying to set up the '
+                'heroku server - please use the above printed error '
+                'to debug the issue however necessary.'
+            )
+    # Taken, either by the app of an earlier run or by someone else
+    try:
+        subprocess.check_output(
+            [heroku_executable_path, 'git:remote', '-a', heroku_app_name],
+            stderr=subprocess.STDOUT,
+            cwd=heroku_server_directory_path,
+            text=True
+        )
+    except subprocess.CalledProcessError as e:
+        print(e.output)
+        raise SystemExit(
+            f'The Heroku app name {heroku_app_name} is taken by another '
+            'account, please use a different task name.'
+        )
+    print(f'Heroku: Reusing the app {heroku_app_name}')
+    return False
+
+
+def setup_heroku_server(task_name, ready_timeout=DEFAULT_READY_TIMEOUT):
+    print("Heroku: Collecting files...")
+
+    if platform == 'win32':
+        print('Windows not supported yet')
+        return
+
+    heroku_executable_path = _get_heroku_executable()
+    heroku_server_directory_path = os.path.join(core_dir, f'{heroku_server_directory_name}_{task_name}')
 
-    os.chdir(heroku_server_directory_path)
-    os.system("git init")
+    stamp, reused = prepare_server_directory(heroku_server_directory_path)
+    if reused:
+        print('Heroku: Server files unchanged since the last launch')
+
+    print("Heroku: Starting server...")
 
     # get heroku credentials
     heroku_user_identifier = None
@@ -89,144 +290,134 @@ def setup_heroku_server(task_name):
                 'program again.'.format(heroku_executable_path)
             )
 
-    heroku_app_name = task_name[:30]
-
-    while heroku_app_name[-1] == '-':
-        heroku_app_name = heroku_app_name[:-1]
+    heroku_app_name = _get_heroku_app_name(task_name)
+    if not os.path.isdir(os.path.join(heroku_server_directory_path, '.git')):
+        subprocess.check_call(['git', 'init', '-q'], cwd=heroku_server_directory_path)
 
     # Create or attach to the server
+    created = _create_heroku_app(heroku_executable_path, heroku_app_name, heroku_server_directory_path)
+
+    # Enable WebSockets
     try:
         subprocess.check_output(
-            [heroku_executable_path, 'create', heroku_app_name],
-            stderr=subprocess.STDOUT,
-            text=True
-        )
-    except subprocess.CalledProcessError as e:
-        if 'is already taken' in e.output:
-            print(e.output)
-            do_continue = input(
-                'An app is already running with that name, do you want to '
-                'restart a new run with it (y/N): '
-            )
-            if do_continue != 'y':
-                raise SystemExit('User chose not to re-run the app.')
-            else:
-                delete_heroku_server(task_name)
-                try:
-                    subprocess.check_output(
-                        [heroku_executable_path, 'create', heroku_app_name],
-                        stderr=subprocess.STDOUT,
-                        text=True
-                    )
-                except subprocess.CalledProcessError as e:
-                    shutil.rmtree(heroku_server_directory_path, True)
-                    print(e.output)
-                    raise SystemExit(
-                        'Something unexpected happened trying to set up the '
-                        'heroku server - please use the above printed error '
-                        'to debug the issue however necessary.'
-                    )
-        else:
-            shutil.rmtree(heroku_server_directory_path, True)
-            print(e.output)
-            raise SystemExit(
-                'Something unexpected happened trying to set up the '
-                'heroku server - please use the above printed error '
-                'to debug the issue however necessary.'
-            )
-        # Enable WebSockets
-    try:
-        subprocess.check_output(
-            [heroku_executable_path, 'features:enable', 'http-session-affinity']
+            [heroku_executable_path, 'features:enable', 'http-session-affinity', '-a', heroku_app_name]
         )
     except subprocess.CalledProcessError:  # Already enabled WebSockets
         pass
 
-    # commit and push to the heroku server
-    os.chdir(heroku_server_directory_path)
-    os.system('git add -A')
-    os.system('git commit -m "app"')
-    os.system('git push -f heroku master')
+    # commit and push to the heroku server, unless it already runs this code
+    if created or stamp.get('deployed_hash') != stamp['source_hash']:
+        subprocess.call(['git', 'add', '-A'], cwd=heroku_server_directory_path)
+        # Fails when nothing changed since the last commit, which is fine
+        subprocess.call(['git', 'commit', '-q', '-m', 'app'], cwd=heroku_server_directory_path)
+        subprocess.check_call(['git', 'push', '-f', 'heroku', 'HEAD:master'], cwd=heroku_server_directory_path)
+        stamp['deployed_hash'] = stamp['source_hash']
+        _write_stamp(heroku_server_directory_path, stamp)
+    else:
+        print('Heroku: The app already runs the current server')
     subprocess.check_output(
-        [heroku_executable_path, 'ps:scale', 'web=1']
+        [heroku_executable_path, 'ps:scale', 'web=1', '-a', heroku_app_name]
     )
-    os.chdir(core_dir)
-
-    # Clean up heroku files
-    if os.path.exists(os.path.join(core_dir, 'heroku.tar.gz')):
-        os.remove(os.path.join(core_dir, 'heroku.tar.gz'))
-
-    shutil.rmtree(heroku_server_directory_path, True)
 
-    return f'https://{heroku_app_name}.herokuapp.com'
+    server_url = f'https://{heroku_app_name}.herokuapp.com'
+    if not wait_for_url(f'{server_url}/', ready_timeout):
+        print(f'Heroku: {server_url} is not answering yet, continuing anyway')
+    return server_url
 
 
-def delete_heroku_server(task_name):
-    heroku_directory_name = glob.glob(os.path.join(core_dir, 'heroku'))[0]
-    heroku_directory_path = os.path.join(core_dir, heroku_directory_name)
-    heroku_executable_path = os.path.join(heroku_directory_path, 'bin', 'heroku')
-
-    heroku_app_name = task_name[:30]
+def delete_heroku_server(task_name, keep=False):
+    heroku_app_name = _get_heroku_app_name(task_name)
+    if keep:
+        print(f'Heroku: Keeping server {heroku_app_name} for the next launch')
+        return
+    heroku_executable_path = _get_heroku_executable()
     print(f"Heroku: Deleting server: {heroku_app_name}")
     subprocess.check_output([
         heroku_executable_path, 'destroy', heroku_app_name, '--confirm', heroku_app_name
     ])
+    # A new app starts without code, the next launch has to push again
+    heroku_server_directory_path = os.path.join(core_dir, f'{heroku_server_directory_name}_{task_name}')
+    stamp = _read_stamp(heroku_server_directory_path)
+    if stamp.get('deployed_hash') is not None:
+        stamp['deployed_hash'] = None
+        _write_stamp(heroku_server_directory_path, stamp)
 
 
-def setup_local_server(task_name):
+def setup_local_server(task_name, server_url=None, port=DEFAULT_LOCAL_PORT, ready_timeout=DEFAULT_READY_TIMEOUT):
     global server_process
     print("Local Server: Collecting files...")
 
-    server_source_directory_path = os.path.join(core_dir, server_source_directory_name)
+    server_url = server_url or os.environ.get(SERVER_URL_ENV)
+    if not server_url:
+        raise SystemExit(
+            'Please give the public server address, like https://hostname.com:3000, '
+            f'with --server-url or the {SERVER_URL_ENV} environment variable.'
+        )
+
     local_server_directory_path = os.path.join(
         core_dir, '{}_{}'.format(local_server_directory_name, task_name)
     )
-
-    # Delete old server files
-    shutil.rmtree(local_server_directory_path, True)
-
-    # Copy over a clean copy into the server directory
-    shutil.copytree(server_source_directory_path, local_server_directory_path)
+    _, reused = prepare_server_directory(local_server_directory_path, install_packages=True)
+    if reused:
+        print('Local: Server files and packages unchanged since the last launch')
 
     print("Local: Starting server...")
 
-    os.chdir(local_server_directory_path)
-
-    packages_installed = subprocess.call(['npm', 'install'])
-    if packages_installed != 0:
-        raise Exception(
-            'please make sure npm is installed, otherwise view '
-            'the above error for more info.'
+    server_process = subprocess.Popen(
+        ['node', 'server.js'],
+        cwd=local_server_directory_path,
+        env=dict(os.environ, PORT=str(port)),
+    )
+    if not wait_for_port(port, ready_timeout, server_process):
+        server_process.terminate()
+        server_process.wait()
+        server_process = None
+        raise SystemExit(
+            f'The local server did not start listening on port {port}, '
+            'please view the above output for more info.'
         )
 
-    server_process = subprocess.Popen(['node', 'server.js'])
-
-    time.sleep(1)
     print(f'Server running locally with pid {server_process.pid}.')
-    host = input('Please enter the public server address, like https://hostname.com: ')
-    port = input('Please enter the port given above, likely 3000: ')
-    return f'{host}:{port}'
+    return server_url.rstrip('/')
 
 
 def delete_local_server(task_name):
     global server_process
-    print('Terminating server')
-    server_process.terminate()
-    server_process.wait()
-    print('Cleaning temp directory')
-    local_server_directory_path = os.path.join(core_dir, f'{local_server_directory_name}_{task_name}')
-    shutil.rmtree(local_server_directory_path, True)
-
-
-def setup_server(task_name, local=False):
+    if server_process is not None:
+        print('Terminating server')
+        server_process.terminate()
+        server_process.wait()
+        server_process = None
+    # The prepared directory and its node_modules are kept for the next launch
+
+
+def setup_server(task_name, local=False, server_url=None, port=DEFAULT_LOCAL_PORT,
+                 ready_timeout=DEFAULT_READY_TIMEOUT):
+    """
+    Set up the relay server without asking anything.
+
+    :param server_url:
+        public address of the local server
+    :param port:
+        port the local server listens on
+    :param ready_timeout:
+        seconds to wait for the server to answer
+    """
     if local:
-        return setup_local_server(task_name)
+        return setup_local_server(task_name, server_url, port, ready_timeout)
     else:
-        return setup_heroku_server(task_name)
+        return setup_heroku_server(task_name, ready_timeout)
+
 
+def delete_server(task_name, local=False, keep=False):
+    """
+    Stop the relay server. The prepared server directory stays for the next
+    launch.
 
-def delete_server(task_name, local=False):
+    :param keep:
+        leave the Heroku app running, so the next launch reuses it
+    """
     if local:
         delete_local_server(task_name)
     else:
-        delete_heroku_server(task_name)
+        delete_heroku_server(task_name, keep)
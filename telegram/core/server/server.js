@@ -8,6 +8,14 @@ const https = require('https');
 const nunjucks = require('nunjucks');
 const WebSocket = require('ws');
 
+// Compact binary frames are optional, JSON is used without msgpack-lite
+let msgpack = null;
+try {
+  msgpack = require('msgpack-lite');
+} catch (error) {
+  console.log('msgpack-lite is not installed, using JSON frames');
+}
+
 const task_directory_name = 'task';
 
 const PORT = process.env.PORT || 3000;
@@ -49,49 +57,166 @@ const wss = new WebSocket.Server({ server });
 // Socket used for speaking to the world
 var world_socket = null;
 
-// Handles sending a message through the socket
+// Packets not yet acknowledged by the world, in the order they arrived. They
+// are kept while the world is disconnected and replayed when it registers again
+const MAX_BUFFERED_PACKETS = parseInt(process.env.MAX_BUFFERED_PACKETS) || 10000;
+const unacked_packets = new Map();
+var next_seq = 1;
+
+// Under load, packets arriving within the linger window share one frame
+const FRAME_LINGER_MS = parseInt(process.env.FRAME_LINGER_MS) || 5;
+const MAX_FRAME_PACKETS = parseInt(process.env.MAX_FRAME_PACKETS) || 100;
+var pending_packets = [];
+var flush_timer = null;
+var last_flush = 0;
+
+// Encodes a frame with the codec the world asked for
+function _encode_frame(socket, frame) {
+  if (socket.codec === 'msgpack') {
+    return msgpack.encode(frame);
+  }
+  return JSON.stringify(frame);
+}
+
+function _send_frame(socket, packets) {
+  var frame = packets[0];
+  if (packets.length > 1) {
+    frame = { type: 'batch', content: packets };
+  }
+  socket.send(_encode_frame(socket, frame), function ack(error) {
+    if (error === undefined) {
+      return true;
+    }
+    // The packets stay buffered and are replayed once the world reconnects
+    console.log('Ran into error trying to send %d packets', packets.length);
+    console.log(error);
+  });
+}
+
+function _flush_packets() {
+  if (flush_timer !== null) {
+    clearTimeout(flush_timer);
+    flush_timer = null;
+  }
+  var packets = pending_packets;
+  pending_packets = [];
+  last_flush = Date.now();
+  if (world_socket && packets.length > 0) {
+    _send_frame(world_socket, packets);
+  }
+}
+
+function _queue_packet(packet) {
+  if (!world_socket.batching) {
+    _send_frame(world_socket, [packet]);
+    return;
+  }
+  pending_packets.push(packet);
+  if (pending_packets.length >= MAX_FRAME_PACKETS) {
+    _flush_packets();
+  } else if (flush_timer === null) {
+    if (Date.now() - last_flush >= FRAME_LINGER_MS) {
+      // Idle: send right away, only bursts wait for the linger window
+      _flush_packets();
+    } else {
+      flush_timer = setTimeout(_flush_packets, FRAME_LINGER_MS);
+    }
+  }
+}
+
+// Buffers a message and sends it through the socket if the world is connected
 function _send_message(event_name, event_data) {
+  if (unacked_packets.size >= MAX_BUFFERED_PACKETS) {
+    console.log('Packet buffer full, refusing message');
+    return false;
+  }
+  var packet = {
+    type: event_name,
+    content: event_data,
+    seq: next_seq++,
+  };
+  unacked_packets.set(packet.seq, packet);
   if (world_socket) {
-    var packet = {
-      type: event_name,
-      content: event_data,
-    };
-    world_socket.send(JSON.stringify(packet), function ack(error) {
-      if (error === undefined) {
-        return true;
-      }
-      console.log('Ran into error trying to send, retrying');
-      setTimeout(function() {
-        world_socket.send(JSON.stringify(packet), function ack2(error2) {
-          if (error2 === undefined) {
-            return true;
-          }
-          console.log('Repeat send of packet failed');
-          console.log(packet);
-          console.log(error2);
-        });
-      }, 500);
-    });
-    return true;
+    _queue_packet(packet);
   } else {
-    console.log('Message recieved without world connected');
-    console.log(event_data);
-    return false;
+    console.log(
+      'Message buffered without world connected (%d waiting)',
+      unacked_packets.size
+    );
+  }
+  return true;
+}
+
+// Acknowledgements are cumulative: the world handles packets in order
+function _handle_ack(seq) {
+  for (const buffered_seq of unacked_packets.keys()) {
+    if (buffered_seq > seq) {
+      break;
+    }
+    unacked_packets.delete(buffered_seq);
+  }
+}
+
+function _replay_packets(socket) {
+  // Packets waiting for a frame are still buffered and replayed below
+  pending_packets = [];
+  if (unacked_packets.size > 0) {
+    console.log('Replaying %d buffered packets', unacked_packets.size);
+  }
+  var packets = [];
+  for (const packet of unacked_packets.values()) {
+    if (!socket.batching) {
+      _send_frame(socket, [packet]);
+      continue;
+    }
+    packets.push(packet);
+    if (packets.length >= MAX_FRAME_PACKETS) {
+      _send_frame(socket, packets);
+      packets = [];
+    }
+  }
+  if (packets.length > 0) {
+    _send_frame(socket, packets);
   }
 }
 
+// Picks the first codec offered by the world that the server supports
+function _negotiate(socket, content) {
+  var codecs = content['codecs'] || ['json'];
+  socket.codec = 'json';
+  for (const codec of codecs) {
+    if (codec === 'json' || (codec === 'msgpack' && msgpack !== null)) {
+      socket.codec = codec;
+      break;
+    }
+  }
+  socket.batching = content['batching'] === true;
+  console.log(
+    'World registered, %s frames%s',
+    socket.codec,
+    socket.batching ? ', batched' : ''
+  );
+}
+
 // Register handlers
 wss.on('connection', function(socket) {
   console.log('Client connected');
   // Disconnects are logged
-  socket.on('disconnect', function() {
-    console.log('World disconnected');
+  socket.on('close', function() {
+    if (socket === world_socket) {
+      console.log('World disconnected');
+      world_socket = null;
+    }
   });
 
   socket.on('message', function(data) {
     data = JSON.parse(data);
     if (data['type'] == 'world_alive') {
+      _negotiate(socket, data['content']);
       world_socket = socket;
+      _replay_packets(socket);
+    } else if (data['type'] == 'ack') {
+      _handle_ack(data['content']['seq']);
     } else if (data['type'] == 'ping') {
       socket.send(JSON.stringify({ type: 'pong', content: 'pong' }));
     }
@@ -146,11 +271,11 @@ app.post('/webhook', async function(req, res, next) {
   // Checks this is an event from a page subscription
   try {
       let result = _send_message('new_packet', req.body);
-      // TODO handle v. rare cases of message drops - should send timeout status
       if (result) {
         res.status(200).send('Successful POST');
       } else {
-        res.status(504).send('Timeout');
+        // Buffer is full, Telegram delivers the update again later
+        res.status(503).send('Service Unavailable');
       }
     } catch (error) {
       console.log('Transient error on message');
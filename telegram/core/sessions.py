@@ -0,0 +1,333 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+import parlai.chat_service.utils.logging as log_utils
+from parlai.chat_service.core.chat_service_manager import AgentState
+
+SESSION_STORE_OFF = 'off'
+SESSION_STORE_SQLITE = 'sqlite'
+DEFAULT_FLUSH_INTERVAL = 1.0
+# Sessions of chats silent for longer are dropped when the store is opened
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+# Conversations silent for longer are evicted from memory
+DEFAULT_IDLE_TTL = 30 * 60
+# Longest time between two looks for idle conversations
+DEFAULT_EVICT_INTERVAL = 30.0
+# What is known about a chat, each stored as JSON
+SESSION_FIELDS = ('world_type', 'onboard_data', 'data', 'world_state')
+
+# Fields of a session saved again after it was deleted
+_CLEARED = {name: None for name in SESSION_FIELDS}
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    chat_id INTEGER PRIMARY KEY,
+    world_type TEXT,
+    onboard_data TEXT,
+    data TEXT,
+    world_state TEXT,
+    updated REAL NOT NULL
+)
+'''
+
+
+class SessionStore:
+    """
+    Snapshots of the conversations in an SQLite database, keyed by chat id.
+
+    ``save`` only records the change in memory; a background thread writes the
+    changes of all chats in one transaction every ``flush_interval`` seconds,
+    so snapshotting a conversation after every turn costs the world no disk
+    write. Changes to one chat between two flushes are merged, and ``load``
+    sees them before they are written. Several processes (shard workers) can
+    share one database as long as each chat is only handled by one of them.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        max_age: float = DEFAULT_MAX_AGE,
+    ):
+        """
+        :param path:
+            SQLite database file, created if missing
+        :param flush_interval:
+            seconds between two writes of the pending changes
+        :param max_age:
+            seconds after which the session of a silent chat is dropped
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.keep_running = True
+        self.saved = 0
+        self.written = 0
+        # chat id -> encoded fields changed since the last flush, None if deleted
+        self._pending = {}
+        # The changes being written, still visible to load meanwhile
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._db_lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(_SCHEMA)
+            self._conn.execute('DELETE FROM sessions WHERE updated < ?', (time.time() - max_age,))
+        self._wakeup = threading.Event()
+        self.flush_thread = threading.Thread(target=self._run_flushes, name='Session-Store-Thread')
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+
+    def save(self, chat_id: int, **fields) -> bool:
+        """
+        Record the given fields of the session of chat_id, keeping the others.
+
+        :return:
+            False if a field could not be encoded as JSON and nothing was saved
+        """
+        unknown = set(fields) - set(SESSION_FIELDS)
+        if unknown:
+            raise ValueError(f'Unknown session fields {sorted(unknown)}')
+        try:
+            encoded = {name: json.dumps(value) for name, value in fields.items()}
+        except (TypeError, ValueError) as e:
+            log_utils.print_and_log(
+                logging.WARN, f'Session of {chat_id} cannot be saved: {repr(e)}'
+            )
+            return False
+        with self._lock:
+            if chat_id not in self._pending:
+                self._pending[chat_id] = encoded
+            elif self._pending[chat_id] is None:
+                # Deleted before, so the fields not given are cleared
+                self._pending[chat_id] = {**_CLEARED, **encoded}
+            else:
+                self._pending[chat_id].update(encoded)
+            self.saved += 1
+        return True
+
+    def delete(self, chat_id: int):
+        """
+        Forget the session of chat_id.
+        """
+        with self._lock:
+            self._pending[chat_id] = None
+
+    def load(self, chat_id: int):
+        """
+        Session of chat_id, as a dict of ``SESSION_FIELDS``, or None.
+        """
+        with self._lock:
+            changes = [
+                changes[chat_id]
+                for changes in (self._flushing, self._pending)
+                if chat_id in changes
+            ]
+        if changes and changes[-1] is None:
+            return None
+        with self._db_lock:
+            row = self._conn.execute(
+                f'SELECT {", ".join(SESSION_FIELDS)} FROM sessions WHERE chat_id = ?',
+                (chat_id,),
+            ).fetchone()
+        if row is None and not changes:
+            return None
+        encoded = dict(zip(SESSION_FIELDS, row)) if row is not None else {}
+        for change in changes:
+            encoded.update(_CLEARED if change is None else change)
+        return {
+            name: json.loads(encoded[name]) if encoded.get(name) is not None else None
+            for name in SESSION_FIELDS
+        }
+
+    def flush(self):
+        """
+        Write the pending changes.
+        """
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            self._flushing, self._pending = self._pending, {}
+        now = time.time()
+        try:
+            with self._db_lock, self._conn:
+                for chat_id, change in self._flushing.items():
+                    if change is None:
+                        self._conn.execute('DELETE FROM sessions WHERE chat_id = ?', (chat_id,))
+                    else:
+                        self._upsert(chat_id, change, now)
+            self.written += len(self._flushing)
+        except sqlite3.Error as e:
+            log_utils.print_and_log(logging.WARN, f'Writing sessions failed: {repr(e)}')
+            # Keep the changes for the next flush, newer ones win
+            with self._lock:
+                for chat_id, change in self._flushing.items():
+                    newer = self._pending.get(chat_id, {})
+                    if newer is not None:
+                        self._pending[chat_id] = (
+                            None if change is None and not newer
+                            else {**(_CLEARED if change is None else change), **newer}
+                        )
+        finally:
+            with self._lock:
+                self._flushing = {}
+
+    def _upsert(self, chat_id: int, change: dict, now: float):
+        names = list(change)
+        self._conn.execute(
+            f'INSERT INTO sessions (chat_id, {", ".join(names)}, updated) '
+            f'VALUES (?, {", ".join("?" for _ in names)}, ?) '
+            f'ON CONFLICT(chat_id) DO UPDATE SET '
+            f'{", ".join(f"{name} = excluded.{name}" for name in names)}, updated = excluded.updated',
+            (chat_id, *(change[name] for name in names), now),
+        )
+
+    def _run_flushes(self):
+        while self.keep_running:
+            self._wakeup.wait(self.flush_interval)
+            self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {'pending': pending, 'saved': self.saved, 'written': self.written}
+
+    def shutdown(self):
+        """
+        Write the pending changes and close the database.
+        """
+        self.keep_running = False
+        self._wakeup.set()
+        self.flush_thread.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+
+class RestoredAgentState(AgentState):
+    """
+    State of a chat rehydrated from its saved session, on its way back into the
+    world it was in.
+
+    Until that world starts the overworld agent only collects the messages of
+    the chat, which are handed to the agent of the world once it is active.
+    """
+
+    def __init__(self, service_id: int, overworld_agent, session: dict):
+        super().__init__(service_id, overworld_agent)
+        self.onboard_data = session['onboard_data']
+        self.data = session['data'] or {}
+        # Handed to the agent of the world, which restores the world from it
+        self.world_state = session['world_state']
+
+    def set_active_agent(self, active_agent):
+        super().set_active_agent(active_agent)
+        if active_agent is None or active_agent is self.overworld_agent:
+            return
+        active_agent.world_state, self.world_state = self.world_state, None
+        self.overworld_agent.hand_over_messages(active_agent)
+
+
+class SessionEvictor:
+    """
+    Moves conversations of chats that went silent out of memory.
+
+    Every ``interval`` seconds it asks the manager for the conversations that
+    are resident and saved, and evicts those idle for more than ``idle_ttl``
+    seconds, then the least recently active ones while more than
+    ``max_resident`` are left. The manager stops the world of an evicted
+    conversation and drops its agent and model; its state stays in the
+    ``SessionStore``, from which the conversation is restored when the chat
+    speaks again, like after a restart. Resident memory so follows the active
+    chats rather than every chat that ever started a conversation.
+
+    The manager provides ``resident_sessions()``, a list of ``(task id,
+    agent)`` pairs, ``evict_session(task_id, agent)``, returning whether the
+    conversation was evicted, and ``prune_finished_worlds()``.
+    """
+
+    def __init__(
+        self,
+        manager,
+        idle_ttl: float = DEFAULT_IDLE_TTL,
+        max_resident: int = 0,
+        interval: float = None,
+    ):
+        """
+        :param manager:
+            manager running the conversations
+        :param idle_ttl:
+            seconds without a message after which a conversation is evicted,
+            0 to only evict beyond max_resident
+        :param max_resident:
+            number of conversations kept in memory at most, 0 for no limit
+        :param interval:
+            seconds between two looks, by default a quarter of idle_ttl up to
+            ``DEFAULT_EVICT_INTERVAL``
+        """
+        if interval is None:
+            interval = min(DEFAULT_EVICT_INTERVAL, idle_ttl / 4) if idle_ttl > 0 else DEFAULT_EVICT_INTERVAL
+        self.manager = manager
+        self.idle_ttl = idle_ttl
+        self.max_resident = max_resident
+        self.interval = max(interval, 0.1)
+        self.keep_running = True
+        self.resident = 0
+        self.evicted = 0
+        self._stopped = threading.Event()
+        self.evict_thread = threading.Thread(target=self._run_evictions, name='Session-Evict-Thread')
+        self.evict_thread.daemon = True
+        self.evict_thread.start()
+
+    def _candidates(self, resident: list) -> list:
+        """
+        The conversations to evict, least recently active first.
+        """
+        resident = sorted(resident, key=lambda pair: pair[1].last_message_time)
+        over_budget = len(resident) - self.max_resident if self.max_resident > 0 else 0
+        if self.idle_ttl > 0:
+            cutoff = time.monotonic() - self.idle_ttl
+            idle = sum(1 for _, agent in resident if agent.last_message_time < cutoff)
+        else:
+            idle = 0
+        return resident[:max(idle, over_budget)]
+
+    def evict_idle(self):
+        """
+        Evict the idle conversations and those beyond the budget now.
+        """
+        self.manager.prune_finished_worlds()
+        resident = self.manager.resident_sessions()
+        evicted = 0
+        for task_id, agent in self._candidates(resident):
+            if self.manager.evict_session(task_id, agent):
+                evicted += 1
+        self.resident = len(resident) - evicted
+        self.evicted += evicted
+        if evicted:
+            log_utils.print_and_log(
+                logging.INFO, f'Evicted {evicted} idle conversations, {self.resident} resident'
+            )
+
+    def _run_evictions(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.evict_idle()
+            except Exception as e:
+                log_utils.print_and_log(logging.WARN, f'Evicting sessions failed: {repr(e)}')
+
+    def stats(self) -> dict:
+        return {'resident': self.resident, 'evicted': self.evicted}
+
+    def shutdown(self):
+        self.keep_running = False
+        self._stopped.set()
+        self.evict_thread.join()
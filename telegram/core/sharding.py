@@ -0,0 +1,275 @@
+import bisect
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Union
+
+import parlai.chat_service.utils.logging as log_utils
+
+from telegram.message_sender import TelegramAPIError, log_chunk_error, split_text
+
+# Virtual nodes per shard, spreading chats evenly over the ring
+DEFAULT_REPLICAS = 64
+SHUTDOWN_TIMEOUT = 10 * 60
+# Chat actions do not count against the message rate limits, send them right away
+UNPACED_METHODS = {'send_chat_action', 'typing_on'}
+# Seconds between two restarts of a crashed shard worker, so a worker dying on
+# startup is not restarted for every update
+RESTART_MIN_INTERVAL = 10
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping keys (chat ids) to shards.
+
+    Uses md5 rather than ``hash()``, which is salted per process, so every
+    process and every restart maps a chat to the same shard.
+    """
+
+    def __init__(self, nodes, replicas: int = DEFAULT_REPLICAS):
+        ring = sorted(
+            (self._hash(f'{node}-{replica}'), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in ring]
+        self._nodes = [node for _, node in ring]
+
+    @staticmethod
+    def _hash(key) -> int:
+        return int.from_bytes(hashlib.md5(str(key).encode('utf-8')).digest()[:8], 'big')
+
+    def node_for(self, key):
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+def chat_id_of(event: dict):
+    """
+    Return the id of the chat an update belongs to, or None if it has none.
+    """
+    for value in event.values():
+        if isinstance(value, dict):
+            chat = value.get('chat') or value.get('message', {}).get('chat')
+            if chat is not None:
+                return chat['id']
+            if 'from' in value:
+                return value['from']['id']
+    return None
+
+
+class RemoteSender:
+    """
+    MessageSender stand-in for shard workers.
+
+    Bot API calls are forwarded to the main process, which sends the messages of
+    every shard through one sender so rate limits stay global. Results come back
+    through ``resolve``.
+    """
+
+    def __init__(self, shard: int, outbox):
+        self.shard = shard
+        self.outbox = outbox
+        # The pid keeps the ids of a restarted worker apart from results still
+        # on their way to the worker it replaces
+        self._request_ids = zip(itertools.repeat(os.getpid()), itertools.count())
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _call(self, chat_id: Union[int, str], method_name: str, *args) -> Future:
+        future = Future()
+        with self._lock:
+            request_id = next(self._request_ids)
+            self._pending[request_id] = future
+        self.outbox.put(('call', self.shard, request_id, chat_id, method_name, args))
+        return future
+
+    def resolve(self, request_id: tuple, error, result):
+        with self._lock:
+            future = self._pending.pop(request_id, None)
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def send_read(self, chat_id):
+        pass
+
+    def send_chat_action(self, chat_id: Union[int, str], action: str) -> Future:
+        return self._call(chat_id, 'send_chat_action', action)
+
+    def typing_to(self, chat_id: Union[int, str]) -> Future:
+        return self.send_chat_action(chat_id, 'typing')
+
+    def typing_on(self, chat_id: Union[int, str], persona_id: str = None):
+        self._call(chat_id, 'typing_on')
+
+    def send_message(self, chat_id: Union[int, str], text: str, reply_to_message_id: int = None):
+        return self.send_message_async(chat_id, text, reply_to_message_id).result()
+
+    def send_message_async(
+        self, chat_id: Union[int, str], text: str, reply_to_message_id: int = None
+    ) -> Future:
+        # Chunks are queued in order, so the main process sends them in order
+        chunks = split_text(text)
+        for chunk in chunks[:-1]:
+            future = self._call(chat_id, 'send_message', chunk, reply_to_message_id)
+            future.add_done_callback(log_chunk_error)
+            reply_to_message_id = None
+        return self._call(chat_id, 'send_message', chunks[-1], reply_to_message_id)
+
+    def edit_message_text_async(self, chat_id: Union[int, str], message_id: int, text: str) -> Future:
+        return self._call(chat_id, 'edit_message_text', message_id, text)
+
+    def stats(self) -> dict:
+        return {'pending': len(self._pending)}
+
+    def shutdown(self):
+        pass
+
+
+class ShardPool:
+    """
+    Worker processes that each own the conversations of a slice of the chats.
+
+    Updates are routed by consistent hash of their chat id, so a chat's worlds
+    and agent state always live in the same worker. Workers send through the
+    main process's MessageSender, which the outbox thread drives.
+    """
+
+    def __init__(self, target, opt, shards: int, sender):
+        """
+        :param target:
+            function ``target(opt, shard, inbox, outbox)`` run by every worker
+        :param opt:
+            options passed to the workers
+        :param shards:
+            number of worker processes
+        :param sender:
+            MessageSender doing the Bot API calls of all workers
+        """
+        # Only the parent of the workers needs multiprocessing
+        import multiprocessing
+
+        self.sender = sender
+        self.target = target
+        self.opt = opt
+        self.ring = HashRing(range(shards))
+        self.stopping = False
+        self.restarts = 0
+        self._unpaced = ThreadPoolExecutor(max_workers=4, thread_name_prefix='Shard-Action')
+        self._context = multiprocessing.get_context('spawn')
+        self._restart_lock = threading.Lock()
+        self._started_at = [0.0] * shards
+        self.outbox = self._context.Queue()
+        self.inboxes = [self._context.Queue() for _ in range(shards)]
+        self.processes = [self._start_worker(shard) for shard in range(shards)]
+        self.outbox_thread = threading.Thread(
+            target=self._run_outbox, name='Shard-Outbox-Thread'
+        )
+        self.outbox_thread.daemon = True
+        self.outbox_thread.start()
+
+    def _start_worker(self, shard: int):
+        process = self._context.Process(
+            target=self.target,
+            args=(self.opt, shard, self.inboxes[shard], self.outbox),
+            name=f'Telegram-Shard-{shard}',
+            daemon=True,
+        )
+        process.start()
+        self._started_at[shard] = time.monotonic()
+        return process
+
+    def _ensure_alive(self, shard: int) -> bool:
+        """
+        Restart the worker of shard if it died.
+
+        :return:
+            False if the worker is dead and was restarted too recently to try again
+        """
+        if self.processes[shard].is_alive():
+            return True
+        with self._restart_lock:
+            process = self.processes[shard]
+            if process.is_alive() or self.stopping:
+                return process.is_alive()
+            if time.monotonic() - self._started_at[shard] < RESTART_MIN_INTERVAL:
+                return False
+            log_utils.print_and_log(
+                logging.ERROR,
+                f'{process.name} died (exit code {process.exitcode}), restarting it; '
+                f'the conversations of its chats start over',
+                should_print=True,
+            )
+            self.restarts += 1
+            self.processes[shard] = self._start_worker(shard)
+            return True
+
+    def route(self, event: dict):
+        """
+        Hand an update to the worker owning its chat, restarting the worker if
+        it crashed.
+        """
+        chat_id = chat_id_of(event)
+        shard = 0 if chat_id is None else self.ring.node_for(chat_id)
+        if not self._ensure_alive(shard):
+            log_utils.print_and_log(
+                logging.ERROR,
+                f'Dropping update {event.get("update_id")}: shard {shard} is down',
+                should_print=True,
+            )
+            return
+        self.inboxes[shard].put(('update', event))
+
+    def alive(self) -> int:
+        return sum(process.is_alive() for process in self.processes)
+
+    def _run_outbox(self):
+        while True:
+            request = self.outbox.get()
+            if request is None:
+                return
+            _, shard, request_id, chat_id, method_name, args = request
+            if method_name in UNPACED_METHODS:
+                method = getattr(self.sender, method_name)
+                future = self._unpaced.submit(method, chat_id, *args)
+            else:
+                future = self.sender.submit(chat_id, method_name, *args)
+            future.add_done_callback(self._reply_to(shard, request_id))
+
+    def _reply_to(self, shard: int, request_id: tuple):
+        def _reply(future):
+            error = future.exception()
+            if error is not None and not isinstance(error, TelegramAPIError):
+                # Arbitrary exceptions may not survive pickling
+                error = RuntimeError(repr(error))
+            result = None if error is not None else future.result()
+            self.inboxes[shard].put(('result', request_id, error, result))
+
+        return _reply
+
+    def shutdown(self):
+        """
+        Let the workers finish their conversations and stop them.
+        """
+        self.stopping = True
+        for inbox in self.inboxes:
+            inbox.put(('stop',))
+        for process in self.processes:
+            process.join(SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                log_utils.print_and_log(
+                    logging.WARN, f'{process.name} did not stop, terminating it'
+                )
+                process.terminate()
+        self.outbox.put(None)
+        # Calls still in the outbox go out before their executor closes
+        self.outbox_thread.join()
+        self._unpaced.shutdown()
@@ -1,6 +1,7 @@
 import errno
 import json
 import logging
+import random
 import threading
 import time
 
@@ -8,14 +9,210 @@ import parlai.chat_service.utils.logging as log_utils
 import websocket
 from parlai.chat_service.core.socket import ChatServiceMessageSocket
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 SOCKET_TIMEOUT = 6
+# Seconds between pings on an idle connection, doubled up to the maximum while
+# traffic keeps the connection busy. Heroku closes sockets idle for 55 seconds
+HEARTBEAT_MIN_INTERVAL = 5
+HEARTBEAT_MAX_INTERVAL = 30
+# Seconds without any frame after a ping before the connection is considered dead
+HEARTBEAT_TIMEOUT = 10
+RECONNECT_BASE_DELAY = 0.2
+RECONNECT_MAX_DELAY = 30
+# Seconds before asking the server to replay packets the manager refused
+REPLAY_DELAY = 1.0
 
 
 # Socket handler
 class TelegramServiceMessageSocket(ChatServiceMessageSocket):
     def __init__(self, server_url, port, message_callback):
+        # Set while the server has accepted the connection
+        self.ready = threading.Event()
+        self.last_activity = time.time()
+        self.reconnect_attempts = 0
+        self.heartbeat_thread = None
+        # Last packet handled and acknowledged, and the first one refused since,
+        # which the packets after it wait for as acks are cumulative
+        self.acked_seq = 0
+        self.refused_seq = None
+        self._replay_timer = None
         super().__init__(server_url, port, message_callback)
 
+    def _safe_send(self, data, force=False):
+        # Wait up to a second for the connection to come back up
+        if not force and not self.ready.wait(1):
+            return False
+        try:
+            self.ws.send(data)
+        except (websocket.WebSocketConnectionClosedException, AttributeError):
+            # The channel died mid-send, wait for it to come back up
+            return False
+        return True
+
+    def _send_world_alive(self):
+        """
+        Registers world with the passthrough server, offering the frame codecs and
+        batching this side understands.
+        """
+        codecs = ['json'] if msgpack is None else ['msgpack', 'json']
+        self._safe_send(
+            json.dumps(
+                {
+                    'type': 'world_alive',
+                    'content': {
+                        'id': 'WORLD_ALIVE',
+                        'sender_id': 'world',
+                        'codecs': codecs,
+                        'batching': True,
+                    },
+                }
+            ),
+            force=True,
+        )
+
+    @staticmethod
+    def _decode_frame(data):
+        # msgpack frames are sent as binary, JSON frames as text
+        if isinstance(data, bytes):
+            return msgpack.unpackb(data, raw=False)
+        return json.loads(data)
+
+    def _handle_packet(self, packet_dict) -> bool:
+        """
+        Hand a packet to the manager.
+
+        :return:
+            False if the manager refused it (ingress queue full)
+        """
+        message_data = packet_dict['content']
+        log_utils.print_and_log(
+            logging.DEBUG, f'Message data received: {message_data}'
+        )
+        try:
+            return self.message_callback(message_data) is not False
+        except Exception as e:
+            # Acknowledge anyway, a replay would fail the same way
+            log_utils.print_and_log(
+                logging.ERROR, f'Message handling failed: {repr(e)}'
+            )
+            return True
+
+    def _handle_frame(self, packets):
+        """
+        Handle the packets of a frame in order and acknowledge the handled ones.
+
+        Once a packet is refused, it and every packet after it stay
+        unacknowledged; the server replays them, in order, when asked again.
+        """
+        handled_seq = None
+        for packet in packets:
+            seq = packet.get('seq')
+            if seq is None:
+                self._handle_packet(packet)
+                continue
+            if seq <= self.acked_seq:
+                # Replayed, but handled before
+                continue
+            if self.refused_seq is not None and seq > self.refused_seq:
+                # Waits for the refused packet to come back first
+                continue
+            if not self._handle_packet(packet):
+                self.refused_seq = seq
+                self._schedule_replay()
+                break
+            self.refused_seq = None
+            handled_seq = self.acked_seq = seq
+        if handled_seq is not None:
+            self._send_ack(handled_seq)
+
+    def _on_frame(self, data):
+        """
+        Handle a frame received from the server.
+        """
+        self.last_activity = time.time()
+        packet_dict = self._decode_frame(data)
+        if packet_dict['type'] == 'conn_success':
+            # A restarted server numbers its packets from 1 again, redelivered
+            # updates are dropped by their update_id
+            self.acked_seq = 0
+            self.refused_seq = None
+            self.alive = True
+            self.reconnect_attempts = 0
+            self.ready.set()
+            return  # No action for successful connection
+        if packet_dict['type'] == 'pong':
+            self.last_pong = self.last_activity
+            return  # No further action for pongs
+        if packet_dict['type'] == 'batch':
+            packets = packet_dict['content']
+        else:
+            packets = [packet_dict]
+        self._handle_frame(packets)
+        # A slow callback must not look like a dead connection
+        self.last_activity = time.time()
+
+    def _schedule_replay(self):
+        """
+        Ask the server to send the unacknowledged packets again in a moment.
+        """
+        if self._replay_timer is not None and self._replay_timer.is_alive():
+            return
+        log_utils.print_and_log(
+            logging.WARN, f'Packet {self.refused_seq} refused, asking for a replay'
+        )
+        # Registering again makes the server replay what was not acknowledged
+        self._replay_timer = threading.Timer(REPLAY_DELAY, self._send_world_alive)
+        self._replay_timer.name = 'Socket-Replay-Thread'
+        self._replay_timer.daemon = True
+        self._replay_timer.start()
+
+    def _send_ack(self, seq):
+        """
+        Tell the server that every packet up to seq was handled, so it stops
+        buffering them for replay.
+        """
+        self._safe_send(json.dumps({'type': 'ack', 'content': {'seq': seq}}))
+
+    def _reconnect_delay(self) -> float:
+        """
+        Exponential backoff with full jitter, so a fleet of bots does not reconnect
+        to a restarted server all at once.
+        """
+        delay = min(
+            RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** self.reconnect_attempts
+        )
+        self.reconnect_attempts += 1
+        return random.uniform(0, delay)
+
+    def _run_heartbeat(self):
+        """
+        Ping the server only when the connection has been quiet, backing off while
+        messages keep flowing, and drop connections that stop answering.
+        """
+        interval = HEARTBEAT_MIN_INTERVAL
+        while self.keep_running:
+            self.ready.wait()
+            time.sleep(interval)
+            if not self.ready.is_set():
+                continue
+            if time.time() - self.last_activity < interval:
+                # Traffic proves the connection is alive
+                interval = min(interval * 2, HEARTBEAT_MAX_INTERVAL)
+                continue
+            interval = HEARTBEAT_MIN_INTERVAL
+            ping_time = time.time()
+            self._safe_send(json.dumps({'type': 'ping', 'content': 'ping'}))
+            time.sleep(HEARTBEAT_TIMEOUT)
+            if self.ready.is_set() and self.last_activity < ping_time:
+                log_utils.print_and_log(
+                    logging.WARN, 'Server stopped answering pings, reconnecting'
+                )
+                self._ensure_closed()
+
     def _setup_socket(self):
         """
         Create socket handlers and registers the socket.
@@ -54,24 +251,14 @@ class TelegramServiceMessageSocket(ChatServiceMessageSocket):
                 logging.INFO, 'World server disconnected: {}'.format(args)
             )
             self.alive = False
+            self.ready.clear()
             self._ensure_closed()
 
         def on_message(*args):
             """
             Incoming message handler for messages from the FB user.
             """
-            packet_dict = json.loads(args[1])
-            if packet_dict['type'] == 'conn_success':
-                self.alive = True
-                return  # No action for successful connection
-            if packet_dict['type'] == 'pong':
-                self.last_pong = time.time()
-                return  # No further action for pongs
-            message_data = packet_dict['content']
-            log_utils.print_and_log(
-                logging.DEBUG, f'Message data received: {message_data}'
-            )
-            self.message_callback(message_data)
+            self._on_frame(args[1])
 
         def run_socket(*args):
             url_base_name = self.server_url.split('https://')[1]
@@ -85,13 +272,15 @@ class TelegramServiceMessageSocket(ChatServiceMessageSocket):
                         on_close=on_disconnect,
                     )
                     self.ws.on_open = on_socket_open
-                    self.ws.run_forever(ping_interval=1, ping_timeout=0.9)
+                    self.ws.run_forever()
                 except Exception as e:
                     log_utils.print_and_log(
                         logging.WARN,
                         'Socket error {}, attempting restart'.format(repr(e)),
                     )
-                time.sleep(0.2)
+                self.alive = False
+                self.ready.clear()
+                time.sleep(self._reconnect_delay())
 
         # Start listening thread
         self.listen_thread = threading.Thread(
@@ -99,10 +288,12 @@ class TelegramServiceMessageSocket(ChatServiceMessageSocket):
         )
         self.listen_thread.daemon = True
         self.listen_thread.start()
-        time.sleep(1.2)
-        while not self.alive:
-            try:
-                self._send_world_alive()
-            except Exception:
-                pass
-            time.sleep(0.8)
+        self.heartbeat_thread = threading.Thread(
+            target=self._run_heartbeat, name='Socket-Heartbeat-Thread'
+        )
+        self.heartbeat_thread.daemon = True
+        self.heartbeat_thread.start()
+        while not self.ready.wait(SOCKET_TIMEOUT):
+            log_utils.print_and_log(
+                logging.INFO, 'Waiting for the server to accept the socket...'
+            )
@@ -0,0 +1,153 @@
+import logging
+import threading
+from concurrent.futures import Future
+
+import parlai.chat_service.utils.logging as log_utils
+
+from telegram.message_sender import MAX_TEXT_CHARS, TelegramAPIError, split_text
+
+
+class StreamingReply:
+    """
+    A reply shown to the user while it is still being generated.
+
+    The first piece of text is posted right away and later text is applied with
+    ``editMessageText``. At most one send or edit per reply is queued at a time,
+    updates arriving meanwhile are coalesced into the next edit, so the edit rate
+    is bounded by the sender's pacing of the chat however fast text arrives.
+    Text beyond Telegram's limit continues in a new message. Once a send or edit
+    fails the reply stops, and later text is ignored.
+    """
+
+    def __init__(self, sender, chat_id, limit: int = MAX_TEXT_CHARS):
+        """
+        :param sender:
+            MessageSender the messages are sent with
+        :param chat_id:
+            chat the reply goes to
+        :param limit:
+            maximum length of one message
+        """
+        self.sender = sender
+        self.chat_id = chat_id
+        self.limit = limit
+        self.text = ''
+        # Messages of the reply, one per chunk, and their text as last sent
+        self.messages = []
+        self._sent_texts = []
+        # Text of the reply before the message currently being streamed
+        self._offset = 0
+        self._message_id = None
+        self._in_flight = False
+        self._dirty = False
+        self._finished = False
+        self._failed = False
+        self._done = Future()
+        self._lock = threading.Lock()
+
+    def append(self, text: str):
+        """
+        Add text to the end of the reply.
+        """
+        self.update(self.text + text)
+
+    def update(self, text: str):
+        """
+        Replace the whole text of the reply, which may only grow.
+        """
+        with self._lock:
+            if self._failed:
+                return
+            if self._finished:
+                raise RuntimeError('Reply is already finished')
+            self.text = text
+            self._flush()
+
+    def finish(self, text: str = None) -> Future:
+        """
+        Send the final text of the reply.
+
+        :return:
+            Future resolved with the Message object of the last message once
+            everything was delivered
+        """
+        with self._lock:
+            if text is not None:
+                self.text = text
+            self._finished = True
+            self._flush()
+            self._resolve_if_done()
+        return self._done
+
+    def _flush(self):
+        if self._failed:
+            return
+        if self._in_flight:
+            self._dirty = True
+            return
+        current = self.text[self._offset:]
+        if not current.strip():
+            # Telegram refuses empty messages
+            return
+        roll_over = False
+        if len(current) > self.limit:
+            current = split_text(current, self.limit)[0]
+            roll_over = True
+        if self._message_id is not None and self._sent_texts[-1].rstrip() == current.rstrip():
+            # Telegram strips trailing whitespace and refuses edits changing nothing
+            if roll_over:
+                self._roll_over(len(current))
+                self._flush()
+            return
+        if self._message_id is None:
+            future = self.sender.send_message_async(self.chat_id, current)
+        else:
+            future = self.sender.edit_message_text_async(self.chat_id, self._message_id, current)
+        self._in_flight = True
+        future.add_done_callback(lambda fut: self._on_sent(fut, current, roll_over))
+
+    def _on_sent(self, future: Future, text: str, roll_over: bool):
+        with self._lock:
+            self._in_flight = False
+            error = future.exception()
+            not_modified = self._message_id is not None and _is_not_modified(error)
+            if error is not None and not not_modified:
+                log_utils.print_and_log(
+                    logging.ERROR, f'Streaming reply to {self.chat_id} failed: {repr(error)}'
+                )
+                self._failed = True
+                self._finished = True
+                self._done.set_exception(error)
+                return
+            # An edit Telegram found to change nothing leaves the message as it was
+            message = future.result() if error is None else self.messages[-1]
+            if self._message_id is None:
+                self._message_id = message['message_id']
+                self.messages.append(message)
+                self._sent_texts.append(text)
+            else:
+                self.messages[-1] = message
+                self._sent_texts[-1] = text
+            if roll_over:
+                self._roll_over(len(text))
+                self._dirty = True
+            if self._dirty:
+                self._dirty = False
+                self._flush()
+            self._resolve_if_done()
+
+    def _roll_over(self, length: int):
+        """
+        Continue the reply in a new message after the first length characters
+        of the current one, which is full.
+        """
+        self._offset += length
+        self._message_id = None
+
+    def _resolve_if_done(self):
+        if self._finished and not self._in_flight and not self._done.done():
+            self._done.set_result(self.messages[-1] if self.messages else None)
+
+
+def _is_not_modified(error: Exception) -> bool:
+    return isinstance(error, TelegramAPIError) and 'message is not modified' in error.description
@@ -0,0 +1,180 @@
+import asyncio
+import hmac
+import json
+import logging
+import threading
+
+import parlai.chat_service.utils.logging as log_utils
+
+SECRET_TOKEN_HEADER = 'x-telegram-bot-api-secret-token'
+# Largest request body read, updates are a few kilobytes at most
+MAX_BODY_BYTES = 1024 * 1024
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    503: 'Service Unavailable',
+}
+
+
+class TelegramWebhookReceiver:
+    """
+    Receives webhook updates over plain HTTP inside the manager process.
+
+    Replaces the node relay server: Telegram (through a TLS terminator such as
+    nginx in front of ``host:port``) POSTs updates straight to this process, which
+    parses each body once and hands it to the manager. The response is only sent
+    after the manager took the update (queued it, see ``IngressQueue``), so
+    Telegram delivers updates one by one per connection.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        message_callback,
+        path: str = '/webhook',
+        secret_token: str = None,
+    ):
+        """
+        :param host:
+            interface to listen on
+        :param port:
+            port to listen on
+        :param message_callback:
+            function called with every incoming update; returning False
+            refuses it with 503
+        :param path:
+            HTTP path updates are POSTed to
+        :param secret_token:
+            if set, requests must carry it in the X-Telegram-Bot-Api-Secret-Token
+            header
+        """
+        self.host = host
+        self.port = port
+        self.message_callback = message_callback
+        self.path = path
+        self.secret_token = secret_token
+        self.keep_running = True
+        self.loop = None
+        self._started = threading.Event()
+        self._start_error = None
+        self.listen_thread = threading.Thread(
+            target=self._run_server, name='Webhook-Receiver-Thread'
+        )
+        self.listen_thread.daemon = True
+        self.listen_thread.start()
+        self._started.wait()
+        if self._start_error is not None:
+            raise self._start_error
+
+    def _run_server(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._serve())
+        finally:
+            self.loop.close()
+
+    async def _serve(self):
+        try:
+            server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        except OSError as e:
+            self._start_error = e
+            self._started.set()
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        log_utils.print_and_log(
+            logging.INFO, f'Webhook receiver listening on {self.host}:{self.port}{self.path}'
+        )
+        self._started.set()
+        async with server:
+            while self.keep_running:
+                await asyncio.sleep(0.5)
+        # Drop idle keep-alive connections
+        connections = asyncio.all_tasks() - {asyncio.current_task()}
+        for connection in connections:
+            connection.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while self.keep_running:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                    request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                    method, target, version = request_line.split(' ', 2)
+                    headers = {}
+                    for line in header_lines:
+                        if ':' in line:
+                            name, value = line.split(':', 1)
+                            headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get('content-length', 0))
+                    if length > MAX_BODY_BYTES:
+                        # The body is left unread, so the connection cannot be reused
+                        await self._respond(writer, 413, keep_alive=False)
+                        break
+                    body = await reader.readexactly(length) if length else b''
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                    break
+                status = await self._handle_request(
+                    method, target.split('?', 1)[0], headers, body
+                )
+                keep_alive = (
+                    version.strip() == 'HTTP/1.1'
+                    and headers.get('connection', '').lower() != 'close'
+                )
+                await self._respond(writer, status, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            # Client went away or the receiver is shutting down
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status: int, keep_alive: bool):
+        writer.write(
+            f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n'
+            f'Content-Length: 0\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode(
+                'latin-1'
+            )
+        )
+        await writer.drain()
+
+    async def _handle_request(self, method, path, headers, body) -> int:
+        if path != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        # Headers were decoded as latin-1, compare the bytes the client sent so
+        # any header value is refused rather than breaking compare_digest
+        if self.secret_token is not None and not hmac.compare_digest(
+            headers.get(SECRET_TOKEN_HEADER, '').encode('latin-1'),
+            self.secret_token.encode('utf-8'),
+        ):
+            return 403
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return 400
+        if not isinstance(update, dict):
+            return 400
+        log_utils.print_and_log(logging.DEBUG, f'Update received: {update}')
+        try:
+            # The manager may block, keep the event loop free for other chats
+            accepted = await self.loop.run_in_executor(None, self.message_callback, update)
+        except Exception as e:
+            # Telegram would redeliver the update forever, drop it instead
+            log_utils.print_and_log(
+                logging.ERROR, f'Update {update.get("update_id")} failed: {repr(e)}'
+            )
+            return 200
+        if accepted is False:
+            # Overloaded, Telegram delivers the update again later
+            return 503
+        return 200
@@ -0,0 +1,373 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import parlai.chat_service.utils.logging as log_utils
+import parlai.chat_service.utils.misc as utils
+from parlai.chat_service.core.world_runner import ChatServiceWorldRunner
+
+from telegram.core.metrics import WORLD_PARLEY_SECONDS
+from telegram.core.profiling import profile_section
+
+# Seconds an idle world waits for input before parleying anyway, so worlds with
+# act timeouts still notice them
+IDLE_PARLEY_INTERVAL = 5.0
+# Seconds the thread runner sleeps between two parleys of a world
+THREAD_PARLEY_INTERVAL = 0.3
+# Seconds the asyncio runner lets its worlds finish at shutdown before
+# cancelling them. A cancelled world never resolves its future, so its done
+# callbacks do not run
+SHUTDOWN_GRACE = 2.0
+
+
+def timed_parley(world):
+    """
+    Parley world once, recording how long it took and profiling it if enabled.
+    """
+    name = type(world).__name__
+    with WORLD_PARLEY_SECONDS.time(world=name), profile_section(f'parley:{name}'):
+        return world.parley()
+
+
+class ThreadWorldRunner(ChatServiceWorldRunner):
+    """
+    The default world runner, one executor thread per conversation, recording
+    the duration of task and onboarding world parleys.
+
+    Worlds are parleyed every ``THREAD_PARLEY_INTERVAL`` seconds, or right away
+    when one of their agents gets a message; time a world spent in parley
+    waiting for input (``act(blocking=True)``) counts towards the interval.
+    """
+
+    def stop_world(self, task_name):
+        """
+        End the world of task_name after its current parley, as if its
+        episode was done.
+        """
+        task = self.tasks.get(task_name)
+        if task is not None:
+            task.stopped = True
+
+    def _run_world(self, task, world_name, agents):
+        """
+        Run a world until completion.
+
+        :return:
+            ret_val: last output of world's parley function. Return None if ERROR
+            world_data: data attribute of world, if it has one
+        """
+        ret_val = None
+        world_generator = utils.get_world_fn_attr(
+            self._world_module, world_name, 'generate_world'
+        )
+        world = world_generator(self.opt, agents)
+        task.world = world
+        # Onboarding worlds run as part of the overworld task and are not saved
+        saved = not task.is_overworld
+        if saved:
+            self.manager.restore_world_state(world, agents)
+
+        wakeup = threading.Event()
+
+        def _on_message(agent):
+            wakeup.set()
+
+        for agent in agents:
+            if hasattr(agent, 'add_message_listener'):
+                agent.add_message_listener(_on_message)
+        try:
+            while (
+                not world.episode_done()
+                and not self.system_done
+                and not getattr(task, 'stopped', False)
+            ):
+                wakeup.clear()
+                start = time.monotonic()
+                ret_val = timed_parley(world)
+                if saved:
+                    self.manager.snapshot_world_state(world, agents)
+                # A world that waited for input in parley goes on right away
+                wakeup.wait(max(0.0, THREAD_PARLEY_INTERVAL - (time.monotonic() - start)))
+        finally:
+            for agent in agents:
+                if hasattr(agent, 'remove_message_listener'):
+                    agent.remove_message_listener(_on_message)
+        world.shutdown()
+        world_data = world.data if hasattr(world, 'data') else {}
+        return ret_val, world_data
+
+
+class AsyncWorldRunner(ChatServiceWorldRunner):
+    """
+    World runner keeping every world loop as a coroutine on one event loop.
+
+    The thread runner parks one executor thread per conversation, polling
+    ``parley`` every 0.3 seconds, so ``max_workers`` conversations at most can be
+    open at once. Here a world only takes an executor thread while ``parley``
+    actually runs (including model inference) and otherwise waits for one of its
+    agents to receive a message, so ``max_workers`` bounds concurrent turns and an
+    idle conversation costs no thread at all.
+    """
+
+    def __init__(self, opt, world_path, max_workers, manager, is_debug=False):
+        super().__init__(opt, world_path, max_workers, manager, is_debug)
+        self.loop = asyncio.new_event_loop()
+        # Wake-up events of the running worlds, set when an agent gets a message
+        self._wakeups = set()
+        self.loop_thread = threading.Thread(
+            target=self.loop.run_forever, name='World-Runner-Loop-Thread'
+        )
+        self.loop_thread.daemon = True
+        self.loop_thread.start()
+
+    def shutdown(self):
+        """
+        Shutdown the world runner.
+        """
+        self.system_done = True
+        self.loop.call_soon_threadsafe(self._wake_all)
+        # Worlds are ended here rather than closed with the loop once it stops
+        asyncio.run_coroutine_threadsafe(
+            self._end_pending(SHUTDOWN_GRACE), self.loop
+        ).result()
+        super().shutdown()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def _end_pending(self, grace: float):
+        """
+        Give the woken worlds grace seconds to finish, then cancel the others.
+        """
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=grace)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def stop_world(self, task_name):
+        """
+        End the world of task_name after its current parley, as if its
+        episode was done.
+        """
+        task = self.tasks.get(task_name)
+        if task is None:
+            return
+        task.stopped = True
+        # Waking every world once is cheaper than tracking which event is whose
+        self.loop.call_soon_threadsafe(self._wake_all)
+
+    def _wake_all(self):
+        for wakeup in self._wakeups:
+            wakeup.set()
+
+    def _submit(self, coro) -> Future:
+        """
+        Schedule coro on the loop and return a Future that, like an executor
+        future, is running while the coroutine runs.
+        """
+        future = Future()
+
+        async def _run():
+            # Nothing starts once the runner shuts down
+            if self.system_done or not future.set_running_or_notify_cancel():
+                coro.close()
+                return
+            try:
+                result = await coro
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+        asyncio.run_coroutine_threadsafe(_run(), self.loop)
+        return future
+
+    async def _call(self, fn, *args):
+        return await self.loop.run_in_executor(self.executor, fn, *args)
+
+    @staticmethod
+    def _backlog(agents) -> int:
+        return sum(agent.msg_queue.qsize() for agent in agents)
+
+    async def _wait_for_input(self, wakeup: asyncio.Event):
+        """
+        Wait until one of the agents gets a new message.
+        """
+        try:
+            await asyncio.wait_for(wakeup.wait(), IDLE_PARLEY_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+    def _listen(self, agents, wakeup: asyncio.Event):
+        def _on_message(agent):
+            self.loop.call_soon_threadsafe(wakeup.set)
+
+        for agent in agents:
+            if hasattr(agent, 'add_message_listener'):
+                agent.add_message_listener(_on_message)
+        self._wakeups.add(wakeup)
+        return _on_message
+
+    def _unlisten(self, agents, wakeup: asyncio.Event, listener):
+        for agent in agents:
+            if hasattr(agent, 'remove_message_listener'):
+                agent.remove_message_listener(listener)
+        self._wakeups.discard(wakeup)
+
+    async def _parley_until_done(self, world, agents, on_parley=None, saved=False, task=None):
+        """
+        Parley world until its episode is done, parleying again once the agents
+        have new input.
+
+        :param saved:
+            snapshot the state of the world after every parley
+        :param task:
+            TaskState of the world, which ``stop_world`` ends early
+
+        :return:
+            last output of the world's parley function, or the first output
+            on_parley accepted
+        """
+        ret_val = None
+        wakeup = asyncio.Event()
+        listener = self._listen(agents, wakeup)
+        try:
+            while (
+                not world.episode_done()
+                and not self.system_done
+                and not getattr(task, 'stopped', False)
+            ):
+                wakeup.clear()
+                backlog = self._backlog(agents)
+                ret_val = await self._call(timed_parley, world)
+                if saved:
+                    self.manager.snapshot_world_state(world, agents)
+                if on_parley is not None and await on_parley(ret_val):
+                    return ret_val
+                if world.episode_done() or wakeup.is_set():
+                    continue
+                # Parley again right away while it works through queued messages
+                if backlog == 0 or self._backlog(agents) >= backlog:
+                    await self._wait_for_input(wakeup)
+        finally:
+            self._unlisten(agents, wakeup, listener)
+        return ret_val
+
+    async def _run_world_async(self, task, world_name, agents):
+        """
+        Run a world until completion.
+
+        :return:
+            ret_val: last output of world's parley function. Return None if ERROR
+            world_data: data attribute of world, if it has one
+        """
+        world_generator = utils.get_world_fn_attr(
+            self._world_module, world_name, 'generate_world'
+        )
+        world = await self._call(world_generator, self.opt, agents)
+        task.world = world
+        # Onboarding worlds run as part of the overworld task and are not saved
+        saved = not task.is_overworld
+        if saved:
+            self.manager.restore_world_state(world, agents)
+        ret_val = await self._parley_until_done(world, agents, saved=saved, task=task)
+        await self._call(world.shutdown)
+        world_data = world.data if hasattr(world, 'data') else {}
+        return ret_val, world_data
+
+    def launch_task_world(self, task_name, world_name, agents):
+        """
+        Launch a task world.
+
+        Return the job's future.
+
+        :param task_name:
+            string. the name of the job thread
+        :param world_name:
+            string. the name of the task world in the module file
+        :param agents:
+            list. the list of agents to install in the world
+
+        :return:
+            the Futures object corresponding to this launched task
+        """
+        task = utils.TaskState(task_name, world_name, agents)
+        self.tasks[task_name] = task
+
+        async def _world_fn():
+            log_utils.print_and_log(
+                logging.INFO, 'Starting task {}...'.format(task_name)
+            )
+            return await self._run_world_async(task, world_name, agents)
+
+        fut = self._submit(_world_fn())
+        task.future = fut
+        return fut
+
+    def launch_overworld(self, task_name, overworld_name, onboard_map, overworld_agent):
+        """
+        Launch an overworld and a subsequent onboarding world.
+
+        Return the job's future
+
+        :param task_name:
+            string. the name of the job thread
+        :param overworld_name:
+            string. the name of the overworld in the module file
+        :param onboard_map:
+            map. a mapping of overworld return values to the names
+            of onboarding worlds in the module file.
+        :param overworld_agent:
+            The agent to run the overworld with
+
+        :return:
+            the Futures object corresponding to running the overworld
+        """
+        task = utils.TaskState(
+            task_name,
+            overworld_name,
+            [overworld_agent],
+            is_overworld=True,
+            world_type=None,
+        )
+        self.tasks[task_name] = task
+        agent_state = self.manager.get_agent_state(overworld_agent.id)
+
+        async def _on_world_type(world_type):
+            if world_type is None:
+                return False
+            if world_type == self.manager.EXIT_STR:
+                await self._call(self.manager._remove_agent, overworld_agent.id)
+                return True
+
+            # perform onboarding
+            onboard_type = onboard_map.get(world_type)
+            if onboard_type:
+                onboard_id = 'onboard-{}-{}'.format(overworld_agent.id, time.time())
+                agent = self.manager._create_agent(onboard_id, overworld_agent.id)
+                agent.data = overworld_agent.data
+                agent_state.set_active_agent(agent)
+                agent_state.assign_agent_to_task(agent, onboard_id)
+                _, onboard_data = await self._run_world_async(task, onboard_type, [agent])
+                agent_state.onboard_data = onboard_data
+                agent_state.data = agent.data
+            await self._call(self.manager.add_agent_to_pool, agent_state, world_type)
+            log_utils.print_and_log(logging.INFO, 'onboarding/overworld complete')
+            return False
+
+        async def _world_function():
+            world_generator = utils.get_world_fn_attr(
+                self._world_module, overworld_name, 'generate_world'
+            )
+            overworld = await self._call(world_generator, self.opt, [overworld_agent])
+            return await self._parley_until_done(
+                overworld, [overworld_agent], on_parley=_on_world_type
+            )
+
+        fut = self._submit(_world_function())
+        task.future = fut
+        return fut
@@ -1,15 +1,82 @@
+import functools
 import logging
+import time
+from concurrent.futures import Future
 from typing import Union
 
 import requests
 from parlai.chat_service.utils import logging as log_utils
+from requests.adapters import HTTPAdapter
+
+from telegram.core.chat_actions import ChatActionDispatcher
+from telegram.core.dispatcher import ChatDispatcher, RetryLater
+from telegram.core.metrics import BOT_API_SECONDS, FLOOD_WAITS
+from telegram.core.rate_limiter import (
+    GLOBAL_MESSAGES_PER_SECOND,
+    PRIVATE_CHAT_MESSAGES_PER_SECOND,
+    RateGovernor,
+)
 
 MAX_TEXT_CHARS = 4096
+DEFAULT_POOL_SIZE = 16
+DEFAULT_SEND_WORKERS = 8
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_API_BASE = 'https://api.telegram.org'
+
+
+class TelegramAPIError(Exception):
+    """
+    Error response of the Bot API.
+    """
+
+    def __init__(self, description: str, error_code: int = None, parameters: dict = None):
+        super().__init__(description)
+        self.description = description
+        self.error_code = error_code
+        self.parameters = parameters or {}
+
+    def __reduce__(self):
+        # Keep error_code and parameters when the error crosses processes
+        return type(self), (self.description, self.error_code, self.parameters)
+
+    @property
+    def retry_after(self):
+        """
+        Seconds to wait before repeating the request, if Telegram asked for it.
+        """
+        return self.parameters.get('retry_after')
+
+
+def split_text(text: str, limit: int = MAX_TEXT_CHARS) -> list:
+    """
+    Split text into chunks Telegram accepts, preferring line and word breaks.
+
+    The chunks concatenate back to text.
+    """
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = text.rfind(' ', 0, limit)
+        # Keep the separator at the end of the chunk it closes
+        cut = limit if cut <= 0 else cut + 1
+        chunks.append(text[:cut])
+        text = text[cut:]
+    chunks.append(text)
+    return chunks
 
 
 def base_telegram_api_method(function):
+    @functools.wraps(function)
     def wrapper(self, *args, **kwargs):
-        response = function(self, *args, **kwargs).json()
+        start = time.monotonic()
+        status = 'error'
+        try:
+            http_response = function(self, *args, **kwargs)
+            status = http_response.status_code
+        finally:
+            BOT_API_SECONDS.observe(time.monotonic() - start, method=function.__name__, status=status)
+        response = http_response.json()
         if response['ok']:
             if 'description' in response:
                 log_utils.print_and_log(
@@ -19,20 +86,125 @@ def base_telegram_api_method(function):
                 )
             return response['result']
         else:
-            raise Exception(response['description'])
+            raise TelegramAPIError(
+                response['description'], response.get('error_code'), response.get('parameters')
+            )
 
     return wrapper
 
 
+def log_chunk_error(future: Future):
+    """
+    Done callback logging the failure of a chunk nobody waits for.
+    """
+    if not future.cancelled() and future.exception() is not None:
+        log_utils.print_and_log(
+            logging.ERROR, f'Sending part of a long message failed: {repr(future.exception())}'
+        )
+
+
 class MessageSender:
     """
     MessageSender is a wrapper around telegram requests that simplifies the
     process of sending content.
+
+    Requests go through one keep-alive session, so consecutive calls reuse the
+    TCP+TLS connections to the Bot API. The ``*_async`` methods run on a pool of
+    send workers which keeps messages to the same chat in order, paces them with a
+    ``RateGovernor`` and reschedules them when Telegram answers with a flood wait.
     """
 
-    def __init__(self, secret_token: str):
+    def __init__(
+        self,
+        secret_token: str,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        send_workers: int = DEFAULT_SEND_WORKERS,
+        global_rate: float = GLOBAL_MESSAGES_PER_SECOND,
+        chat_rate: float = PRIVATE_CHAT_MESSAGES_PER_SECOND,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        api_base: str = DEFAULT_API_BASE,
+    ):
+        """
+        :param secret_token:
+            bot access token
+        :param pool_size:
+            maximum number of keep-alive connections to the Bot API
+        :param send_workers:
+            number of threads sending messages concurrently
+        :param global_rate:
+            messages per second the bot may send in total
+        :param chat_rate:
+            messages per second the bot may send to one private chat
+        :param max_retries:
+            how many flood waits a message may hit before it fails
+        :param api_base:
+            address of the Bot API server
+        """
         self.token = secret_token
-        self.api_url = f'https://api.telegram.org/bot{self.token}'
+        self.api_url = f'{api_base.rstrip("/")}/bot{self.token}'
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.governor = RateGovernor(global_rate=global_rate, private_rate=chat_rate)
+        self.dispatcher = ChatDispatcher(
+            send_workers, name='Telegram-Sender', throttle=self.governor.acquire
+        )
+        self.chat_actions = ChatActionDispatcher(self.send_chat_action)
+
+    def _submit(self, chat_id: Union[int, str], method, *args) -> Future:
+        """
+        Queue ``method(*args)`` for chat_id, retrying it after Telegram's
+        ``retry_after`` when the bot hits flood control.
+        """
+        attempts = 0
+
+        def _call():
+            nonlocal attempts
+            attempts += 1
+            try:
+                return method(*args)
+            except TelegramAPIError as e:
+                if e.retry_after is None or attempts > self.max_retries:
+                    raise
+                log_utils.print_and_log(
+                    logging.INFO,
+                    f'Flood wait of {e.retry_after}s for chat {chat_id}, rescheduling',
+                )
+                FLOOD_WAITS.inc(method=getattr(method, '__name__', 'unknown'))
+                self.governor.retry_after(chat_id, e.retry_after)
+                raise RetryLater(e.retry_after)
+
+        return self.dispatcher.submit(chat_id, _call)
+
+    def submit(self, chat_id: Union[int, str], method_name: str, *args) -> Future:
+        """
+        Queue the Bot API method ``method_name(chat_id, *args)`` of this sender,
+        with the ordering, pacing and flood wait handling of ``send_message_async``.
+
+        :return:
+            Future resolved with the result of the method
+        """
+        return self._submit(chat_id, getattr(self, method_name), chat_id, *args)
+
+    def stats(self) -> dict:
+        """
+        Return the current throttle and queue state of the sender.
+        """
+        stats = self.governor.stats()
+        stats['queued'] = self.dispatcher.pending()
+        stats['waiting_chats'] = self.dispatcher.waiting_chats()
+        stats['typing_chats'] = self.chat_actions.busy_chats()
+        return stats
+
+    def shutdown(self):
+        """
+        Send the messages that are still queued and close the connections.
+        """
+        self.chat_actions.shutdown()
+        self.dispatcher.shutdown()
+        self.session.close()
 
     @base_telegram_api_method
     def send_chat_action(self, chat_id: Union[int, str], action: str):
@@ -48,7 +220,7 @@ class MessageSender:
             True on success
         """
         payload = {'chat_id': chat_id, 'action': action}
-        return requests.post(self.api_url + '/sendChatAction', json=payload)
+        return self.session.post(self.api_url + '/sendChatAction', json=payload)
 
     def send_read(self, chat_id):
         pass
@@ -62,6 +234,14 @@ class MessageSender:
         """
         return self.send_chat_action(chat_id, 'typing')
 
+    def typing_on(self, chat_id: Union[int, str], persona_id: str = None):
+        """
+        Show the typing indicator in chat_id until the next message is sent to it.
+
+        Returns immediately, the indicator is sent and renewed in the background.
+        """
+        self.chat_actions.start(chat_id, 'typing')
+
     @base_telegram_api_method
     def send_message(self, chat_id: Union[int, str], text: str, reply_to_message_id: int = None):
         """
@@ -76,26 +256,99 @@ class MessageSender:
         :return:
             dict with Message object
         """
+        # Telegram clears the chat action when the message arrives, stop renewing it
+        self.chat_actions.stop(chat_id)
         payload = {
             'chat_id': chat_id,
             'text': text
         }
         if reply_to_message_id:
             payload['reply_to_message_id'] = reply_to_message_id
-        return requests.post(self.api_url + '/sendMessage', json=payload)
+        return self.session.post(self.api_url + '/sendMessage', json=payload)
+
+    def send_message_async(
+        self, chat_id: Union[int, str], text: str, reply_to_message_id: int = None
+    ) -> Future:
+        """
+        Queue a message to chat_id without waiting for the Bot API.
+
+        Messages to the same chat are sent in the order they were queued. Text
+        longer than Telegram allows is sent as several messages, only the first
+        one replying to reply_to_message_id.
+
+        :return:
+            Future resolved with the Message object of the last chunk
+        """
+        chunks = split_text(text)
+        for chunk in chunks[:-1]:
+            future = self._submit(chat_id, self.send_message, chat_id, chunk, reply_to_message_id)
+            future.add_done_callback(log_chunk_error)
+            reply_to_message_id = None
+        return self._submit(chat_id, self.send_message, chat_id, chunks[-1], reply_to_message_id)
+
+    @base_telegram_api_method
+    def edit_message_text(self, chat_id: Union[int, str], message_id: int, text: str):
+        """
+        Use this method to edit text messages.
+
+        :param chat_id:
+            Unique identifier for the target chat or username of the target channel.
+        :param message_id:
+            Identifier of the message to edit.
+        :param text:
+            New text of the message, 1-4096 characters after entities parsing.
+        :return:
+            dict with the edited Message object
+        """
+        payload = {'chat_id': chat_id, 'message_id': message_id, 'text': text}
+        return self.session.post(self.api_url + '/editMessageText', json=payload)
+
+    def edit_message_text_async(self, chat_id: Union[int, str], message_id: int, text: str) -> Future:
+        """
+        Queue an edit of a message in chat_id, in order with the chat's other messages.
+
+        :return:
+            Future resolved with the edited Message object
+        """
+        return self._submit(chat_id, self.edit_message_text, chat_id, message_id, text)
+
+    @base_telegram_api_method
+    def get_updates(self, offset: int = None, limit: int = 100, timeout: int = 30):
+        """
+        Use this method to receive incoming updates using long polling.
+
+        :param offset:
+            identifier of the first update to be returned. Updates with a smaller
+            identifier are confirmed and will not be returned again.
+        :param limit:
+            limits the number of updates to be retrieved, 1-100.
+        :param timeout:
+            timeout in seconds for long polling.
+        :return:
+            list of Update objects
+        """
+        payload = {'limit': limit, 'timeout': timeout}
+        if offset is not None:
+            payload['offset'] = offset
+        # Leave the server time to answer an empty long poll
+        return self.session.post(self.api_url + '/getUpdates', json=payload, timeout=timeout + 10)
 
     @base_telegram_api_method
-    def set_webhook(self, url: str):
+    def set_webhook(self, url: str, secret_token: str = None):
         """
         Use this method to specify a url and receive incoming updates via an outgoing webhook.
 
         :param url:
             HTTPS url to send updates to. Use an empty string to remove webhook integration
+        :param secret_token:
+            if set, sent in the X-Telegram-Bot-Api-Secret-Token header of every webhook request
         :return:
             True on success
         """
         paylaod = {'url': url}
-        return requests.post(self.api_url + '/setWebhook', json=paylaod)
+        if secret_token:
+            paylaod['secret_token'] = secret_token
+        return self.session.post(self.api_url + '/setWebhook', json=paylaod)
 
     @base_telegram_api_method
     def delete_webhook(self):
@@ -105,4 +358,4 @@ class MessageSender:
         :return:
             True on success
         """
-        return requests.post(self.api_url + '/deleteWebhook')
+        return self.session.post(self.api_url + '/deleteWebhook')
@@ -67,5 +67,318 @@ class Parser(ParlaiParser):
             help='Run the server locally on this server rather than setting up'
                  ' a heroku server.',
         )
+        telegram.add_argument(
+            '--server-url',
+            dest='server_url',
+            type=str,
+            default=None,
+            help='public address of the --local relay server, like '
+                 'https://hostname.com:3000. Read from the TELEGRAM_SERVER_URL '
+                 'environment variable if not given',
+        )
+        telegram.add_argument(
+            '--server-port',
+            dest='server_port',
+            type=int,
+            default=3000,
+            help='port the --local relay server listens on',
+        )
+        telegram.add_argument(
+            '--server-ready-timeout',
+            dest='server_ready_timeout',
+            type=float,
+            default=60,
+            help='seconds to wait for the relay server to answer after starting it',
+        )
+        telegram.add_argument(
+            '--keep-server',
+            dest='keep_server',
+            action='store_true',
+            default=False,
+            help='leave the Heroku relay app running on shutdown, so the next '
+                 'launch reuses it instead of deploying again',
+        )
+        telegram.add_argument(
+            '--ingest',
+            dest='ingest',
+            choices=['relay', 'getUpdates', 'webhook'],
+            default='relay',
+            help='how updates reach the bot: through the webhook relay server, '
+                 'by long-polling getUpdates, or by a webhook receiver running '
+                 'inside this process',
+        )
+        telegram.add_argument(
+            '--webhook-host',
+            dest='webhook_host',
+            type=str,
+            default='127.0.0.1',
+            help='interface the in-process webhook receiver listens on',
+        )
+        telegram.add_argument(
+            '--webhook-port',
+            dest='webhook_port',
+            type=int,
+            default=8080,
+            help='port the in-process webhook receiver listens on',
+        )
+        telegram.add_argument(
+            '--webhook-url',
+            dest='webhook_url',
+            type=str,
+            default=None,
+            help='public HTTPS url of the TLS terminator in front of the '
+                 'in-process webhook receiver, registered with setWebhook. '
+                 'Leave empty to skip the registration, e.g. when testing on '
+                 'localhost',
+        )
+        telegram.add_argument(
+            '--poll-limit',
+            dest='poll_limit',
+            type=int,
+            default=100,
+            help='maximum number of updates fetched per getUpdates request, 1-100',
+        )
+        telegram.add_argument(
+            '--poll-timeout',
+            dest='poll_timeout',
+            type=int,
+            default=30,
+            help='long polling timeout of getUpdates requests in seconds',
+        )
+        telegram.add_argument(
+            '--telegram-api-url',
+            dest='telegram_api_url',
+            type=str,
+            default='https://api.telegram.org',
+            help='address of the Bot API server, e.g. a local Bot API server or '
+                 'the fake one from telegram.bench',
+        )
+        telegram.add_argument(
+            '--send-workers',
+            dest='send_workers',
+            type=int,
+            default=8,
+            help='number of threads sending messages to the Bot API. Messages '
+                 'to the same chat are always sent in order',
+        )
+        telegram.add_argument(
+            '--http-pool-size',
+            dest='http_pool_size',
+            type=int,
+            default=16,
+            help='maximum number of keep-alive connections to the Bot API',
+        )
+        telegram.add_argument(
+            '--global-rate-limit',
+            dest='global_rate_limit',
+            type=float,
+            default=30,
+            help='messages per second the bot may send across all chats',
+        )
+        telegram.add_argument(
+            '--chat-rate-limit',
+            dest='chat_rate_limit',
+            type=float,
+            default=1,
+            help='messages per second the bot may send to one private chat',
+        )
+        telegram.add_argument(
+            '--inference-batch-size',
+            dest='inference_batch_size',
+            type=int,
+            default=1,
+            help='maximum number of chats answered by one batched model call, '
+                 'e.g. 8, for models with batch_act. 1 (default) lets every '
+                 'chat call its model on its own',
+        )
+        telegram.add_argument(
+            '--inference-max-wait',
+            dest='inference_max_wait',
+            type=float,
+            default=0.01,
+            help='seconds a chat waits for other chats to join its model batch',
+        )
+        telegram.add_argument(
+            '--dedup-window',
+            dest='dedup_window',
+            type=int,
+            default=256,
+            help='number of recent message ids every agent remembers to drop '
+                 'duplicate messages',
+        )
+        telegram.add_argument(
+            '--update-window',
+            dest='update_window',
+            type=int,
+            default=1024,
+            help='number of update ids below the newest one that may still arrive '
+                 'out of order; older updates are dropped as duplicates',
+        )
+        telegram.add_argument(
+            '--update-state-path',
+            dest='update_state_path',
+            type=str,
+            default=None,
+            help='file storing the last handled update id across restarts, '
+                 'defaults to ~/.parlai/telegram_<task>_update_id',
+        )
+        telegram.add_argument(
+            '--session-store',
+            dest='session_store',
+            choices=['off', 'sqlite'],
+            default='off',
+            help='with sqlite, save the world every chat is in, its onboarding '
+                 'data and the state of the world (e.g. the dialogue history of '
+                 'the model), so the conversations go on after a restart',
+        )
+        telegram.add_argument(
+            '--session-store-path',
+            dest='session_store_path',
+            type=str,
+            default=None,
+            help='SQLite database of the saved conversations, defaults to '
+                 '~/.parlai/telegram_<task>_sessions.sqlite',
+        )
+        telegram.add_argument(
+            '--session-idle-ttl',
+            dest='session_idle_ttl',
+            type=float,
+            default=0,
+            help='with --session-store sqlite, seconds after which the '
+                 'conversation of a silent chat is evicted from memory, its model '
+                 'and history freed, and restored from the session store on the '
+                 'next message, e.g. 1800. 0 (default) keeps idle conversations '
+                 'in memory',
+        )
+        telegram.add_argument(
+            '--session-max-resident',
+            dest='session_max_resident',
+            type=int,
+            default=0,
+            help='memory budget as a number of conversations (not bytes) kept '
+                 'in memory at most, with --session-store sqlite; the least '
+                 'recently active ones beyond it are evicted like idle ones. '
+                 '0 (default) for no limit',
+        )
+        telegram.add_argument(
+            '--model-loading',
+            dest='model_loading',
+            choices=['eager', 'parallel', 'lazy'],
+            default='parallel',
+            help='load the models one by one before serving, in parallel in the '
+                 'background while the overworld is already served, or only '
+                 'when a world first needs them',
+        )
+        telegram.add_argument(
+            '--shards',
+            dest='shards',
+            type=int,
+            default=1,
+            help='number of worker processes running the conversations. Chats '
+                 'are spread over them by a consistent hash of the chat id; this '
+                 'process receives the updates and sends the messages of all '
+                 'workers',
+        )
+        telegram.add_argument(
+            '--ingress-workers',
+            dest='ingress_workers',
+            type=int,
+            default=4,
+            help='number of threads handing received updates to the manager, so '
+                 'a slow chat does not hold up receiving the others. Updates of '
+                 'one chat are always handled in order. Use 0 to handle them on '
+                 'the receiving thread',
+        )
+        telegram.add_argument(
+            '--ingress-queue-size',
+            dest='ingress_queue_size',
+            type=int,
+            default=10000,
+            help='maximum number of received updates waiting to be handled',
+        )
+        telegram.add_argument(
+            '--ingress-overflow',
+            dest='ingress_overflow',
+            choices=['block', 'drop-oldest', 'drop-newest'],
+            default='block',
+            help='what happens to an update arriving while the ingress queue is '
+                 'full: block the receiver until there is room, drop the oldest '
+                 'waiting update, or refuse the new one, which is delivered '
+                 'again later (the webhook receiver answers 503, the poller '
+                 'fetches it again and the relay replays it)',
+        )
+        telegram.add_argument(
+            '--metrics-port',
+            dest='metrics_port',
+            type=int,
+            default=None,
+            help='serve Prometheus metrics (latency of every stage an update goes '
+                 'through, Bot API calls, queue depths) on this port at /metrics. '
+                 'Shard workers use the following ports, one each',
+        )
+        telegram.add_argument(
+            '--metrics-host',
+            dest='metrics_host',
+            type=str,
+            default='127.0.0.1',
+            help='interface the metrics endpoint listens on',
+        )
+        telegram.add_argument(
+            '--profile',
+            dest='profile',
+            choices=['off', 'sample', 'cprofile'],
+            default='off',
+            help='profile world parleys, agent act/observe and model calls: '
+                 'sample takes --profile-hz stack samples per second of the '
+                 'threads inside them and writes flame graph stacks, cprofile '
+                 'runs --profile-fraction of them under cProfile',
+        )
+        telegram.add_argument(
+            '--profile-hz',
+            dest='profile_hz',
+            type=float,
+            default=10,
+            help='stack samples per second taken by --profile sample',
+        )
+        telegram.add_argument(
+            '--profile-fraction',
+            dest='profile_fraction',
+            type=float,
+            default=0.01,
+            help='share of the calls --profile cprofile profiles, 0-1',
+        )
+        telegram.add_argument(
+            '--profile-dir',
+            dest='profile_dir',
+            type=str,
+            default=None,
+            help='directory the profiles are written to, defaults to '
+                 '~/.parlai/telegram_profile',
+        )
+        telegram.add_argument(
+            '--profile-dump-interval',
+            dest='profile_dump_interval',
+            type=float,
+            default=60,
+            help='seconds between two writes of the profiles',
+        )
+        telegram.add_argument(
+            '--runtime',
+            dest='runtime',
+            choices=['threads', 'asyncio'],
+            default='threads',
+            help='how worlds run: one thread per conversation, or coroutines on '
+                 'an event loop taking a thread only while a world parleys, so '
+                 'max_workers limits concurrent turns instead of conversations',
+        )
+        telegram.add_argument(
+            '--act-wait',
+            dest='act_wait',
+            type=float,
+            default=5.0,
+            help='seconds a world may wait for a message in act(blocking=True) '
+                 'with --runtime threads, so idle conversations sleep instead of '
+                 'polling. The asyncio runtime wakes worlds on new messages',
+        )
         telegram.set_defaults(is_debug=False)
         telegram.set_defaults(verbose=False)
@@ -0,0 +1,84 @@
+"""
+Shard worker process.
+
+Runs a TelegramManager without its own ingest or Bot API connection: updates
+arrive from the main process through an inbox queue and Bot API calls go back
+through the outbox queue.
+"""
+import logging
+import threading
+
+import parlai.chat_service.utils.logging as log_utils
+
+from telegram.core.dedup import UpdateIdWindow
+from telegram.core.sharding import RemoteSender
+from telegram.telegram_manager import TelegramManager
+
+
+class ShardWorkerManager(TelegramManager):
+    """
+    TelegramManager of one shard, owning the conversations of its chats.
+    """
+
+    def __init__(self, opt, shard: int, inbox, outbox):
+        self.shard = shard
+        self.inbox = inbox
+        self.outbox = outbox
+        self.inbox_thread = None
+        super().__init__(opt)
+
+    def _init_update_filter(self):
+        # The main process already dropped redelivered updates
+        self.update_filter = UpdateIdWindow(size=self.opt['update_window'])
+
+    def setup_server(self):
+        pass
+
+    def setup_socket(self):
+        self.sender = RemoteSender(self.shard, self.outbox)
+        self._setup_ingress()
+        self.inbox_thread = threading.Thread(
+            target=self._run_inbox, name=f'Shard-{self.shard}-Inbox-Thread'
+        )
+        self.inbox_thread.daemon = True
+        self.inbox_thread.start()
+
+    def _setup_metrics(self, port: int = None):
+        # Every worker serves its own metrics on the ports after the main one
+        if port is None and self.opt.get('metrics_port') is not None:
+            port = self.opt['metrics_port'] + 1 + self.shard
+        super()._setup_metrics(port)
+
+    def _run_inbox(self):
+        while True:
+            message = self.inbox.get()
+            if message[0] == 'stop':
+                # Keep resolving Bot API results while conversations wind down
+                self.running = False
+                continue
+            if message[0] == 'result':
+                self.sender.resolve(*message[1:])
+                continue
+            try:
+                self._receive_update(message[1])
+            except Exception as e:
+                log_utils.print_and_log(
+                    logging.ERROR, f'Shard {self.shard} failed on update: {repr(e)}'
+                )
+
+    def start_task(self):
+        # The main process stops the worker through the inbox
+        if self.running:
+            super().start_task()
+
+
+def run_shard_worker(opt, shard: int, inbox, outbox):
+    """
+    Entry point of a shard worker process.
+    """
+    manager = ShardWorkerManager(opt, shard, inbox, outbox)
+    log_utils.print_and_log(logging.INFO, f'Shard {shard} ready', should_print=True)
+    try:
+        manager.start_task()
+    finally:
+        manager.shutdown()
@@ -3,19 +3,40 @@ Telegram Manager Module.
 
 Contains implementation of the TelegramManager, which helps run ParlAI via Telegram.
 """
+import copy
 import logging
 import os
+import threading
+import time
+from concurrent.futures import Future
 
 import parlai.chat_service.utils.logging as log_utils
+import parlai.chat_service.utils.misc as utils
 from parlai.chat_service.core.chat_service_manager import ChatServiceManager
-from parlai.core.agents import create_agent
 from parlai.utils.io import PathManager
 
-import telegram.core.server as server_utils
 from telegram.agents import TelegramAgent
-from telegram.core.socket import TelegramServiceMessageSocket
+from telegram.core.batching import InferenceScheduler
+from telegram.core.dedup import UpdateIdWindow
+from telegram.core.ingress import IngressQueue
+from telegram.core.metrics import INGEST_SECONDS, INGRESS, REGISTRY, SENDER, SESSIONS, set_stats
+from telegram.core.models import ModelRegistry
+from telegram.core.profiling import PROFILE_OFF, start_profiler, stop_profiler
+from telegram.core.sessions import SESSION_STORE_OFF, RestoredAgentState, SessionEvictor, SessionStore
+from telegram.core.streaming import StreamingReply
+from telegram.core.world_runner import AsyncWorldRunner, ThreadWorldRunner
 from telegram.message_sender import MessageSender
 
+INGEST_RELAY = 'relay'
+INGEST_GET_UPDATES = 'getUpdates'
+INGEST_WEBHOOK = 'webhook'
+RUNTIME_ASYNCIO = 'asyncio'
+MODEL_LOADING_EAGER = 'eager'
+MODEL_LOADING_LAZY = 'lazy'
+DEFAULT_ACT_WAIT = 5.0
+# Locks serializing the messages of a chat with the eviction of its conversation
+CHAT_LOCK_STRIPES = 64
+
 
 class TelegramManager(ChatServiceManager):
     """
@@ -32,19 +53,32 @@ class TelegramManager(ChatServiceManager):
         super().__init__(opt)
 
         self.server_task_name = None
+        self.models = None
+        self.shards = None
+        self.ingress = None
+        self.metrics_server = None
+        self.sessions = None
+        self.evictor = None
+        # Task ids of the worlds stopped by the evictor that did not end yet
+        self._evicted_tasks = set()
+        self._chat_locks = [threading.Lock() for _ in range(CHAT_LOCK_STRIPES)]
 
         self._init_logs()
 
         # Read in Config
         self._parse_config(opt)
+        self._init_update_filter()
         self._complete_setup()
 
     def _complete_setup(self):
+        self._setup_profiler()
+        self._setup_sessions()
         self.setup_server()
         self.init_new_state()
         self.setup_socket()
         self.start_new_run()
         self._load_model()
+        self._setup_metrics()
 
     def _confirm_message_delivery(self, event):
         print(f'Event {event}')
@@ -62,11 +96,83 @@ class TelegramManager(ChatServiceManager):
         log_utils.set_is_debug(self.opt['is_debug'])
         log_utils.set_log_level(self.opt['log_level'])
 
+    def _parse_config(self, opt):
+        """
+        Parse config for task.
+
+        Same as the base class, except that the world runner depends on --runtime.
+        """
+        self.debug = opt['is_debug']
+        self.config = opt['config']
+        self.overworld = self.config['overworld']
+        self.world_path = self.config['world_path']
+        self.world_module = utils.get_world_module(self.world_path)
+        self.task_configs = self.config['configs']
+        self.max_workers = self.config['max_workers']
+        self.opt['task'] = self.config['task_name']
+        # Deepcopy the opts so the manager opts aren't changed by the world runner
+        self.runner_opt = copy.deepcopy(opt)
+        if opt.get('runtime') == RUNTIME_ASYNCIO:
+            runner_class = AsyncWorldRunner
+            # The runner only parleys worlds with input, they need not wait for it
+            self.act_wait = 0.0
+        else:
+            runner_class = ThreadWorldRunner
+            self.act_wait = opt.get('act_wait', DEFAULT_ACT_WAIT)
+        self.world_runner = runner_class(
+            self.runner_opt, self.world_path, self.max_workers, self, opt['is_debug']
+        )
+        self.max_agents_for = {
+            task: cfg.agents_required for task, cfg in self.task_configs.items()
+        }
+        self.onboard_map = {
+            task: cfg.onboarding_name for task, cfg in self.task_configs.items()
+        }
+        self.taskworld_map = {
+            task: cfg.task_name for task, cfg in self.task_configs.items()
+        }
+        self.service_reference_id = None
+        self.parse_additional_args(opt)
+
+    def _init_update_filter(self):
+        """
+        Set up the update_id filter that drops redelivered updates.
+        """
+        state_path = self.opt.get('update_state_path')
+        if state_path is None:
+            parlai_dir = os.path.expanduser('~/.parlai/')
+            if not os.path.exists(parlai_dir):
+                PathManager.mkdirs(parlai_dir)
+            state_path = os.path.join(parlai_dir, f'telegram_{self.opt["task"]}_update_id')
+        self.update_filter = UpdateIdWindow(state_path, size=self.opt['update_window'])
+
     def _handle_bot_read(self, agent_id):
         self.sender.send_read(agent_id)
-        self.sender.typing_to(agent_id)
+        self.sender.typing_on(agent_id)
+
+    def _receive_update(self, event) -> bool:
+        """
+        Hand an update from the socket, poller or webhook receiver to the manager.
+
+        :return:
+            False if the ingress queue is full and refused the update
+        """
+        if self.ingress is None:
+            self._ingest_update(event)
+            return True
+        return self.ingress.put(event)
+
+    def _ingest_update(self, event):
+        with INGEST_SECONDS.time():
+            self._handle_webhook_event(event)
 
     def _handle_webhook_event(self, event):
+        if 'update_id' in event and self.update_filter.is_duplicate(event['update_id']):
+            self._log_debug(f'Update {event["update_id"]} was already handled, dropping it.')
+            return
+        if self.shards is not None:
+            self.shards.route(event)
+            return
         if 'message' in event:
             if 'photo' in event['message']:
                 event['message']['image'] = True
@@ -75,27 +181,273 @@ class TelegramManager(ChatServiceManager):
                     event['message']['image'] = True
             self._on_new_message(event)
 
+    def _chat_lock(self, agent_id) -> threading.Lock:
+        return self._chat_locks[hash(agent_id) % CHAT_LOCK_STRIPES]
+
+    def _on_new_message(self, message):
+        """
+        Put an incoming message onto the correct agent's message queue.
+
+        While conversations are evicted, the message is handled under the lock of
+        its chat, so it cannot be put into the agent of a world being dropped.
+        """
+        if self.evictor is None:
+            return super()._on_new_message(message)
+        with self._chat_lock(message['message']['from']['id']):
+            super()._on_new_message(message)
+
     def _load_model(self):
         """
         Load model if necessary.
+
+        Models load in parallel in the background (or on first use with
+        ``--model-loading lazy``) while the overworld is already served; worlds
+        needing a model wait for it. ``--model-loading eager`` blocks until all
+        of them are loaded.
         """
+        if self.shards is not None:
+            # Every shard worker loads its own copy
+            return
         if 'models' in self.opt and self.should_load_model:
-            model_params = {}
+            model_opts = {}
             model_info = {}
             for model in self.opt['models']:
                 model_opt = self.opt['models'][model]
                 override = model_opt.get('override', {})
                 if type(override) is list:
                     model_opt['overrides'] = override[0]
-                model_params[model] = create_agent(model_opt).share()
+                model_opts[model] = model_opt
                 model_info[model] = {'override': override}
+            schedulers = {}
+
+            def _on_load(model, shared):
+                if self.opt['inference_batch_size'] > 1:
+                    schedulers[model] = InferenceScheduler(
+                        shared,
+                        batch_size=self.opt['inference_batch_size'],
+                        max_wait=self.opt['inference_max_wait'],
+                        name=model,
+                    )
+
+            self.models = ModelRegistry(
+                model_opts,
+                lazy=self.opt['model_loading'] == MODEL_LOADING_LAZY,
+                on_load=_on_load,
+            )
             self.runner_opt['model_info'] = model_info
-            self.runner_opt['shared_bot_params'] = model_params
+            self.runner_opt['shared_bot_params'] = self.models
+            self.runner_opt['inference_schedulers'] = schedulers
+            if self.opt['model_loading'] == MODEL_LOADING_EAGER:
+                self.models.wait()
 
     def _on_first_message(self, message):
         agent_id = message['sender']['id']
+        if self._restore_session(agent_id):
+            # The message belongs to the world the chat is going back to
+            self.get_agent_state(agent_id).get_active_agent().put_data(message)
+            return
         self._launch_overworld(agent_id)
 
+    def _setup_sessions(self):
+        """
+        Open the store the conversations are saved in, unless --session-store is off.
+        """
+        if self.opt.get('session_store', SESSION_STORE_OFF) == SESSION_STORE_OFF:
+            if self.opt.get('session_idle_ttl') or self.opt.get('session_max_resident'):
+                log_utils.print_and_log(
+                    logging.WARN,
+                    'Idle conversations are only evicted with --session-store sqlite',
+                    should_print=True,
+                )
+            return
+        if self.opt['shards'] > 1:
+            # The conversations run in the shard workers, which open the store
+            return
+        path = self.opt.get('session_store_path')
+        if path is None:
+            parlai_dir = os.path.expanduser('~/.parlai/')
+            if not os.path.exists(parlai_dir):
+                PathManager.mkdirs(parlai_dir)
+            path = os.path.join(parlai_dir, f'telegram_{self.opt["task"]}_sessions.sqlite')
+        self.sessions = SessionStore(path)
+        idle_ttl = self.opt.get('session_idle_ttl', 0)
+        max_resident = self.opt.get('session_max_resident', 0)
+        if idle_ttl > 0 or max_resident > 0:
+            self.evictor = SessionEvictor(self, idle_ttl, max_resident)
+
+    def _restore_session(self, agent_id) -> bool:
+        """
+        Put a chat unknown since the start back into the world it was in,
+        skipping the overworld and onboarding.
+
+        :return:
+            whether the chat had a session to restore
+        """
+        if self.sessions is None:
+            return False
+        session = self.sessions.load(agent_id)
+        if session is None:
+            return False
+        world_type = session['world_type']
+        if world_type not in self.task_configs or self.max_agents_for[world_type] != 1:
+            # The task changed since, start over
+            self.sessions.delete(agent_id)
+            return False
+        task_id = f'overworld-{agent_id}-{time.time()}'
+        agent_state = RestoredAgentState(agent_id, self._create_agent(task_id, agent_id), session)
+        self.messenger_agent_states[agent_id] = agent_state
+        # No overworld runs until the chat leaves its world
+        overworld_future = Future()
+        overworld_future.set_result(None)
+        self.agent_id_to_overworld_future[agent_id] = overworld_future
+        self._log_debug(f'Restoring the {world_type} conversation of {agent_id}.')
+        self.add_agent_to_pool(agent_state, world_type)
+        return True
+
+    def add_agent_to_pool(self, agent, world_type='default'):
+        """
+        Add the agent to pool, saving the world the chat goes to.
+
+        Only chats going to worlds of a single user are saved, the partners of
+        the others would be gone after a restart.
+        """
+        super().add_agent_to_pool(agent, world_type)
+        if self.sessions is not None and self.max_agents_for.get(world_type) == 1:
+            self.sessions.save(
+                agent.service_id,
+                world_type=world_type,
+                onboard_data=agent.onboard_data,
+                data=agent.data,
+                world_state=getattr(agent, 'world_state', None),
+            )
+
+    def after_agent_removed(self, agent_id):
+        """
+        Forget the saved session of a chat that left its world.
+        """
+        # Worlds stopped by a shutdown are resumed on the next start
+        if self.sessions is not None and self.running:
+            self.sessions.delete(agent_id)
+
+    def restore_world_state(self, world, agents):
+        """
+        Restore a new task world from the state saved before a restart.
+        """
+        if len(agents) != 1 or agents[0].world_state is None:
+            return
+        if hasattr(world, 'set_state'):
+            world.set_state(agents[0].world_state)
+
+    def snapshot_world_state(self, world, agents):
+        """
+        Save the state of a task world if it changed, called after every parley.
+        """
+        if self.sessions is None or len(agents) != 1 or not hasattr(world, 'get_state'):
+            return
+        agent = agents[0]
+        state = world.get_state()
+        if state != agent.world_state:
+            agent.world_state = state
+            self.sessions.save(agent.id, world_state=state)
+
+    def resident_sessions(self) -> list:
+        """
+        Running conversations the evictor may drop, as (task id, agent) pairs.
+
+        Only worlds of one user that can snapshot their state are resumed as
+        they were, the others stay in memory until they end.
+        """
+        resident = []
+        for task_id, future in list(self.active_worlds.items()):
+            if future is None or future.done() or task_id in self._evicted_tasks:
+                continue
+            task = self.world_runner.tasks.get(task_id)
+            if task is None or len(task.agents) != 1 or not hasattr(task.world, 'get_state'):
+                continue
+            resident.append((task_id, task.agents[0]))
+        return resident
+
+    def evict_session(self, task_id, agent) -> bool:
+        """
+        Stop the world of task_id, keeping the saved session of its chat.
+
+        The chat is forgotten once the world ended, and is restored from its
+        session on its next message.
+
+        :return:
+            False if the agent has messages to act on or the chat has no session
+        """
+        if agent.msg_queue.qsize() > 0 or self.sessions.load(agent.id) is None:
+            return False
+        self._evicted_tasks.add(task_id)
+        self.world_runner.stop_world(task_id)
+        return True
+
+    def _forget_evicted(self, task_id, agents):
+        """
+        Drop the chats of an evicted world, restoring right away those that
+        spoke while it was ending.
+        """
+        self.active_worlds[task_id] = None
+        for agent in agents:
+            with self._chat_lock(agent.id):
+                agent_state = self.messenger_agent_states.get(agent.id)
+                if agent_state is None or agent_state.get_active_agent() is not agent:
+                    continue
+                del self.messenger_agent_states[agent.id]
+                self.agent_id_to_overworld_future.pop(agent.id, None)
+                if agent.msg_queue.qsize() > 0 and self._restore_session(agent.id):
+                    agent.hand_over_messages(self.get_agent_state(agent.id).get_active_agent())
+            self._log_debug(f'Evicted the conversation of {agent.id}.')
+
+    def prune_finished_worlds(self):
+        """
+        Drop the bookkeeping of ended worlds, which would otherwise keep every
+        finished world, its agents and model alive.
+        """
+        for task_id, future in list(self.active_worlds.items()):
+            if future is None:
+                # The done callback ran, so an eviction it did not see is stale
+                self._evicted_tasks.discard(task_id)
+            if future is None or future.done():
+                self.active_worlds.pop(task_id, None)
+        for task_name, task in list(self.world_runner.tasks.items()):
+            if task.future is not None and task.future.done():
+                self.world_runner.tasks.pop(task_name, None)
+
+    def _get_done_callback_for_agents(self, task_id, world_type, agents):
+        """
+        Create done callback for finishing task world with particular agents.
+
+        The chats of a world that ended because it was evicted are forgotten
+        instead of being sent back to the overworld.
+        """
+        done_callback = super()._get_done_callback_for_agents(task_id, world_type, agents)
+
+        def _done_callback(fut):
+            if task_id not in self._evicted_tasks:
+                return done_callback(fut)
+            self._evicted_tasks.discard(task_id)
+            if fut.exception() is not None:
+                return done_callback(fut)
+            self._forget_evicted(task_id, agents)
+
+        return _done_callback
+
+    def _expire_all_conversations(self):
+        """
+        Shut down all sub-worlds.
+
+        Conversations in a saved world go on after the restart, so there is no
+        need to warn the users and wait for them to finish.
+        """
+        if self.sessions is None:
+            return super()._expire_all_conversations()
+        self.running = False
+        for overworld_fut in self.agent_id_to_overworld_future.values():
+            overworld_fut.cancel()
+        self.shutting_down = True
+
     def get_app_token(self):
         """
         Find and return an app access token.
@@ -140,7 +492,7 @@ class TelegramManager(ChatServiceManager):
         """
         Prepare the Telegram server for handling messages.
         """
-        if self.bypass_server_setup:
+        if self.bypass_server_setup or self.opt['ingest'] != INGEST_RELAY:
             return
 
         log_utils.print_and_log(
@@ -151,18 +503,25 @@ class TelegramManager(ChatServiceManager):
             'feature.\n',
             should_print=True,
         )
-        input('Please press Enter to continue... ')
 
         log_utils.print_and_log(
             logging.INFO, 'Setting up Telegram webhook...', should_print=True
         )
 
+        import telegram.core.server as server_utils
+
         # Setup the server with a task name related to the current task
         task_name = f'ParlAI-Telegram-{self.opt["task"]}'
         self.server_task_name = ''.join(
             ch for ch in task_name.lower() if ch.isalnum() or ch == '-'
         )
-        self.server_url = server_utils.setup_server(self.server_task_name, self.opt['local'])
+        self.server_url = server_utils.setup_server(
+            self.server_task_name,
+            self.opt['local'],
+            server_url=self.opt.get('server_url'),
+            port=self.opt.get('server_port', server_utils.DEFAULT_LOCAL_PORT),
+            ready_timeout=self.opt.get('server_ready_timeout', server_utils.DEFAULT_READY_TIMEOUT),
+        )
         log_utils.print_and_log(
             logging.INFO,
             f'Webhook address: {self.server_url}/webhook',
@@ -176,39 +535,222 @@ class TelegramManager(ChatServiceManager):
         if self.bypass_server_setup:
             return
 
+        self._setup_sender()
+        if self.opt['shards'] > 1:
+            self._setup_shards()
+        self._setup_ingress()
+        if self.opt['ingest'] == INGEST_GET_UPDATES:
+            self._setup_update_poller()
+            return
+        if self.opt['ingest'] == INGEST_WEBHOOK:
+            self._setup_webhook_receiver()
+            return
+
         log_utils.print_and_log(
             logging.INFO, 'Local: Setting up WebSocket...', should_print=True
         )
-
-        self.app_token = self.get_app_token()
-        self.sender = MessageSender(self.app_token)
         self.sender.set_webhook(f'{self.server_url}/webhook')
 
+        # Each receiver is imported where it is set up, so a bot only loads
+        # the one it runs with
+        from telegram.core.socket import TelegramServiceMessageSocket
+
         # Set up receive
         socket_use_url = self.server_url
         if self.opt['local']:
             socket_use_url = 'https://localhost'
         self.socket = TelegramServiceMessageSocket(
-            socket_use_url, self.port, self._handle_webhook_event
+            socket_use_url, self.port, self._receive_update
         )
         log_utils.print_and_log(logging.INFO, 'Done with websocket', should_print=True)
 
+    def _setup_sender(self):
+        """
+        Create the MessageSender used for every Bot API call.
+        """
+        self.app_token = self.get_app_token()
+        self.sender = MessageSender(
+            self.app_token,
+            pool_size=self.opt['http_pool_size'],
+            send_workers=self.opt['send_workers'],
+            global_rate=self.opt['global_rate_limit'],
+            chat_rate=self.opt['chat_rate_limit'],
+            api_base=self.opt['telegram_api_url'],
+        )
+
+    def _setup_ingress(self):
+        """
+        Create the queue that moves handling of updates off the receiving thread.
+        """
+        if self.opt['ingress_workers'] <= 0:
+            return
+        self.ingress = IngressQueue(
+            self._ingest_update,
+            workers=self.opt['ingress_workers'],
+            maxsize=self.opt['ingress_queue_size'],
+            overflow=self.opt['ingress_overflow'],
+        )
+
+    def _setup_profiler(self):
+        """
+        Start profiling world parleys, agent and model calls if --profile is set.
+        """
+        mode = self.opt.get('profile', PROFILE_OFF)
+        if mode == PROFILE_OFF:
+            return
+        directory = self.opt.get('profile_dir') or os.path.expanduser('~/.parlai/telegram_profile')
+        start_profiler(
+            mode,
+            directory,
+            hz=self.opt['profile_hz'],
+            fraction=self.opt['profile_fraction'],
+            dump_interval=self.opt['profile_dump_interval'],
+        )
+
+    def _setup_metrics(self, port: int = None):
+        """
+        Serve the metrics for Prometheus if --metrics-port is set.
+
+        :param port:
+            port to serve on instead of --metrics-port
+        """
+        if port is None:
+            port = self.opt.get('metrics_port')
+        if port is None:
+            return
+        from telegram.core.metrics import MetricsServer
+
+        REGISTRY.add_collector(self._collect_metrics)
+        self.metrics_server = MetricsServer(self.opt['metrics_host'], port)
+        log_utils.print_and_log(
+            logging.INFO,
+            f'Metrics: http://{self.opt["metrics_host"]}:{self.metrics_server.port}/metrics',
+            should_print=True,
+        )
+
+    def _collect_metrics(self):
+        if self.ingress is not None:
+            set_stats(INGRESS, self.ingress.stats())
+        if self.sender is not None:
+            set_stats(SENDER, self.sender.stats())
+        if self.sessions is not None:
+            set_stats(SESSIONS, self.sessions.stats())
+        if self.evictor is not None:
+            set_stats(SESSIONS, self.evictor.stats())
+
+    def _setup_shards(self):
+        """
+        Start the worker processes the conversations are spread over.
+        """
+        from telegram.core.sharding import ShardPool
+        # The worker module builds on this one
+        from telegram.shard_worker import run_shard_worker
+
+        log_utils.print_and_log(
+            logging.INFO,
+            f'Starting {self.opt["shards"]} shard workers...',
+            should_print=True,
+        )
+        worker_opt = copy.deepcopy(self.opt)
+        worker_opt['shards'] = 1
+        self.shards = ShardPool(run_shard_worker, worker_opt, self.opt['shards'], self.sender)
+
+    def start_task(self):
+        """
+        Begin handling task.
+
+        With shard workers the conversations run in the workers, so this only
+        waits until the manager is shut down or every worker has died.
+        """
+        if self.shards is None:
+            return super().start_task()
+        self.running = True
+        while self.running and self.shards.alive():
+            time.sleep(1)
+        if self.running:
+            log_utils.print_and_log(
+                logging.ERROR, 'All shard workers died, stopping', should_print=True
+            )
+
+    def _setup_update_poller(self):
+        """
+        Receive updates by long-polling getUpdates instead of the webhook relay.
+        """
+        log_utils.print_and_log(
+            logging.INFO, 'Local: Polling updates from Telegram...', should_print=True
+        )
+        from telegram.core.poller import TelegramUpdatePoller
+
+        # getUpdates is refused while a webhook is set
+        self.sender.delete_webhook()
+        self.socket = TelegramUpdatePoller(
+            self.sender,
+            self._receive_update,
+            limit=self.opt['poll_limit'],
+            timeout=self.opt['poll_timeout'],
+        )
+
+    def _setup_webhook_receiver(self):
+        """
+        Receive webhook updates in this process instead of through the relay.
+        """
+        import secrets
+
+        from telegram.core.webhook import TelegramWebhookReceiver
+
+        secret_token = secrets.token_urlsafe(32)
+        self.socket = TelegramWebhookReceiver(
+            self.opt['webhook_host'],
+            self.opt['webhook_port'],
+            self._receive_update,
+            secret_token=secret_token if self.opt['webhook_url'] else None,
+        )
+        if self.opt['webhook_url']:
+            webhook_url = self.opt['webhook_url'].rstrip('/') + self.socket.path
+            self.sender.set_webhook(webhook_url, secret_token=secret_token)
+            log_utils.print_and_log(
+                logging.INFO, f'Webhook address: {webhook_url}', should_print=True
+            )
+
     def shutdown(self):
         """
         Handle any client shutdown cleanup.
         """
         try:
             self.running = False
+            if self.evictor is not None:
+                self.evictor.shutdown()
             self.world_runner.shutdown()
-            if not self.bypass_server_setup:
+            if self.models is not None:
+                self.models.shutdown()
+            for scheduler in self.runner_opt.get('inference_schedulers', {}).values():
+                scheduler.shutdown()
+            if self.socket is not None:
                 self.socket.keep_running = False
+            if self.ingress is not None:
+                self.ingress.shutdown()
+            if self.shards is not None:
+                self.shards.shutdown()
             self._expire_all_conversations()
+            if self.sessions is not None:
+                self.sessions.shutdown()
+            if self.sender is not None:
+                self.sender.shutdown()
+            if self.metrics_server is not None:
+                REGISTRY.remove_collector(self._collect_metrics)
+                self.metrics_server.shutdown()
+            stop_profiler()
+            self.update_filter.save()
         except BaseException as e:
             log_utils.print_and_log(logging.ERROR, f'world ended in error: {e}')
 
         finally:
-            if not self.bypass_server_setup:
-                server_utils.delete_server(self.server_task_name, self.opt['local'])
+            if self.server_task_name is not None:
+                import telegram.core.server as server_utils
+
+                server_utils.delete_server(
+                    self.server_task_name, self.opt['local'], keep=self.opt.get('keep_server', False)
+                )
 
     # Agent Interaction Functions #
 
@@ -225,4 +767,36 @@ class TelegramManager(ChatServiceManager):
         :param persona_id:
             identifier of persona
         """
-        return self.sender.send_message(receiver_id, text)
+        return self.observe_message_async(receiver_id, text, quick_replies, persona_id).result()
+
+    def observe_message_async(
+        self, receiver_id: int, text: str, quick_replies=None, persona_id: str = None
+    ) -> Future:
+        """
+        Queue a message through the message manager without blocking the caller.
+
+        Messages to the same receiver are delivered in the order they were queued.
+
+        :param receiver_id:
+            identifier for agent to send message to
+        :param text:
+            text to send
+        :param quick_replies:
+            list of quick replies
+        :param persona_id:
+            identifier of persona
+        :return:
+            Future resolved with the sent Message object
+        """
+        return self.sender.send_message_async(receiver_id, text)
+
+    def observe_message_stream(self, receiver_id: int) -> StreamingReply:
+        """
+        Start a reply that is shown while it is being generated.
+
+        :param receiver_id:
+            identifier for agent to send message to
+        :return:
+            StreamingReply to feed the text into and finish
+        """
+        return StreamingReply(self.sender, receiver_id)
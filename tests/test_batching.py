@@ -0,0 +1,132 @@
+import threading
+
+import pytest
+
+from telegram.core.batching import InferenceScheduler
+
+
+class _UnbatchedModel:
+    """
+    Stub model replying with the observed text in upper case.
+    """
+
+    def __init__(self, opt, shared=None):
+        self.opt = opt
+        self.batches = shared['batches']
+        self.observation = None
+
+    def observe(self, observation):
+        self.observation = {**observation, 'copy': id(self)}
+        return self.observation
+
+    def act(self):
+        return {'text': self.observation['text'].upper()}
+
+
+class _UpperModel(_UnbatchedModel):
+    def __init__(self, opt, shared=None):
+        super().__init__(opt, shared)
+        self.history = []
+
+    def self_observe(self, reply):
+        self.history.append(reply)
+
+    def batch_act(self, observations):
+        self.batches.append(observations)
+        return [
+            {'text': observation['text'].upper(), 'copy': observation['copy']}
+            for observation in observations
+        ]
+
+
+class _FailingModel(_UpperModel):
+    def batch_act(self, observations):
+        self.batches.append(observations)
+        raise ValueError('out of memory')
+
+
+def _shared(model_class):
+    return {'class': model_class, 'opt': {}, 'batches': []}
+
+
+def _act_concurrently(scheduler, shared, count):
+    """
+    Let count world copies of the model act at once.
+
+    :return:
+        the copies and, per copy, its reply or the exception it raised
+    """
+    copies = [shared['class'](shared['opt'], shared) for _ in range(count)]
+    results = [None] * count
+
+    def _act(index):
+        try:
+            results[index] = scheduler.act(copies[index], {'text': f'chat {index}'})
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=_act, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+        assert not thread.is_alive()
+    return copies, results
+
+
+def test_concurrent_turns_run_as_one_batch():
+    shared = _shared(_UpperModel)
+    scheduler = InferenceScheduler(shared, batch_size=8, max_wait=0.5)
+    try:
+        copies, results = _act_concurrently(scheduler, shared, 4)
+    finally:
+        scheduler.shutdown()
+    assert [len(batch) for batch in shared['batches']] == [4]
+    for index, (copy, reply) in enumerate(zip(copies, results)):
+        assert reply['text'] == f'CHAT {index}'
+        # Each reply goes back to the copy that observed the message
+        assert copy.history == [reply]
+        assert reply['copy'] == id(copy)
+
+
+def test_batches_hold_at_most_batch_size_turns():
+    shared = _shared(_UpperModel)
+    scheduler = InferenceScheduler(shared, batch_size=2, max_wait=0.5)
+    try:
+        _, results = _act_concurrently(scheduler, shared, 5)
+    finally:
+        scheduler.shutdown()
+    assert all(len(batch) <= 2 for batch in shared['batches'])
+    assert sorted(reply['text'] for reply in results) == [f'CHAT {index}' for index in range(5)]
+
+
+def test_model_without_batch_act_answers_one_at_a_time():
+    shared = _shared(_UnbatchedModel)
+    scheduler = InferenceScheduler(shared)
+    try:
+        assert not scheduler.supports_batching
+        copy = _UnbatchedModel({}, shared)
+        assert scheduler.act(copy, {'text': 'hi'}) == {'text': 'HI'}
+    finally:
+        scheduler.shutdown()
+    assert shared['batches'] == []
+
+
+def test_failed_batch_fails_every_waiting_turn():
+    shared = _shared(_FailingModel)
+    scheduler = InferenceScheduler(shared, batch_size=8, max_wait=0.5)
+    try:
+        copies, results = _act_concurrently(scheduler, shared, 3)
+    finally:
+        scheduler.shutdown()
+    assert all(isinstance(result, ValueError) for result in results)
+    assert all(copy.history == [] for copy in copies)
+
+
+def test_act_after_shutdown_is_refused():
+    shared = _shared(_UpperModel)
+    scheduler = InferenceScheduler(shared)
+    scheduler.shutdown()
+    scheduler.batch_thread.join(5)
+    with pytest.raises(RuntimeError):
+        scheduler.act(_UpperModel({}, shared), {'text': 'hi'})
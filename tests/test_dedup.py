@@ -0,0 +1,70 @@
+import os
+import time
+
+from telegram.core.dedup import UpdateIdWindow
+
+
+def test_duplicates_and_late_updates_in_window():
+    window = UpdateIdWindow(size=8)
+    assert not window.is_duplicate(100)
+    assert not window.is_duplicate(103)
+    assert window.is_duplicate(103)
+    # Late but inside the window, accepted once
+    assert not window.is_duplicate(101)
+    assert window.is_duplicate(101)
+    assert window.is_duplicate(100)
+    # Too old to tell, so dropped
+    assert window.is_duplicate(103 - 8)
+
+
+def test_window_slides_past_its_size():
+    window = UpdateIdWindow(size=8)
+    assert not window.is_duplicate(1)
+    assert not window.is_duplicate(50)
+    assert not window.is_duplicate(45)
+    assert window.is_duplicate(1)
+
+
+def test_reload_drops_updates_handled_before_restart(tmp_path):
+    path = str(tmp_path / 'update_id')
+    window = UpdateIdWindow(path, size=8, persist_every=16)
+    for update_id in range(10, 15):
+        assert not window.is_duplicate(update_id)
+    window.save()
+
+    reloaded = UpdateIdWindow(path, size=8)
+    assert reloaded.high_water == 14
+    for update_id in range(10, 15):
+        assert reloaded.is_duplicate(update_id)
+    assert not reloaded.is_duplicate(15)
+
+
+def test_persists_every_few_updates(tmp_path):
+    path = str(tmp_path / 'update_id')
+    window = UpdateIdWindow(path, persist_every=2)
+    window.is_duplicate(1)
+    assert not os.path.exists(path)
+    window.is_duplicate(2)
+    with open(path) as state_file:
+        assert state_file.read() == '2'
+
+
+def test_ids_restart_after_a_week_without_updates():
+    window = UpdateIdWindow(size=8)
+    assert not window.is_duplicate(1000)
+    window.last_update_time -= UpdateIdWindow.MAX_IDLE_SECONDS + 1
+    # Telegram picked a new, lower id
+    assert not window.is_duplicate(5)
+    assert window.high_water == 5
+    assert window.is_duplicate(5)
+
+
+def test_stale_state_file_is_ignored(tmp_path):
+    path = str(tmp_path / 'update_id')
+    with open(path, 'w') as state_file:
+        state_file.write('1000')
+    stale = time.time() - UpdateIdWindow.MAX_IDLE_SECONDS - 60
+    os.utime(path, (stale, stale))
+    window = UpdateIdWindow(path)
+    assert window.high_water is None
+    assert not window.is_duplicate(5)
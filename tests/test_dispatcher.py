@@ -0,0 +1,70 @@
+import random
+import threading
+import time
+
+from telegram.core.dispatcher import ChatDispatcher, RetryLater
+
+
+def test_jobs_of_one_chat_run_in_submission_order():
+    dispatcher = ChatDispatcher(4, name='Test')
+    seen = {chat_id: [] for chat_id in range(3)}
+
+    def job(chat_id, index):
+        time.sleep(random.random() / 200)
+        seen[chat_id].append(index)
+
+    try:
+        futures = [
+            dispatcher.submit(index % 3, job, index % 3, index) for index in range(60)
+        ]
+        for future in futures:
+            future.result(timeout=10)
+    finally:
+        dispatcher.shutdown()
+    for chat_id, indexes in seen.items():
+        assert indexes == sorted(indexes)
+        assert len(indexes) == 20
+
+
+def test_retry_later_runs_job_again_before_later_jobs_of_the_chat():
+    dispatcher = ChatDispatcher(2, name='Test')
+    order = []
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RetryLater(0.2)
+        order.append('flaky')
+        return 'sent'
+
+    try:
+        first = dispatcher.submit(1, flaky)
+        second = dispatcher.submit(1, order.append, 'second')
+        other = dispatcher.submit(2, order.append, 'other')
+        assert first.result(timeout=5) == 'sent'
+        second.result(timeout=5)
+        other.result(timeout=5)
+    finally:
+        dispatcher.shutdown()
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.2
+    # The parked chat holds no worker, so the other chat went first
+    assert order == ['other', 'flaky', 'second']
+
+
+def test_failed_job_does_not_block_the_chat():
+    dispatcher = ChatDispatcher(1, name='Test')
+    done = threading.Event()
+
+    def fail():
+        raise ValueError('boom')
+
+    try:
+        failed = dispatcher.submit(1, fail)
+        after = dispatcher.submit(1, done.set)
+        after.result(timeout=5)
+    finally:
+        dispatcher.shutdown()
+    assert isinstance(failed.exception(), ValueError)
+    assert done.is_set()
@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from telegram.core.ingress import (
+    OVERFLOW_BLOCK,
+    OVERFLOW_DROP_NEWEST,
+    OVERFLOW_DROP_OLDEST,
+    IngressQueue,
+)
+
+
+def _update(update_id):
+    return {'update_id': update_id, 'message': {'chat': {'id': update_id}}}
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class _Handler:
+    """
+    Records the updates handled, holding the first one until released.
+    """
+
+    def __init__(self):
+        self.handled = []
+        self.release = threading.Event()
+
+    def __call__(self, update):
+        if not self.handled:
+            self.release.wait(5)
+        self.handled.append(update['update_id'])
+
+
+def _full_queue(overflow):
+    """
+    Queue of size 2 with its only worker busy and two updates waiting.
+    """
+    handler = _Handler()
+    queue = IngressQueue(handler, workers=1, maxsize=2, overflow=overflow)
+    assert queue.put(_update(1))
+    _wait_for(lambda: queue.depth() == 0)
+    assert queue.put(_update(2))
+    assert queue.put(_update(3))
+    return queue, handler
+
+
+def test_drop_newest_refuses_incoming_update():
+    queue, handler = _full_queue(OVERFLOW_DROP_NEWEST)
+    assert not queue.put(_update(4))
+    handler.release.set()
+    queue.shutdown()
+    assert handler.handled == [1, 2, 3]
+    assert queue.stats()['dropped'] == 1
+
+
+def test_drop_oldest_replaces_oldest_waiting_update():
+    queue, handler = _full_queue(OVERFLOW_DROP_OLDEST)
+    assert queue.put(_update(4))
+    handler.release.set()
+    queue.shutdown()
+    assert handler.handled == [1, 3, 4]
+    assert queue.stats()['dropped'] == 1
+
+
+def test_block_waits_for_room():
+    queue, handler = _full_queue(OVERFLOW_BLOCK)
+    accepted = []
+    receiver = threading.Thread(target=lambda: accepted.append(queue.put(_update(4))))
+    receiver.start()
+    receiver.join(0.2)
+    assert receiver.is_alive()
+    handler.release.set()
+    receiver.join(5)
+    queue.shutdown()
+    assert accepted == [True]
+    assert sorted(handler.handled) == [1, 2, 3, 4]
+    stats = queue.stats()
+    assert stats['dropped'] == 0
+    assert stats['max_depth'] == 2
+
+
+def test_failed_update_is_counted():
+    def handler(update):
+        raise ValueError('boom')
+
+    queue = IngressQueue(handler, workers=1)
+    queue.put(_update(1))
+    queue.shutdown()
+    stats = queue.stats()
+    assert stats['handled'] == 1
+    assert stats['failed'] == 1
+
+
+def test_unknown_overflow_policy():
+    with pytest.raises(ValueError):
+        IngressQueue(print, overflow='drop-all')
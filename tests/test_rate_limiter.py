@@ -0,0 +1,53 @@
+import pytest
+
+from telegram.core.rate_limiter import RateGovernor, TokenBucket
+
+
+def test_token_bucket_paces_after_burst():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.updated
+    for _ in range(3):
+        assert bucket.wait_time(now) == 0.0
+        bucket.consume()
+    assert bucket.wait_time(now) == pytest.approx(0.5)
+    assert bucket.wait_time(now + 0.25) == pytest.approx(0.25)
+    assert bucket.wait_time(now + 0.5) == 0.0
+
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(rate=10, capacity=3)
+    now = bucket.updated
+    bucket.consume()
+    assert not bucket.is_full(now)
+    assert bucket.is_full(now + 60)
+    assert bucket.tokens == 3
+
+
+def test_governor_limits_each_chat_after_its_burst():
+    governor = RateGovernor(global_rate=100, private_rate=1, group_rate=0.5, chat_burst=2)
+    for chat_id in (1, -1):
+        assert governor.acquire(chat_id) == 0.0
+        assert governor.acquire(chat_id) == 0.0
+    assert governor.acquire(1) == pytest.approx(1.0, abs=0.05)
+    # Group chats get the stricter limit
+    assert governor.acquire(-1) == pytest.approx(2.0, abs=0.05)
+    # Other chats are not held up
+    assert governor.acquire(2) == 0.0
+    assert governor.stats()['throttled'] == 2
+
+
+def test_governor_global_limit_applies_across_chats():
+    governor = RateGovernor(global_rate=3, private_rate=1, chat_burst=1)
+    for chat_id in range(3):
+        assert governor.acquire(chat_id) == 0.0
+    assert governor.acquire(3) == pytest.approx(1 / 3, abs=0.05)
+
+
+def test_governor_blocks_chat_for_retry_after():
+    governor = RateGovernor()
+    governor.retry_after(1, 5)
+    assert governor.acquire(1) == pytest.approx(5, abs=0.05)
+    assert governor.acquire(2) == 0.0
+    stats = governor.stats()
+    assert stats['flood_waits'] == 1
+    assert stats['flood_blocked_chats'] == 1
@@ -0,0 +1,75 @@
+from telegram.core.sessions import SessionStore
+
+
+def _store(tmp_path):
+    # Flushes only when asked to, so the tests see both sides of a flush
+    return SessionStore(str(tmp_path / 'sessions.db'), flush_interval=60)
+
+
+def test_session_survives_reopening_the_store(tmp_path):
+    store = _store(tmp_path)
+    world_state = {'turns': [['hi', 'hello']], 'episode': 3}
+    assert store.save(1, world_type='default', onboard_data={'name': 'Ann'})
+    assert store.save(1, data={'lang': 'en'}, world_state=world_state)
+    store.shutdown()
+
+    reopened = _store(tmp_path)
+    try:
+        assert reopened.load(1) == {
+            'world_type': 'default',
+            'onboard_data': {'name': 'Ann'},
+            'data': {'lang': 'en'},
+            'world_state': world_state,
+        }
+        assert reopened.load(2) is None
+    finally:
+        reopened.shutdown()
+
+
+def test_load_merges_pending_changes_with_written_ones(tmp_path):
+    store = _store(tmp_path)
+    try:
+        store.save(1, world_type='default', data={'lang': 'en'})
+        assert store.load(1)['world_type'] == 'default'
+        store.flush()
+        store.save(1, data={'lang': 'de'})
+        session = store.load(1)
+        assert session['world_type'] == 'default'
+        assert session['data'] == {'lang': 'de'}
+        assert store.stats()['pending'] == 1
+    finally:
+        store.shutdown()
+
+
+def test_deleted_session_is_gone_after_restart(tmp_path):
+    store = _store(tmp_path)
+    store.save(1, world_type='default', data={'lang': 'en'})
+    store.flush()
+    store.delete(1)
+    assert store.load(1) is None
+    # Saved again after the delete, the old fields stay cleared
+    store.save(1, world_type='other')
+    store.save(2, world_type='default')
+    store.delete(2)
+    store.shutdown()
+
+    reopened = _store(tmp_path)
+    try:
+        assert reopened.load(1) == {
+            'world_type': 'other',
+            'onboard_data': None,
+            'data': None,
+            'world_state': None,
+        }
+        assert reopened.load(2) is None
+    finally:
+        reopened.shutdown()
+
+
+def test_unencodable_fields_are_not_saved(tmp_path):
+    store = _store(tmp_path)
+    try:
+        assert not store.save(1, world_type='default', data={'agent': object()})
+        assert store.load(1) is None
+    finally:
+        store.shutdown()
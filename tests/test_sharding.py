@@ -0,0 +1,33 @@
+from telegram.core.sharding import HashRing, chat_id_of
+
+
+def test_ring_is_stable_across_instances():
+    keys = range(-500, 500)
+    first, second = HashRing(range(4)), HashRing(range(4))
+    assert [first.node_for(key) for key in keys] == [second.node_for(key) for key in keys]
+
+
+def test_adding_a_node_only_moves_keys_to_it():
+    keys = range(-5000, 5000)
+    before = HashRing(range(4))
+    after = HashRing(range(5))
+    moved = [key for key in keys if before.node_for(key) != after.node_for(key)]
+    assert all(after.node_for(key) == 4 for key in moved)
+    # About a fifth of the chats change shard, not most of them
+    assert 0.1 < len(moved) / len(keys) < 0.3
+
+
+def test_ring_spreads_keys_over_all_nodes():
+    ring = HashRing(range(4))
+    counts = [0] * 4
+    for key in range(10000):
+        counts[ring.node_for(key)] += 1
+    assert min(counts) > 10000 / 4 * 0.7
+
+
+def test_chat_id_of_updates():
+    assert chat_id_of({'update_id': 1, 'message': {'chat': {'id': 7}}}) == 7
+    callback = {'from': {'id': 8}, 'message': {'chat': {'id': -9}}}
+    assert chat_id_of({'update_id': 1, 'callback_query': callback}) == -9
+    assert chat_id_of({'update_id': 1, 'inline_query': {'from': {'id': 8}}}) == 8
+    assert chat_id_of({'update_id': 1}) is None
@@ -0,0 +1,141 @@
+import json
+
+import pytest
+
+from telegram.core import socket as relay_socket
+from telegram.core.socket import TelegramServiceMessageSocket
+
+
+class _FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+    def close(self):
+        pass
+
+
+class _Socket(TelegramServiceMessageSocket):
+    """
+    Socket whose frames are fed by the test instead of a relay server.
+    """
+
+    def _setup_socket(self):
+        self.ws = _FakeWebSocket()
+        self.ready.set()
+
+    def acks(self):
+        return [
+            message['content']['seq'] for message in self.ws.sent if message['type'] == 'ack'
+        ]
+
+
+class _Callback:
+    def __init__(self):
+        self.updates = []
+        self.refuse = set()
+
+    def __call__(self, update):
+        if update['update_id'] in self.refuse:
+            self.refuse.discard(update['update_id'])
+            return False
+        self.updates.append(update['update_id'])
+        return True
+
+
+def _packet(seq):
+    return {'type': 'new_packet', 'content': {'update_id': seq}, 'seq': seq}
+
+
+def _batch(*seqs):
+    return json.dumps({'type': 'batch', 'content': [_packet(seq) for seq in seqs]})
+
+
+@pytest.fixture
+def callback():
+    return _Callback()
+
+
+@pytest.fixture
+def sock(callback, monkeypatch):
+    # Replays are asked for by the tests themselves
+    monkeypatch.setattr(relay_socket, 'REPLAY_DELAY', 60)
+    sock = _Socket('https://relay.example.com', 443, callback)
+    yield sock
+    if sock._replay_timer is not None:
+        sock._replay_timer.cancel()
+
+
+def test_packets_are_acknowledged_cumulatively(sock, callback):
+    sock._on_frame(json.dumps(_packet(1)))
+    sock._on_frame(_batch(2, 3, 4))
+    assert callback.updates == [1, 2, 3, 4]
+    assert sock.acks() == [1, 4]
+
+
+def test_replayed_packets_are_handled_once(sock, callback):
+    sock._on_frame(_batch(1, 2))
+    # Reconnected before the ack arrived, the server replays from 1
+    sock._on_frame(json.dumps(_packet(1)))
+    sock._on_frame(_batch(2, 3))
+    assert callback.updates == [1, 2, 3]
+    assert sock.acks() == [2, 3]
+
+
+def test_restarted_server_numbers_packets_again(sock, callback):
+    sock._on_frame(_batch(1, 2))
+    sock._on_frame(json.dumps({'type': 'conn_success', 'content': {}}))
+    sock._on_frame(json.dumps({'type': 'new_packet', 'content': {'update_id': 10}, 'seq': 1}))
+    assert callback.updates == [1, 2, 10]
+    assert sock.acks() == [2, 1]
+
+
+def test_refused_packet_and_later_ones_wait_for_the_replay(sock, callback):
+    callback.refuse = {3}
+    sock._on_frame(_batch(1, 2, 3, 4))
+    sock._on_frame(json.dumps(_packet(5)))
+    assert callback.updates == [1, 2]
+    assert sock.acks() == [2]
+    assert sock._replay_timer is not None
+    # The replay brings everything unacknowledged back in order
+    sock._on_frame(_batch(3, 4, 5))
+    assert callback.updates == [1, 2, 3, 4, 5]
+    assert sock.acks() == [2, 5]
+
+
+def test_packet_failing_in_the_manager_is_acknowledged(sock):
+    def fail(update):
+        raise ValueError('boom')
+
+    sock.message_callback = fail
+    sock._on_frame(_batch(1, 2))
+    assert sock.acks() == [2]
+
+
+def test_world_alive_offers_the_codecs_available(sock, monkeypatch):
+    has_msgpack = relay_socket.msgpack is not None
+    sock._send_world_alive()
+    monkeypatch.setattr(relay_socket, 'msgpack', None)
+    sock._send_world_alive()
+    offers = [message['content'] for message in sock.ws.sent if message['type'] == 'world_alive']
+    assert offers[0]['codecs'] == (['msgpack', 'json'] if has_msgpack else ['json'])
+    assert offers[1]['codecs'] == ['json']
+    assert all(offer['batching'] for offer in offers)
+
+
+def test_json_batch_is_acknowledged_once(sock, callback):
+    sock._on_frame(_batch(1, 2, 3))
+    sock._on_frame(_batch(4, 5))
+    assert callback.updates == [1, 2, 3, 4, 5]
+    assert sock.acks() == [3, 5]
+
+
+def test_msgpack_batch_is_acknowledged_once(sock, callback):
+    msgpack = pytest.importorskip('msgpack')
+    batch = {'type': 'batch', 'content': [_packet(seq) for seq in (1, 2, 3)]}
+    sock._on_frame(msgpack.packb(batch))
+    sock._on_frame(msgpack.packb(_packet(4)))
+    assert callback.updates == [1, 2, 3, 4]
+    assert sock.acks() == [3, 4]
@@ -0,0 +1,151 @@
+from concurrent.futures import Future
+
+import pytest
+
+from telegram.core.streaming import StreamingReply
+from telegram.message_sender import TelegramAPIError, split_text
+
+
+class _FakeSender:
+    """
+    Records sends and edits, leaving their futures for the test to resolve.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.next_id = 1
+
+    def send_message_async(self, chat_id, text):
+        return self._call('send', None, text)
+
+    def edit_message_text_async(self, chat_id, message_id, text):
+        return self._call('edit', message_id, text)
+
+    def _call(self, method, message_id, text):
+        future = Future()
+        self.calls.append((method, message_id, text, future))
+        return future
+
+    def complete(self, error=None):
+        """
+        Resolve the oldest unresolved call.
+        """
+        method, message_id, text, future = next(
+            call for call in self.calls if not call[3].done()
+        )
+        if error is not None:
+            future.set_exception(error)
+            return
+        if message_id is None:
+            message_id = self.next_id
+            self.next_id += 1
+        future.set_result({'message_id': message_id, 'text': text})
+
+    def texts(self):
+        return [(method, text) for method, _, text, _ in self.calls]
+
+
+def test_split_text_prefers_line_then_word_breaks():
+    assert split_text('short', 10) == ['short']
+    assert split_text('one two three four', 10) == ['one two ', 'three four']
+    assert split_text('one two\nthree four', 12) == ['one two\n', 'three four']
+
+
+def test_split_text_cuts_long_words_at_the_limit():
+    text = 'a' * 25
+    assert split_text(text, 10) == ['a' * 10, 'a' * 10, 'a' * 5]
+
+
+def test_split_text_chunks_join_back_to_text():
+    text = ' '.join(f'word{index}' for index in range(3000))
+    chunks = split_text(text)
+    assert ''.join(chunks) == text
+    assert all(len(chunk) <= 4096 for chunk in chunks)
+
+
+def test_edits_are_coalesced_while_one_is_in_flight():
+    sender = _FakeSender()
+    reply = StreamingReply(sender, 1)
+    reply.append('Hello')
+    for piece in (' there', ',', ' how', ' are', ' you'):
+        reply.append(piece)
+    assert sender.texts() == [('send', 'Hello')]
+    sender.complete()
+    # Everything that arrived meanwhile goes into one edit
+    assert sender.texts() == [('send', 'Hello'), ('edit', 'Hello there, how are you')]
+    done = reply.finish('Hello there, how are you?')
+    sender.complete()
+    sender.complete()
+    assert sender.texts()[-1] == ('edit', 'Hello there, how are you?')
+    assert done.result(timeout=1)['text'] == 'Hello there, how are you?'
+    assert len(reply.messages) == 1
+
+
+def test_text_beyond_the_limit_rolls_over_to_a_new_message():
+    sender = _FakeSender()
+    reply = StreamingReply(sender, 1, limit=12)
+    reply.append('one')
+    sender.complete()
+    reply.append(' two three four')
+    done = reply.finish()
+    while any(not call[3].done() for call in sender.calls):
+        sender.complete()
+    assert sender.texts() == [('send', 'one'), ('edit', 'one two '), ('send', 'three four')]
+    assert [message['message_id'] for message in reply.messages] == [1, 2]
+    assert done.result(timeout=1)['text'] == 'three four'
+
+
+def test_roll_over_skips_an_edit_only_adding_whitespace():
+    sender = _FakeSender()
+    reply = StreamingReply(sender, 1, limit=12)
+    reply.append('one two')
+    sender.complete()
+    reply.append(' three four')
+    sender.complete()
+    assert sender.texts() == [('send', 'one two'), ('send', 'three four')]
+
+
+def test_trailing_whitespace_is_not_sent_as_an_edit():
+    sender = _FakeSender()
+    reply = StreamingReply(sender, 1)
+    reply.append('Hello')
+    sender.complete()
+    reply.append(' ')
+    reply.append('\n')
+    assert sender.texts() == [('send', 'Hello')]
+    assert reply.finish().result(timeout=1)['text'] == 'Hello'
+
+
+def test_not_modified_edit_counts_as_sent():
+    sender = _FakeSender()
+    reply = StreamingReply(sender, 1)
+    reply.append('Hello')
+    sender.complete()
+    reply.append(' world')
+    sender.complete(TelegramAPIError('Bad Request: message is not modified', 400))
+    done = reply.finish('Hello world!')
+    sender.complete()
+    assert sender.texts()[-1] == ('edit', 'Hello world!')
+    assert done.result(timeout=1)['text'] == 'Hello world!'
+
+
+def test_failed_send_stops_the_reply_without_raising():
+    sender = _FakeSender()
+    reply = StreamingReply(sender, 1)
+    reply.append('Hello')
+    reply.append(' world')
+    sender.complete(TelegramAPIError('Forbidden: bot was blocked by the user', 403))
+    reply.append(', more')
+    reply.update('Hello world, more text')
+    done = reply.finish('Hello world, more text.')
+    assert sender.texts() == [('send', 'Hello')]
+    with pytest.raises(TelegramAPIError):
+        done.result(timeout=1)
+
+
+def test_update_after_finish_is_an_error():
+    sender = _FakeSender()
+    reply = StreamingReply(sender, 1)
+    reply.finish('Hello')
+    with pytest.raises(RuntimeError):
+        reply.append(' world')
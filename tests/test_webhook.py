@@ -0,0 +1,129 @@
+import http.client
+import json
+import socket
+
+import pytest
+
+from telegram.core.webhook import MAX_BODY_BYTES, SECRET_TOKEN_HEADER, TelegramWebhookReceiver
+
+SECRET = 'secret-token'
+
+
+class _Callback:
+    def __init__(self):
+        self.updates = []
+        self.accept = True
+
+    def __call__(self, update):
+        self.updates.append(update)
+        return self.accept
+
+
+@pytest.fixture
+def callback():
+    return _Callback()
+
+
+@pytest.fixture
+def receiver(callback):
+    receiver = TelegramWebhookReceiver('127.0.0.1', 0, callback, secret_token=SECRET)
+    yield receiver
+    receiver.keep_running = False
+    receiver.listen_thread.join(5)
+
+
+def _post(connection, body, token=SECRET, path='/webhook'):
+    headers = {'Content-Type': 'application/json'}
+    if token is not None:
+        headers[SECRET_TOKEN_HEADER] = token
+    connection.request('POST', path, body=body, headers=headers)
+    response = connection.getresponse()
+    response.read()
+    return response
+
+
+def _connect(receiver):
+    return http.client.HTTPConnection('127.0.0.1', receiver.port, timeout=5)
+
+
+def test_update_is_handed_to_callback(receiver, callback):
+    connection = _connect(receiver)
+    response = _post(connection, json.dumps({'update_id': 1}))
+    assert response.status == 200
+    assert callback.updates == [{'update_id': 1}]
+
+
+def test_wrong_or_missing_secret_token_is_forbidden(receiver, callback):
+    connection = _connect(receiver)
+    assert _post(connection, '{"update_id": 1}', token='wrong').status == 403
+    assert _post(connection, '{"update_id": 1}', token=None).status == 403
+    # Not ASCII, still just refused
+    headers = {SECRET_TOKEN_HEADER: 'sécret'.encode('utf-8').decode('latin-1')}
+    connection.request('POST', '/webhook', body='{}', headers=headers)
+    assert connection.getresponse().status == 403
+    assert callback.updates == []
+
+
+def test_body_that_is_not_an_object_is_a_bad_request(receiver, callback):
+    connection = _connect(receiver)
+    assert _post(connection, 'not json').status == 400
+    assert _post(connection, '[1, 2]').status == 400
+    assert _post(connection, '"update"').status == 400
+    assert callback.updates == []
+
+
+def test_refused_update_is_unavailable(receiver, callback):
+    callback.accept = False
+    connection = _connect(receiver)
+    assert _post(connection, '{"update_id": 1}').status == 503
+
+
+def test_wrong_path_and_method(receiver):
+    connection = _connect(receiver)
+    assert _post(connection, '{}', path='/other').status == 404
+    connection.request('GET', '/webhook')
+    response = connection.getresponse()
+    response.read()
+    assert response.status == 405
+
+
+def test_keep_alive_serves_several_updates_on_one_connection(receiver, callback):
+    connection = _connect(receiver)
+    for update_id in range(3):
+        response = _post(connection, json.dumps({'update_id': update_id}))
+        assert response.status == 200
+        assert response.getheader('Connection') == 'keep-alive'
+        if update_id == 0:
+            sock = connection.sock
+        # http.client reconnects silently, so check it kept the socket
+        assert connection.sock is sock
+    assert [update['update_id'] for update in callback.updates] == [0, 1, 2]
+
+
+def test_connection_close_is_honoured(receiver):
+    connection = _connect(receiver)
+    connection.request(
+        'POST', '/webhook', body='{}', headers={SECRET_TOKEN_HEADER: SECRET, 'Connection': 'close'}
+    )
+    response = connection.getresponse()
+    assert response.getheader('Connection') == 'close'
+
+
+def test_oversized_body_is_refused_without_reading_it(receiver, callback):
+    with socket.create_connection(('127.0.0.1', receiver.port), timeout=5) as sock:
+        sock.sendall(
+            (
+                f'POST /webhook HTTP/1.1\r\n'
+                f'{SECRET_TOKEN_HEADER}: {SECRET}\r\n'
+                f'Content-Length: {MAX_BODY_BYTES + 1}\r\n\r\n'
+            ).encode('latin-1')
+        )
+        response = b''
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                break
+            response += data
+    assert response.startswith(b'HTTP/1.1 413 ')
+    assert b'Connection: close' in response
+    assert callback.updates == []